@@ -0,0 +1,48 @@
+"""
+Benchmark dell'individuazione delle funzioni C (find_c_function_definitions) su file
+generati di dimensione crescente. Uso: python benchmarks/bench_c_analysis.py
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from grading.c_analysis import find_c_function_definitions  # noqa: E402
+
+
+def genera_codice_c(numero_funzioni, righe_per_funzione=10):
+    """Genera un file C con numero_funzioni funzioni, con commenti, stringhe e graffe annidate."""
+    parti = ["#include <stdio.h>\n", "#define BLOCCO(x) { (x); }\n", "int globale[] = {1, 2, 3};\n"]
+    for i in range(numero_funzioni):
+        parti.append(f"/* funzione {i} {{ */\nint\nfunzione_{i}(int a,\n           int b)\n{{\n")
+        for j in range(righe_per_funzione):
+            parti.append(f'    if (a > {j}) {{ printf("}} %d\\n", a); }} // {{\n')
+        chiamata = f"funzione_{i - 1}(a, b)" if i else "0"
+        parti.append(f"    return {chiamata};\n}}\n\n")
+    return "".join(parti)
+
+
+def misura(funzione, *argomenti, ripetizioni=3):
+    migliore = float("inf")
+    for _ in range(ripetizioni):
+        inizio = time.perf_counter()
+        risultato = funzione(*argomenti)
+        migliore = min(migliore, time.perf_counter() - inizio)
+    return migliore, risultato
+
+
+def main():
+    # La versione non memorizzata, per misurare l'analisi e non la cache
+    trova_funzioni = find_c_function_definitions.__wrapped__
+    print(f"{'functions':>10} {'lines':>8} {'time (ms)':>10} {'us/line':>8}")
+    for numero_funzioni in (50, 200, 500, 1000, 1500):
+        codice = genera_codice_c(numero_funzioni)
+        righe = codice.count("\n")
+        tempo, funzioni = misura(trova_funzioni, codice)
+        assert len(funzioni) == numero_funzioni, (len(funzioni), numero_funzioni)
+        print(f"{numero_funzioni:>10} {righe:>8} {tempo * 1000:>10.1f} {tempo * 1e6 / righe:>8.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,176 @@
+"""
+Benchmark end-to-end della correzione di una classe contro il server finto (benchmarks/server_finto.py):
+per ogni consegna passa da correggi_codici_in_parallelo all'estrazione del JSON, a evidenzia_errori_json
+e al calcolo dei punteggi (elabora_risposta_llm), come la pagina di correzione e la CLI.
+Riporta consegne al secondo, latenza p50/p99 delle chiamate e dell'elaborazione locale, e memoria.
+Uso: python benchmarks/bench_correzione.py --studenti 200 --max-workers 8 --latenza 0.5 --passaggi 2 --cache
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import resource
+import tempfile
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from grading.cache import CacheRisposteLLM  # noqa: E402
+from grading.deduplica import raggruppa_duplicati  # noqa: E402
+from grading.llm import crea_client, correggi_codici_in_parallelo  # noqa: E402
+from grading.metrics import RegistroChiamate, _percentile  # noqa: E402
+from grading.parsing import statistiche_riparazione_json  # noqa: E402
+from grading.pipeline import elabora_risposta_llm  # noqa: E402
+from grading.resilienza import PoliticaChiamate  # noqa: E402
+
+from server_finto import ConfigurazioneServerFinto, ServerFinto  # noqa: E402
+
+MODELLO_BENCHMARK = "finto/modello"
+
+
+def genera_consegna(casuale, numero_funzioni, righe_per_funzione):
+    """Una consegna C con numero_funzioni funzioni d'esame (funzione_0, ...) e nomi di variabili casuali."""
+    parti = ["#include <stdio.h>\n#include <stdlib.h>\n\n"]
+    for i in range(numero_funzioni):
+        indice, accumulatore = casuale.choice(("i", "k", "idx", "pos")), casuale.choice(("s", "tot", "acc", "somma"))
+        parti.append(f"int funzione_{i}(int *v, int n) {{\n    int {accumulatore} = 0;\n")
+        parti.append(f"    for (int {indice} = 0; {indice} < n; {indice}++) {{\n")
+        for j in range(righe_per_funzione):
+            parti.append(f"        if (v[{indice}] > {casuale.randint(0, 99)}) {accumulatore} += v[{indice}] * {j + 1};\n")
+        parti.append(f"    }}\n    return {accumulatore};\n}}\n\n")
+    parti.append("int main(void) {\n    int v[] = {1, 2, 3};\n")
+    for i in range(numero_funzioni):
+        parti.append(f'    printf("%d\\n", funzione_{i}(v, 3));\n')
+    parti.append("    return 0;\n}\n")
+    return "".join(parti)
+
+
+def genera_classe(numero_studenti, numero_funzioni=4, righe_per_funzione=6, quota_duplicati=0.0, seme=0):
+    """
+    Restituisce ({nome_studente: codice}, criteri). Una frazione quota_duplicati delle consegne è la copia,
+    con altri spazi, di una consegna precedente (equivalente per la deduplicazione).
+    """
+    casuale = random.Random(seme)
+    codici = {}
+    for indice in range(numero_studenti):
+        nome = f"Studente_{indice:04d}"
+        if codici and casuale.random() < quota_duplicati:
+            codici[nome] = casuale.choice(list(codici.values())).replace("    ", "\t")
+        else:
+            codici[nome] = genera_consegna(casuale, numero_funzioni, righe_per_funzione)
+    criteri = "".join(f"funzione_{i}: {casuale.choice((2, 3, 5))}\n" for i in range(numero_funzioni))
+    return codici, criteri
+
+
+def esegui_passaggio(codici, criteri, client, cache, politica, max_workers, deduplica):
+    """Corregge tutta la classe una volta e restituisce le misure del passaggio."""
+    registro = RegistroChiamate()
+    gruppi = raggruppa_duplicati(codici) if deduplica else None
+    tempi_elaborazione = []
+    errori = 0
+    inizio = time.perf_counter()
+    for nome_studente, contenuto, errore, _ in correggi_codici_in_parallelo(
+        codici, criteri, None, MODELLO_BENCHMARK, client, max_workers=max_workers,
+        cache=cache, registro=registro, politica=politica, gruppi=gruppi
+    ):
+        if errore:
+            errori += 1
+            continue
+        inizio_elaborazione = time.perf_counter()
+        risultato = elabora_risposta_llm(codici[nome_studente], contenuto, criteri)
+        tempi_elaborazione.append(time.perf_counter() - inizio_elaborazione)
+        if risultato["errore"]:
+            errori += 1
+    durata = time.perf_counter() - inizio
+    totali = registro.sessione()
+    return {
+        "consegne": len(codici),
+        "durata_s": durata,
+        "consegne_al_secondo": len(codici) / durata if durata else None,
+        "chiamate": totali["chiamate"],
+        "risposte_da_cache": totali["risposte_da_cache"],
+        "errori_chiamate": totali["errori"],
+        "consegne_con_errore": errori,
+        "latenza_p50_s": totali["latenza_p50"],
+        "latenza_p99_s": totali["latenza_p99"],
+        "elaborazione_p50_ms": (_percentile(tempi_elaborazione, 50) or 0) * 1000,
+        "elaborazione_p99_ms": (_percentile(tempi_elaborazione, 99) or 0) * 1000,
+    }
+
+
+def costruisci_parser():
+    parser = argparse.ArgumentParser(description="Benchmark end-to-end della correzione contro il server finto.")
+    parser.add_argument("--studenti", type=int, default=100)
+    parser.add_argument("--funzioni", type=int, default=4, help="Funzioni d'esame per consegna")
+    parser.add_argument("--righe-per-funzione", type=int, default=6)
+    parser.add_argument("--quota-duplicati", type=float, default=0.0, help="Frazione di consegne equivalenti a un'altra")
+    parser.add_argument("--max-workers", type=int, default=8)
+    parser.add_argument("--passaggi", type=int, default=1, help="Correzioni ripetute della classe (con --cache: a caldo)")
+    parser.add_argument("--cache", action="store_true", help="Usa una cache delle risposte (in una cartella temporanea)")
+    parser.add_argument("--deduplica", action="store_true", help="Corregge una sola volta le consegne equivalenti")
+    parser.add_argument("--latenza", type=float, default=0.5)
+    parser.add_argument("--dispersione", type=float, default=0.5)
+    parser.add_argument("--distribuzione", choices=("costante", "esponenziale", "lognormale"), default="lognormale")
+    parser.add_argument("--tasso-429", type=float, default=0.0)
+    parser.add_argument("--tasso-errori", type=float, default=0.0)
+    parser.add_argument("--retry-after", type=float, default=0.2)
+    parser.add_argument("--tasso-json-malformato", type=float, default=0.0)
+    parser.add_argument("--timeout", type=float, default=30.0)
+    parser.add_argument("--hedging", action="store_true")
+    parser.add_argument("--tracemalloc", action="store_true",
+                        help="Misura anche il picco di memoria Python allocata (rallenta l'esecuzione)")
+    parser.add_argument("--seme", type=int, default=0)
+    parser.add_argument("--json", action="store_true", help="Stampa i risultati in JSON")
+    return parser
+
+
+def main(argv=None):
+    args = costruisci_parser().parse_args(argv)
+    codici, criteri = genera_classe(args.studenti, args.funzioni, args.righe_per_funzione, args.quota_duplicati, args.seme)
+    config = ConfigurazioneServerFinto(
+        latenza=args.latenza, dispersione=args.dispersione, distribuzione=args.distribuzione,
+        tasso_429=args.tasso_429, tasso_errori=args.tasso_errori, retry_after=args.retry_after,
+        tasso_json_malformato=args.tasso_json_malformato, seme=args.seme
+    )
+    politica = PoliticaChiamate(timeout=args.timeout, hedging=args.hedging, attesa_base=0.1)
+
+    if args.tracemalloc:
+        tracemalloc.start()
+    risultati = []
+    with tempfile.TemporaryDirectory() as cartella, ServerFinto(config) as server:
+        client = crea_client("chiave-finta", server.base_url)
+        cache = CacheRisposteLLM(os.path.join(cartella, "cache.db")) if args.cache else None
+        for _ in range(args.passaggi):
+            risultati.append(esegui_passaggio(codici, criteri, client, cache, politica, args.max_workers, args.deduplica))
+        richieste_server = dict(server.richieste)
+    memoria = {
+        # ru_maxrss è in KB su Linux e in byte su macOS
+        "rss_massimo_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (1024 * 1024 if sys.platform == "darwin" else 1024),
+        "picco_python_mb": tracemalloc.get_traced_memory()[1] / (1024 * 1024) if args.tracemalloc else None,
+    }
+
+    if args.json:
+        print(json.dumps({
+            "passaggi": risultati, "memoria": memoria, "richieste_server": richieste_server,
+            "riparazioni_json": statistiche_riparazione_json(),
+        }, indent=2))
+        return 0
+    print(f"{'pass':>4} {'subm/s':>8} {'time (s)':>9} {'calls':>6} {'cached':>6} {'errors':>6} "
+          f"{'p50 (s)':>8} {'p99 (s)':>8} {'proc p50 (ms)':>13} {'proc p99 (ms)':>13}")
+    for numero, r in enumerate(risultati, start=1):
+        def secondi(valore):
+            return f"{valore:.3f}" if valore is not None else "-"
+        print(f"{numero:>4} {r['consegne_al_secondo']:>8.1f} {r['durata_s']:>9.2f} {r['chiamate']:>6} "
+              f"{r['risposte_da_cache']:>6} {r['consegne_con_errore']:>6} {secondi(r['latenza_p50_s']):>8} "
+              f"{secondi(r['latenza_p99_s']):>8} {r['elaborazione_p50_ms']:>13.2f} {r['elaborazione_p99_ms']:>13.2f}")
+    print(f"Server responses by status: {richieste_server}")
+    print(f"Max RSS: {memoria['rss_massimo_mb']:.1f} MB" + (
+        f", peak Python allocations: {memoria['picco_python_mb']:.1f} MB" if memoria["picco_python_mb"] is not None else ""
+    ))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
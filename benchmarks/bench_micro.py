@@ -0,0 +1,275 @@
+"""
+Micro-benchmark delle funzioni sul percorso critico dell'analisi e del punteggio
+(evidenzia_errori_json, ricostruisci_errori_da_testo_commentato, find_c_function_definitions,
+build_call_map, find_main_caller, parse_criteria_function_scores) su input sintetici di dimensione
+crescente: file C da 50 a 20000 righe, file con centinaia di funzioni, catene profonde di funzioni
+ausiliarie, liste di migliaia di annotazioni.
+Per ogni caso misura il tempo (mediana di N campioni) e il picco di memoria allocata (tracemalloc,
+in un'esecuzione a parte), e li confronta con benchmarks/baseline_micro.json: termina con codice 1 se
+un caso supera la baseline oltre la tolleranza.
+Ogni campione è preceduto da un ciclo di riferimento in Python puro: il confronto col tempo della baseline
+usa il rapporto tra i due, che resta stabile anche quando la velocità della macchina (carico, frequenza
+della CPU, macchine virtuali condivise) cambia durante l'esecuzione. Un caso che sembra regredito viene
+rimisurato (--conferme) ed è segnalato solo se lo resta in ogni misura.
+Uso: python benchmarks/bench_micro.py [--casi find_c] [--aggiorna-baseline]
+Le baseline dipendono dalla macchina: vanno rigenerate con --aggiorna-baseline quando si cambia ambiente.
+"""
+import os
+import sys
+import json
+import time
+import random
+import statistics
+import argparse
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from grading.c_analysis import find_c_function_definitions, build_call_map, find_main_caller  # noqa: E402
+from grading.parsing import evidenzia_errori_json, ricostruisci_errori_da_testo_commentato  # noqa: E402
+from grading.scoring import parse_criteria_function_scores  # noqa: E402
+
+from bench_c_analysis import genera_codice_c  # noqa: E402
+
+PERCORSO_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline_micro.json")
+
+# Regressione: tempo o memoria oltre la baseline di più della tolleranza relativa...
+TOLLERANZA_TEMPO = 0.5
+TOLLERANZA_MEMORIA = 0.25
+# ...e di più di questi valori assoluti, così il rumore sui casi molto veloci non fa fallire il confronto
+SOGLIA_TEMPO_MS = 2.0
+SOGLIA_MEMORIA_KB = 64
+
+RIPETIZIONI_PREDEFINITE = 9
+CONFERME_PREDEFINITE = 2
+# Ogni campione ripete la chiamata finché dura almeno tanto (secondi), come timeit.autorange:
+# sui casi da pochi microsecondi un'unica chiamata misurerebbe soprattutto il rumore del timer
+DURATA_MINIMA_CAMPIONE = 0.02
+
+RIGHE_PER_FUNZIONE = 10
+RIGHE_PER_FUNZIONE_GENERATA = RIGHE_PER_FUNZIONE + 8  # Firma, graffe, return e riga vuota di genera_codice_c
+
+
+def codice_di_righe(righe):
+    """File C di circa righe righe (funzioni da RIGHE_PER_FUNZIONE righe di corpo, ognuna chiama la precedente)."""
+    return genera_codice_c(max(1, righe // RIGHE_PER_FUNZIONE_GENERATA), RIGHE_PER_FUNZIONE)
+
+
+def genera_errori_json(codice, numero_errori, seme=0):
+    """Array JSON di numero_errori annotazioni nel formato dell'LLM, su righe casuali del codice."""
+    casuale = random.Random(seme)
+    righe = codice.count("\n") + 1
+    errori = []
+    for indice in range(numero_errori):
+        punti = -0.5 * casuale.randint(1, 6)
+        criterio = f"Criterion {indice % 37} violated in branch {indice}"
+        errori.append({
+            "line": str(casuale.randint(1, righe)),
+            "criteria": criterio,
+            "point_deduction": punti,
+            "inline_comment": f"//******** {criterio} {punti:g}",
+        })
+    return json.dumps(errori)
+
+
+def genera_criteri(numero_funzioni):
+    """Testo dei criteri con numero_funzioni punteggi nei due formati accettati, intervallati da righe descrittive."""
+    righe = []
+    for indice in range(numero_funzioni):
+        if indice % 2:
+            righe.append(f"funzione_{indice}: {indice % 7 + 1}.5  # commento")
+        else:
+            righe.append(f"funzione_{indice} ({indice % 5 + 1} pt)..........")
+        righe.append(f"  - the function must handle case {indice} without reading past the end of the array")
+    return "\n".join(righe)
+
+
+def casi_benchmark():
+    """
+    Restituisce la lista dei casi: (nome, preparazione), dove preparazione() restituisce (funzione, argomenti).
+    Le funzioni memorizzate per contenuto vengono misurate nella versione originale (__wrapped__).
+    """
+    casi = []
+    for righe in (50, 500, 5000, 20000):
+        casi.append((f"find_c_function_definitions/{righe}_righe",
+                     lambda righe=righe: (find_c_function_definitions.__wrapped__, (codice_di_righe(righe),))))
+
+    def prepara_centinaia_di_funzioni():
+        return find_c_function_definitions.__wrapped__, (genera_codice_c(800, 2),)
+    casi.append(("find_c_function_definitions/800_funzioni", prepara_centinaia_di_funzioni))
+
+    for righe in (500, 5000, 20000):
+        def prepara_call_map(righe=righe):
+            codice = codice_di_righe(righe)
+            return build_call_map, (codice, find_c_function_definitions.__wrapped__(codice))
+        casi.append((f"build_call_map/{righe}_righe", prepara_call_map))
+
+    for profondita in (100, 1000, 3000):
+        def prepara_catena(profondita=profondita):
+            # In genera_codice_c ogni funzione chiama la precedente: funzione_0 è in fondo alla catena
+            codice = genera_codice_c(profondita, 1)
+            call_map = build_call_map(codice, find_c_function_definitions.__wrapped__(codice))
+            return find_main_caller, ("funzione_0", call_map, [f"funzione_{profondita - 1}"])
+        casi.append((f"find_main_caller/catena_{profondita}", prepara_catena))
+
+    for righe, numero_errori in ((500, 50), (5000, 1000), (20000, 5000)):
+        def prepara_evidenzia(righe=righe, numero_errori=numero_errori):
+            codice = codice_di_righe(righe)
+            return evidenzia_errori_json, (codice, genera_errori_json(codice, numero_errori))
+        casi.append((f"evidenzia_errori_json/{righe}_righe_{numero_errori}_errori", prepara_evidenzia))
+
+        def prepara_ricostruisci(righe=righe, numero_errori=numero_errori):
+            codice = codice_di_righe(righe)
+            codice_annotato = evidenzia_errori_json(codice, genera_errori_json(codice, numero_errori))[0]
+            return ricostruisci_errori_da_testo_commentato.__wrapped__, (codice_annotato,)
+        casi.append((f"ricostruisci_errori/{righe}_righe_{numero_errori}_errori", prepara_ricostruisci))
+
+    for numero_funzioni in (50, 1000, 10000):
+        casi.append((f"parse_criteria_function_scores/{numero_funzioni}_funzioni",
+                     lambda numero_funzioni=numero_funzioni: (
+                         parse_criteria_function_scores.__wrapped__, (genera_criteri(numero_funzioni),))))
+    return casi
+
+
+def ciclo_riferimento():
+    """Lavoro fisso in Python puro, per stimare la velocità della macchina nell'istante del campione."""
+    totale = 0
+    for indice in range(50000):
+        totale += indice * indice % 7
+    return totale
+
+
+def _cronometra(funzione, argomenti, chiamate):
+    inizio = time.perf_counter()
+    for _ in range(chiamate):
+        funzione(*argomenti)
+    return (time.perf_counter() - inizio) / chiamate
+
+
+def misura_tempo(funzione, argomenti, ripetizioni):
+    """
+    Restituisce (secondi per chiamata, secondi del ciclo di riferimento): le mediane di ripetizioni
+    campioni, dopo una chiamata di riscaldamento. Ogni campione misura il ciclo di riferimento e subito
+    dopo la funzione, ripetuta quanto basta a durare almeno DURATA_MINIMA_CAMPIONE.
+    """
+    funzione(*argomenti)
+    chiamate = 1
+    while _cronometra(funzione, argomenti, chiamate) * chiamate < DURATA_MINIMA_CAMPIONE:
+        chiamate *= 2
+    tempi, riferimenti = [], []
+    for _ in range(max(1, ripetizioni)):
+        riferimenti.append(_cronometra(ciclo_riferimento, (), 1))
+        tempi.append(_cronometra(funzione, argomenti, chiamate))
+    rapporto = statistics.median(tempo / riferimento for tempo, riferimento in zip(tempi, riferimenti))
+    riferimento = statistics.median(riferimenti)
+    # Il tempo riportato è coerente col rapporto: quello atteso alla velocità mediana del campione
+    return rapporto * riferimento, riferimento
+
+
+def misura_memoria(funzione, argomenti):
+    """Picco di memoria allocata durante una chiamata (esclusi gli argomenti, già allocati)."""
+    tracemalloc.start()
+    try:
+        tracemalloc.reset_peak()
+        prima = tracemalloc.get_traced_memory()[0]
+        funzione(*argomenti)
+        return tracemalloc.get_traced_memory()[1] - prima
+    finally:
+        tracemalloc.stop()
+
+
+def tempo_atteso_ms(misura, baseline):
+    """
+    Tempo della baseline riportato alla velocità della macchina durante la misura: la baseline salva
+    anche il ciclo di riferimento (quelle più vecchie no, e si confrontano i tempi assoluti).
+    """
+    if not baseline.get("riferimento_ms") or not misura.get("riferimento_ms"):
+        return baseline["tempo_ms"]
+    return baseline["tempo_ms"] * misura["riferimento_ms"] / baseline["riferimento_ms"]
+
+
+def confronta(misura, baseline, tolleranza_tempo, tolleranza_memoria):
+    """Elenco delle regressioni di misura rispetto alla baseline del caso (vuoto se nessuna)."""
+    if baseline is None:
+        return []
+    regressioni = []
+    atteso = tempo_atteso_ms(misura, baseline)
+    limite_tempo = atteso * (1 + tolleranza_tempo)
+    if misura["tempo_ms"] > limite_tempo and misura["tempo_ms"] - atteso > SOGLIA_TEMPO_MS:
+        regressioni.append(f"time {misura['tempo_ms']:.2f} ms > {limite_tempo:.2f} ms")
+    limite_memoria = baseline["memoria_kb"] * (1 + tolleranza_memoria)
+    if misura["memoria_kb"] > limite_memoria and misura["memoria_kb"] - baseline["memoria_kb"] > SOGLIA_MEMORIA_KB:
+        regressioni.append(f"memory {misura['memoria_kb']:.0f} KB > {limite_memoria:.0f} KB")
+    return regressioni
+
+
+def costruisci_parser():
+    parser = argparse.ArgumentParser(description="Micro-benchmark delle funzioni di analisi e punteggio.")
+    parser.add_argument("--casi", help="Esegue solo i casi il cui nome contiene questo testo")
+    parser.add_argument("--ripetizioni", type=int, default=RIPETIZIONI_PREDEFINITE,
+                        help="Campioni di tempo per caso (se ne usa la mediana)")
+    parser.add_argument("--conferme", type=int, default=CONFERME_PREDEFINITE,
+                        help="Nuove misure di un caso che sembra regredito, prima di segnalarlo")
+    parser.add_argument("--baseline", default=PERCORSO_BASELINE)
+    parser.add_argument("--aggiorna-baseline", action="store_true",
+                        help="Salva i risultati come nuova baseline (solo i casi eseguiti) invece di confrontarli")
+    parser.add_argument("--tolleranza-tempo", type=float, default=TOLLERANZA_TEMPO)
+    parser.add_argument("--tolleranza-memoria", type=float, default=TOLLERANZA_MEMORIA)
+    return parser
+
+
+def main(argv=None):
+    args = costruisci_parser().parse_args(argv)
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+
+    risultati = {}
+    regressioni_totali = 0
+    print(f"{'case':<58} {'time (ms)':>10} {'expected':>10} {'peak (KB)':>10} {'base':>10}  status")
+    for nome, preparazione in casi_benchmark():
+        if args.casi and args.casi not in nome:
+            continue
+        funzione, argomenti = preparazione()
+        tempo, tempo_riferimento = misura_tempo(funzione, argomenti, args.ripetizioni)
+        misura = {
+            "tempo_ms": tempo * 1000,
+            "riferimento_ms": tempo_riferimento * 1000,
+            "memoria_kb": misura_memoria(funzione, argomenti) / 1024,
+        }
+        risultati[nome] = misura
+        riferimento = baseline.get(nome)
+        regressioni = [] if args.aggiorna_baseline else confronta(
+            misura, riferimento, args.tolleranza_tempo, args.tolleranza_memoria
+        )
+        # Una regressione di tempo deve ripresentarsi in ogni nuova misura: un picco di carico non basta
+        for _ in range(args.conferme if regressioni else 0):
+            tempo, tempo_riferimento = misura_tempo(funzione, argomenti, args.ripetizioni)
+            if tempo / tempo_riferimento < misura["tempo_ms"] / misura["riferimento_ms"]:
+                misura.update(tempo_ms=tempo * 1000, riferimento_ms=tempo_riferimento * 1000)
+            regressioni = confronta(misura, riferimento, args.tolleranza_tempo, args.tolleranza_memoria)
+            if not regressioni:
+                break
+        regressioni_totali += bool(regressioni)
+        stato = "REGRESSION: " + "; ".join(regressioni) if regressioni else ("ok" if riferimento else "no baseline")
+        print(f"{nome:<58} {misura['tempo_ms']:>10.2f} "
+              f"{tempo_atteso_ms(misura, riferimento) if riferimento else float('nan'):>10.2f} {misura['memoria_kb']:>10.0f} "
+              f"{riferimento['memoria_kb'] if riferimento else float('nan'):>10.0f}  {stato}")
+
+    if args.aggiorna_baseline:
+        baseline.update({nome: {chiave: round(valore, 3) for chiave, valore in misura.items()}
+                         for nome, misura in risultati.items()})
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(dict(sorted(baseline.items())), f, indent=2)
+            f.write("\n")
+        print(f"Baseline updated: {args.baseline}")
+        return 0
+    if regressioni_totali:
+        print(f"{regressioni_totali} case(s) regressed past the baseline.", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,269 @@
+"""
+Server locale che imita l'endpoint /chat/completions di OpenRouter (API OpenAI-compatibile), per
+provare e misurare la correzione senza consumare credito. Il client va creato con
+base_url="http://127.0.0.1:<porta>/v1" e una chiave API qualsiasi.
+Uso: python benchmarks/server_finto.py --porta 8765 --latenza 1.5 --dispersione 0.5 --tasso-429 0.05
+
+Le risposte sono array JSON di errori generati in modo deterministico dal codice dello studente
+(stessa consegna, stessa risposta), oppure il contenuto fisso indicato con --risposta.
+"""
+import re
+import sys
+import json
+import math
+import time
+import random
+import hashlib
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Frazione della latenza che precede il primo token nelle risposte in streaming
+QUOTA_PRIMO_TOKEN = 0.3
+
+# Caratteri per frammento nelle risposte in streaming
+CARATTERI_PER_FRAMMENTO = 24
+
+CRITERI_FINTI = (
+    "Missing check on the input parameters",
+    "Loop bound is off by one",
+    "Return value is not checked",
+    "Variable used before initialization",
+)
+
+
+class ConfigurazioneServerFinto:
+    """
+    Comportamento del server finto:
+    - latenza, dispersione, distribuzione: secondi per risposta, estratti da una distribuzione
+      "costante", "esponenziale" (media latenza) o "lognormale" (mediana latenza, sigma dispersione);
+    - tasso_429 / tasso_errori: probabilità di rispondere 429 (con Retry-After: retry_after) o 500;
+    - tasso_json_malformato: probabilità di aggiungere una virgola finale all'array (riparata dal client);
+    - risposta: contenuto fisso da restituire al posto delle risposte generate;
+    - seme: seme del generatore casuale, per esecuzioni ripetibili.
+    """
+
+    def __init__(self, latenza=0.5, dispersione=0.5, distribuzione="lognormale", tasso_429=0.0, tasso_errori=0.0,
+                 retry_after=1.0, tasso_json_malformato=0.0, risposta=None, seme=None):
+        self.latenza = latenza
+        self.dispersione = dispersione
+        self.distribuzione = distribuzione
+        self.tasso_429 = tasso_429
+        self.tasso_errori = tasso_errori
+        self.retry_after = retry_after
+        self.tasso_json_malformato = tasso_json_malformato
+        self.risposta = risposta
+        self.casuale = random.Random(seme)
+        self._lock = threading.Lock()
+
+    def estrai(self):
+        """Estrae (latenza, esito) per una richiesta: esito è 200, 429 o 500."""
+        with self._lock:
+            if self.distribuzione == "costante":
+                latenza = self.latenza
+            elif self.distribuzione == "esponenziale":
+                latenza = self.casuale.expovariate(1 / self.latenza) if self.latenza > 0 else 0.0
+            else:
+                latenza = self.latenza * math.exp(self.casuale.gauss(0, self.dispersione))
+            estrazione = self.casuale.random()
+        if estrazione < self.tasso_429:
+            return latenza, 429
+        if estrazione < self.tasso_429 + self.tasso_errori:
+            return latenza, 500
+        return latenza, 200
+
+
+def genera_risposta(codice, malformata=False, strutturata=False):
+    """
+    Array JSON di 0-3 errori su righe di codice scelte in base all'hash della consegna, in un blocco
+    Markdown come rispondono di solito i modelli (strutturata: oggetto {"errors": [...]}, come con response_format).
+    """
+    righe = [numero for numero, riga in enumerate(codice.split("\n"), start=1) if riga.rstrip().endswith(";")]
+    seme = int(hashlib.sha256(codice.encode("utf-8", "surrogatepass")).hexdigest()[:8], 16)
+    casuale = random.Random(seme)
+    errori = []
+    for _ in range(casuale.randint(0, 3) if righe else 0):
+        criterio = casuale.choice(CRITERI_FINTI)
+        punti = -0.5 * casuale.randint(1, 4)
+        errori.append({
+            "line": str(casuale.choice(righe)),
+            "criteria": criterio,
+            "point_deduction": punti,
+            "inline_comment": f"//******** {criterio} {punti:g}",
+        })
+    if strutturata:
+        return json.dumps({"errors": errori})
+    testo = json.dumps(errori, indent=2)
+    if malformata and errori:
+        testo = testo[:-1].rstrip() + ",\n]"
+    return "```json\n" + testo + "\n```"
+
+
+def _codice_dalla_richiesta(richiesta):
+    messaggi = richiesta.get("messages") or []
+    contenuto = messaggi[-1].get("content", "") if messaggi else ""
+    if isinstance(contenuto, list):
+        contenuto = "".join(parte.get("text", "") for parte in contenuto)
+    match = re.search(r"```c\n([\s\S]*?)\n```", contenuto)
+    return match.group(1) if match else contenuto
+
+
+class _GestoreRichieste(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1" # Connessioni keep-alive, come OpenRouter
+
+    def log_message(self, *argomenti):
+        pass
+
+    def _invia_json(self, stato, corpo, intestazioni=()):
+        dati = json.dumps(corpo).encode("utf-8")
+        self.send_response(stato)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(dati)))
+        for nome, valore in intestazioni:
+            self.send_header(nome, valore)
+        self.end_headers()
+        self.wfile.write(dati)
+
+    def do_POST(self):
+        dati = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self._invia_json(404, {"error": {"message": f"Unknown path {self.path}", "code": 404}})
+            return
+        server = self.server
+        config = server.config
+        richiesta = json.loads(dati or b"{}")
+        modello = richiesta.get("model", "finto/modello")
+        latenza, esito = config.estrai()
+        server.conta(esito)
+
+        if esito != 200:
+            time.sleep(min(latenza, 0.05))
+            messaggio = "Rate limit exceeded" if esito == 429 else "Internal server error"
+            intestazioni = [("Retry-After", f"{config.retry_after:g}")] if esito == 429 else []
+            self._invia_json(esito, {"error": {"message": messaggio, "code": esito}}, intestazioni)
+            return
+
+        if config.risposta is not None:
+            contenuto = config.risposta
+        else:
+            with config._lock:
+                malformata = config.casuale.random() < config.tasso_json_malformato
+            contenuto = genera_risposta(
+                _codice_dalla_richiesta(richiesta), malformata, strutturata=bool(richiesta.get("response_format"))
+            )
+        uso = {
+            "prompt_tokens": len(dati) // 4,
+            "completion_tokens": len(contenuto) // 4,
+            "total_tokens": len(dati) // 4 + len(contenuto) // 4,
+            "prompt_tokens_details": {"cached_tokens": 0},
+        }
+        base = {"id": "chatcmpl-finto", "created": int(time.time()), "model": modello}
+
+        if not richiesta.get("stream"):
+            time.sleep(latenza)
+            self._invia_json(200, dict(base, object="chat.completion", usage=uso, choices=[{
+                "index": 0, "message": {"role": "assistant", "content": contenuto}, "finish_reason": "stop"
+            }]))
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Connection", "close") # La lunghezza non è nota in anticipo
+        self.end_headers()
+        frammenti = [contenuto[i:i + CARATTERI_PER_FRAMMENTO] for i in range(0, len(contenuto), CARATTERI_PER_FRAMMENTO)]
+        time.sleep(latenza * QUOTA_PRIMO_TOKEN)
+        intervallo = latenza * (1 - QUOTA_PRIMO_TOKEN) / max(1, len(frammenti))
+        for indice, frammento in enumerate(frammenti):
+            chunk = dict(base, object="chat.completion.chunk", choices=[{
+                "index": 0, "delta": {"content": frammento},
+                "finish_reason": "stop" if indice == len(frammenti) - 1 else None
+            }])
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+            self.wfile.flush()
+            time.sleep(intervallo)
+        chunk = dict(base, object="chat.completion.chunk", choices=[], usage=uso)
+        self.wfile.write(f"data: {json.dumps(chunk)}\n\ndata: [DONE]\n\n".encode("utf-8"))
+        self.wfile.flush()
+        self.close_connection = True
+
+
+class ServerFinto(ThreadingHTTPServer):
+    """
+    Server finto in ascolto su host:porta (porta 0: scelta dal sistema operativo).
+    Si può usare come context manager: avvia il server in un thread e lo ferma all'uscita.
+    """
+    daemon_threads = True
+
+    def __init__(self, config=None, host="127.0.0.1", porta=0):
+        super().__init__((host, porta), _GestoreRichieste)
+        self.config = config or ConfigurazioneServerFinto()
+        self.richieste = {}
+        self._lock_richieste = threading.Lock()
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, porta = self.server_address[:2]
+        return f"http://{host}:{porta}/v1"
+
+    def conta(self, esito):
+        with self._lock_richieste:
+            self.richieste[esito] = self.richieste.get(esito, 0) + 1
+
+    def avvia(self):
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def ferma(self):
+        self.shutdown()
+        self.server_close()
+
+    def __enter__(self):
+        return self.avvia()
+
+    def __exit__(self, *eccezione):
+        self.ferma()
+
+
+def costruisci_parser():
+    parser = argparse.ArgumentParser(description="Server locale OpenAI-compatibile con latenze ed errori configurabili.")
+    parser.add_argument("--porta", type=int, default=8765)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--latenza", type=float, default=0.5, help="Latenza media/mediana in secondi")
+    parser.add_argument("--dispersione", type=float, default=0.5, help="Sigma della distribuzione lognormale")
+    parser.add_argument("--distribuzione", choices=("costante", "esponenziale", "lognormale"), default="lognormale")
+    parser.add_argument("--tasso-429", type=float, default=0.0, help="Frazione di risposte 429 (rate limit)")
+    parser.add_argument("--tasso-errori", type=float, default=0.0, help="Frazione di risposte 500")
+    parser.add_argument("--retry-after", type=float, default=1.0, help="Secondi indicati nell'header Retry-After delle 429")
+    parser.add_argument("--tasso-json-malformato", type=float, default=0.0,
+                        help="Frazione di risposte con una virgola finale nell'array JSON")
+    parser.add_argument("--risposta", help="File con il contenuto fisso da restituire a ogni richiesta")
+    parser.add_argument("--seme", type=int, help="Seme del generatore casuale")
+    return parser
+
+
+def main(argv=None):
+    args = costruisci_parser().parse_args(argv)
+    risposta = None
+    if args.risposta:
+        with open(args.risposta, "r", encoding="utf-8") as f:
+            risposta = f.read()
+    config = ConfigurazioneServerFinto(
+        latenza=args.latenza, dispersione=args.dispersione, distribuzione=args.distribuzione,
+        tasso_429=args.tasso_429, tasso_errori=args.tasso_errori, retry_after=args.retry_after,
+        tasso_json_malformato=args.tasso_json_malformato, risposta=risposta, seme=args.seme
+    )
+    server = ServerFinto(config, args.host, args.porta)
+    print(f"Fake OpenAI-compatible server listening on {server.base_url}", file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1 @@
+# Moduli di supporto alla correzione automatica, indipendenti dall'interfaccia Streamlit.
@@ -0,0 +1,211 @@
+import os
+import zipfile
+import threading
+from collections import OrderedDict
+from collections.abc import Mapping
+
+# Limite predefinito dei byte di codice decodificato tenuti in memoria per archivio
+MAX_BYTE_RESIDENTI_PREDEFINITO = 16 * 1024 * 1024  # 16 MB
+
+# Codifiche provate in ordine per i sorgenti degli studenti: dopo UTF-8 quella dei file salvati dagli
+# editor Windows; latin-1 decodifica qualsiasi sequenza di byte, quindi la lettura non fallisce mai
+CODIFICHE_CODICE = ("utf-8", "cp1252", "latin-1")
+
+
+def decodifica_codice(dati):
+    """Decodifica i byte di un sorgente con la prima codifica di CODIFICHE_CODICE che li accetta."""
+    for codifica in CODIFICHE_CODICE[:-1]:
+        try:
+            return str(dati, codifica)
+        except UnicodeDecodeError:
+            pass
+    return str(dati, CODIFICHE_CODICE[-1])
+
+
+class ConsegnaStudente:
+    """
+    Consegna di uno studente all'interno dell'archivio: espone name e getvalue()
+    come un io.BytesIO, ma il contenuto viene letto dallo zip solo quando richiesto.
+    Con un DepositoContenuti getvalue() restituisce una memoryview del deposito, senza copia.
+    """
+
+    def __init__(self, archivio, nome_studente, info_membro):
+        self._archivio = archivio
+        self.nome_studente = nome_studente
+        self.info_membro = info_membro  # zipfile.ZipInfo (offset dell'header, dimensioni)
+        self.name = os.path.basename(info_membro.filename)
+
+    @property
+    def dimensione(self):
+        """Dimensione non compressa del file in byte."""
+        return self.info_membro.file_size
+
+    def getvalue(self):
+        """Legge dallo zip i byte del file (senza tenerli in memoria)."""
+        return self._archivio.leggi_byte(self.nome_studente)
+
+    @property
+    def impronta(self):
+        """Hash SHA-256 del contenuto nel deposito (None se l'archivio non usa un deposito)."""
+        return self._archivio.impronta_consegna(self.nome_studente)
+
+    def testo(self):
+        """Restituisce il codice decodificato (vedi decodifica_codice), usando la cache limitata dell'archivio."""
+        return self._archivio.codice(self.nome_studente)
+
+
+class ArchivioConsegne(Mapping):
+    """
+    Indice delle consegne di un archivio .zip con una sottocartella per studente:
+    {nome_studente: ConsegnaStudente}. Alla creazione viene letta solo la central directory
+    dello zip (nomi, offset e dimensioni dei membri); il contenuto di un file viene letto e
+    decodificato solo quando lo studente viene selezionato o corretto.
+    I codici decodificati sono tenuti in una cache LRU limitata a max_byte_residenti.
+    Le letture sono serializzate da un lock, quindi l'archivio è usabile dai thread
+    della correzione in parallelo.
+    Con un DepositoContenuti (vedi grading.deposito) lo zip e le consegne vengono salvati una sola
+    volta per processo, indirizzati per hash: le sessioni che caricano lo stesso archivio condividono
+    i byte (mappati in memoria) e i codici decodificati, e l'archivio tiene solo nomi e impronte.
+    """
+
+    def __init__(self, file_zip, max_byte_residenti=MAX_BYTE_RESIDENTI_PREDEFINITO, deposito=None):
+        self.max_byte_residenti = max_byte_residenti
+        self.deposito = deposito
+        self._lock = threading.Lock()
+        self._codici = OrderedDict()  # nome_studente -> codice decodificato (ordine LRU)
+        self._byte_residenti = 0
+        self._impronte = {}  # nome_studente -> impronta della consegna nel deposito
+        # Solleva zipfile.BadZipFile se l'archivio non è valido
+        if deposito is not None:
+            # Lo zip resta del deposito, che lo chiude quando non serve e lo riapre per le letture
+            self.impronta = deposito.aggiungi_file(file_zip)
+            deposito.trattieni(self.impronta)
+            try:
+                membri = deposito.membri_zip(self.impronta)
+            except zipfile.BadZipFile:
+                deposito.rilascia(self.impronta)  # Un file non valido non resta nel deposito
+                raise
+            self._zip = None
+        else:
+            self.impronta = None
+            self._zip = zipfile.ZipFile(file_zip, 'r')
+            membri = self._zip.infolist()
+        self._consegne = {}
+        for file_info in membri:
+            # Cerca file .c in sottocartelle, ignorando i metadati di macOS
+            if file_info.filename.endswith('.c') and not file_info.filename.startswith('__MACOSX'):
+                parts = file_info.filename.split('/')
+                if len(parts) > 1:
+                    student_name = parts[0]
+                    self._consegne[student_name] = ConsegnaStudente(self, student_name, file_info)
+
+    def __getitem__(self, nome_studente):
+        return self._consegne[nome_studente]
+
+    def __iter__(self):
+        return iter(self._consegne)
+
+    def __len__(self):
+        return len(self._consegne)
+
+    def impronta_consegna(self, nome_studente):
+        if self.deposito is None:
+            return None
+        impronta = self._impronte.get(nome_studente)
+        if impronta is None:
+            impronta = self.deposito.membro_zip(self.impronta, self._consegne[nome_studente].info_membro.filename)
+            self._impronte[nome_studente] = impronta
+        return impronta
+
+    def leggi_byte(self, nome_studente):
+        """Legge dallo zip i byte della consegna di uno studente (con il deposito: memoryview senza copia)."""
+        if self.deposito is not None:
+            return self.deposito.vista(self.impronta_consegna(nome_studente))
+        info_membro = self._consegne[nome_studente].info_membro
+        with self._lock:
+            return self._zip.read(info_membro)
+
+    def codice(self, nome_studente):
+        """Restituisce il codice decodificato di uno studente, leggendolo dallo zip se non è in cache."""
+        if self.deposito is not None:
+            return self.deposito.testo(self.impronta_consegna(nome_studente), decodifica_codice)
+        with self._lock:
+            if nome_studente in self._codici:
+                self._codici.move_to_end(nome_studente)
+                return self._codici[nome_studente]
+        codice = decodifica_codice(self.leggi_byte(nome_studente))
+        dimensione = len(codice)
+        with self._lock:
+            if nome_studente not in self._codici and dimensione <= self.max_byte_residenti:
+                self._codici[nome_studente] = codice
+                self._byte_residenti += dimensione
+                # Rimuove i codici usati meno di recente finché non si rientra nel limite
+                while self._byte_residenti > self.max_byte_residenti:
+                    _, codice_rimosso = self._codici.popitem(last=False)
+                    self._byte_residenti -= len(codice_rimosso)
+        return codice
+
+    def codici(self):
+        """Vista {nome_studente: codice} che legge e decodifica ogni codice solo quando viene usato."""
+        return _VistaCodici(self)
+
+    def itera_codici(self):
+        """
+        Coppie (nome_studente, codice) lette in un solo passaggio direttamente dallo zip: ogni codice viene
+        decodificato e lasciato al chiamante, senza passare per la cache dei codici né essere salvato nel
+        deposito. Per le analisi di tutta la classe (es. le impronte della deduplicazione) su archivi grandi.
+        """
+        for nome_studente, consegna in self._consegne.items():
+            if self.deposito is not None:
+                dati = self.deposito.leggi_membro_zip(self.impronta, consegna.info_membro.filename)
+            else:
+                with self._lock:
+                    dati = self._zip.read(consegna.info_membro)
+            yield nome_studente, decodifica_codice(dati)
+
+    @property
+    def byte_residenti(self):
+        return self._byte_residenti
+
+    def chiudi(self):
+        """
+        Chiude lo zip; con il deposito rilascia l'archivio, che viene rimosso dal deposito con le sue
+        consegne se nessun'altra sessione lo sta usando. Da chiamare quando l'archivio viene eliminato.
+        """
+        if self.deposito is not None:
+            self.deposito.rilascia(self.impronta)
+        else:
+            self._zip.close()
+
+
+class _VistaCodici(Mapping):
+    def __init__(self, archivio):
+        self._archivio = archivio
+
+    def __getitem__(self, nome_studente):
+        if nome_studente not in self._archivio:
+            raise KeyError(nome_studente)
+        return self._archivio.codice(nome_studente)
+
+    def __iter__(self):
+        return iter(self._archivio)
+
+    def __len__(self):
+        return len(self._archivio)
+
+
+def nome_file_corretto(nome_studente, nome_file):
+    """
+    Nome del file .c corretto con i commenti dell'LLM, es. "Mario_Rossi_corrected_Lab1.c".
+    Se il nome del file inizia già con il nome dello studente, il prefisso non viene ripetuto.
+    """
+    student_id_part = nome_studente or "student"
+    original_file_base = os.path.splitext(nome_file or "")[0]
+    prefix_to_check = student_id_part + "_"
+    if original_file_base.startswith(prefix_to_check):
+        task_name_part = original_file_base[len(prefix_to_check):]
+    else:
+        task_name_part = original_file_base
+    if not task_name_part:
+        task_name_part = "task"
+    return f"{student_id_part.replace(' ', '_')}_corrected_{task_name_part}.c"
@@ -0,0 +1,95 @@
+import re
+from bisect import bisect_left
+
+from grading.c_analysis import analizza_funzioni
+from grading.memo import memoizza_per_contenuto
+
+
+class MotoreAttribuzione:
+    """
+    Assegna gli errori alle funzioni principali (quelle con un punteggio base), con le stesse
+    regole del calcolo per funzione della pagina di correzione:
+    1. se il testo del criterio nomina una funzione principale (parola intera, senza distinzione
+       di maiuscole), vince il nome più lungo;
+    2. altrimenti l'errore va alla funzione che contiene la riga, o alla sua funzione principale.
+    I nomi sono cercati con un'unica regex compilata (alternanza) e la funzione che contiene
+    una riga con una ricerca binaria sugli intervalli [start_line, end_line], che per funzioni
+    di primo livello sono disgiunti e ordinati.
+    """
+
+    def __init__(self, defined_functions, main_function_names, funzioni_principali):
+        self.main_function_names = list(main_function_names)
+        self.funzioni_principali = funzioni_principali
+
+        # Priorità dei nomi come nell'ordinamento originale: lunghezza decrescente (ordinamento stabile).
+        # Per nomi uguali a meno delle maiuscole vale il primo nell'ordinamento.
+        self._nome_per_minuscolo = {}
+        for priorita, func_name in enumerate(sorted(self.main_function_names, key=len, reverse=True)):
+            self._nome_per_minuscolo.setdefault(func_name.lower(), (priorita, func_name))
+        self._pattern_nomi = None
+        if self._nome_per_minuscolo:
+            alternanza = "|".join(
+                re.escape(nome) for nome in sorted(self._nome_per_minuscolo, key=len, reverse=True)
+            )
+            self._pattern_nomi = re.compile(r"\b(?:" + alternanza + r")\b")
+
+        # Indice degli intervalli: fine delle funzioni (non decrescente) per la ricerca binaria
+        self._funzioni = list(defined_functions)
+        self._fini = [func["end_line"] for func in self._funzioni]
+
+    def funzione_nominata(self, criteria_text):
+        """Funzione principale nominata nel testo del criterio (già in minuscolo), o None."""
+        if self._pattern_nomi is None:
+            return None
+        migliore = None
+        for match in self._pattern_nomi.finditer(criteria_text):
+            candidato = self._nome_per_minuscolo[match.group()]
+            if migliore is None or candidato[0] < migliore[0]:
+                migliore = candidato
+        return migliore[1] if migliore else None
+
+    def funzione_contenente(self, error_line):
+        """Nome della prima funzione che contiene la riga (1-based), o None."""
+        indice = bisect_left(self._fini, error_line)
+        if indice < len(self._funzioni) and self._funzioni[indice]["start_line"] <= error_line:
+            return self._funzioni[indice]["name"]
+        return None
+
+    def attribuisci(self, lista_errori):
+        """
+        Attribuisce tutti gli errori in un solo passaggio.
+        Restituisce (function_deductions, function_deduction_details): la somma delle deduzioni
+        e la lista delle stringhe di dettaglio (es. " - 0.5") per ogni funzione principale.
+        """
+        function_deductions = {name: 0.0 for name in self.main_function_names}
+        function_deduction_details = {name: [] for name in self.main_function_names}
+
+        for error_item in lista_errori:
+            penalty = float(error_item.get("point_deduction", 0))
+            criteria_text = error_item.get("criteria", "").lower()
+            error_line = int(error_item.get("line", 0))
+
+            # Tentativo 1: funzione principale nominata nel testo del criterio
+            target_func_name = self.funzione_nominata(criteria_text)
+            if target_func_name is None:
+                # Tentativo 2 (Fallback): posizione della riga dell'errore
+                containing_func_name = self.funzione_contenente(error_line)
+                if containing_func_name:
+                    target_func_name = self.funzioni_principali.get(containing_func_name)
+
+            if target_func_name:
+                function_deductions[target_func_name] += penalty
+                function_deduction_details[target_func_name].append(f" - {abs(penalty):.1f}")
+
+        return function_deductions, function_deduction_details
+
+
+@memoizza_per_contenuto()
+def motore_attribuzione(codice, main_function_names):
+    """
+    Restituisce il MotoreAttribuzione per il codice e le funzioni principali date (tupla di nomi).
+    Memorizzato per hash del contenuto: lo stesso codice con gli stessi criteri riusa l'indice.
+    """
+    defined_functions, grafo_chiamate = analizza_funzioni(codice)
+    funzioni_principali = grafo_chiamate.risolvi_funzioni_principali(main_function_names)
+    return MotoreAttribuzione(defined_functions, main_function_names, funzioni_principali)
@@ -0,0 +1,85 @@
+import json
+
+from grading.parsing import estrai_json_da_risposta
+from grading.verdetti_funzioni import unita_codice, UNITA_GLOBALE, SEGNAPOSTO_FUNZIONE
+
+# Dimensione (caratteri) oltre la quale un file viene corretto a blocchi di funzioni:
+# oltre questa soglia le annotazioni di un file con molti errori rischiano di superare max_tokens
+MAX_CARATTERI_BLOCCO = 6000
+
+
+def suddividi_in_blocchi(code_string, max_caratteri=MAX_CARATTERI_BLOCCO):
+    """
+    Suddivide un file lungo in blocchi da correggere separatamente. Ogni blocco contiene tutto il
+    codice globale (include, prototipi, variabili globali) come contesto e un gruppo di funzioni
+    consecutive di al più max_caratteri caratteri (almeno una); le altre funzioni sono sostituite
+    dal segnaposto e da righe vuote, così i numeri di riga restano quelli del file originale.
+    Restituisce una lista di dizionari con "codice" e "intervalli" (righe delle funzioni del blocco),
+    oppure None se il file non si può suddividere (meno di due blocchi).
+    """
+    unita = unita_codice(code_string)
+    if unita is None:
+        return None
+    funzioni = [u for u in unita if u["nome"] != UNITA_GLOBALE]
+    righe = code_string.split("\n")
+
+    gruppi = []
+    dimensione_gruppo = 0
+    for funzione in funzioni:
+        dimensione = sum(len(riga) + 1 for riga in righe[funzione["prima_riga"] - 1:funzione["ultima_riga"]])
+        if gruppi and dimensione_gruppo + dimensione <= max_caratteri:
+            gruppi[-1].append(funzione)
+            dimensione_gruppo += dimensione
+        else:
+            gruppi.append([funzione])
+            dimensione_gruppo = dimensione
+    if len(gruppi) < 2:
+        return None
+
+    blocchi = []
+    for gruppo in gruppi:
+        righe_blocco = list(righe)
+        for funzione in funzioni:
+            if funzione in gruppo:
+                continue
+            prima, ultima = funzione["prima_riga"], funzione["ultima_riga"]
+            righe_blocco[prima - 1:ultima] = [SEGNAPOSTO_FUNZIONE.format(nome=funzione["nome"])] + [""] * (ultima - prima)
+        blocchi.append({
+            "codice": "\n".join(righe_blocco),
+            "intervalli": [(funzione["prima_riga"], funzione["ultima_riga"]) for funzione in gruppo],
+        })
+    blocchi[0]["globale"] = True
+    return blocchi
+
+
+def unisci_risposte_blocchi(blocchi, risposte):
+    """
+    Unisce le risposte dei blocchi in un unico array JSON (stringa) con le righe del file originale.
+    Di ogni blocco si tengono le annotazioni sulle sue funzioni; quelle sul codice globale (e senza
+    una riga valida) si tengono solo dal primo blocco, per non contarle più volte.
+    Se una risposta non è un array JSON valido viene restituita così com'è, così l'errore
+    viene segnalato come per la correzione del file intero.
+    """
+    intervalli_funzioni = [intervallo for blocco in blocchi for intervallo in blocco["intervalli"]]
+    unite = []
+    for blocco, risposta in zip(blocchi, risposte):
+        json_estratto, errore = estrai_json_da_risposta(risposta)
+        if errore:
+            return risposta
+        try:
+            annotazioni = json.loads(json_estratto)
+        except json.JSONDecodeError:
+            return risposta
+        if not isinstance(annotazioni, list):
+            return risposta
+        for annotazione in annotazioni:
+            try:
+                riga = int(annotazione["line"])
+            except (TypeError, ValueError, KeyError):
+                riga = None
+            if riga is not None and any(prima <= riga <= ultima for prima, ultima in blocco["intervalli"]):
+                unite.append(annotazione)
+            elif blocco.get("globale") and (riga is None or not any(
+                    prima <= riga <= ultima for prima, ultima in intervalli_funzioni)):
+                unite.append(annotazione)
+    return json.dumps(unite, ensure_ascii=False)
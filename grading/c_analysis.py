@@ -0,0 +1,329 @@
+import re
+
+from grading.memo import memoizza_per_contenuto
+
+# --- Funzioni Helper per l'analisi dei punteggi per funzione ---
+
+# Scanner del codice C: un'unica regex con alternative nominate, applicata con finditer
+# in un solo passaggio sul testo. Commenti, stringhe, costanti carattere e direttive del
+# preprocessore vengono riconosciuti (e ignorati) per intero, così le parentesi al loro
+# interno non vengono contate. I caratteri non riconosciuti (operatori, spazi) vengono saltati.
+_PATTERN_TOKEN_C = re.compile(
+    r"(?P<commento_riga>//[^\n]*)"
+    r"|(?P<commento_blocco>/\*[\s\S]*?(?:\*/|\Z))"
+    r"|(?P<stringa>\"(?:\\[\s\S]|[^\"\\\n])*\"?)"
+    r"|(?P<carattere>'(?:\\[\s\S]|[^'\\\n])*'?)"
+    r"|(?P<preprocessore>^[ \t]*\#(?:\\\r?\n|/\*[\s\S]*?\*/|[^\n])*)"
+    r"|(?P<identificatore>[A-Za-z_]\w*)"
+    r"|(?P<numero>\.?\d(?:[eEpP][+-]|[\w.])*)"
+    r"|(?P<punteggiatura>[{}()\[\];,=])",
+    re.MULTILINE
+)
+_PATTERN_DIRETTIVA = re.compile(r"[ \t]*\#[ \t]*(\w*)[ \t]*(.*)", re.DOTALL)
+
+# Parole chiave C che possono precedere una '(' ma non sono nomi di funzione
+_PAROLE_CHIAVE_C = frozenset((
+    "auto", "break", "case", "char", "const", "continue", "default", "do", "double", "else",
+    "enum", "extern", "float", "for", "goto", "if", "inline", "int", "long", "register",
+    "restrict", "return", "short", "signed", "sizeof", "static", "struct", "switch", "typedef",
+    "union", "unsigned", "void", "volatile", "while", "_Bool", "_Alignas", "_Alignof",
+    "_Static_assert", "_Noreturn", "_Generic", "__attribute__", "__declspec", "__asm__", "asm",
+))
+
+
+def tokenizza_c(code_string):
+    """
+    Scansiona il codice C in un solo passaggio e restituisce (generatore) i token significativi
+    per l'analisi strutturale: tuple (tipo, valore, riga, posizione) con tipo "identificatore"
+    o "punteggiatura" ({ } ( ) [ ] ; , =), riga 1-based e posizione come offset nel testo.
+    Commenti, stringhe, costanti carattere e direttive del preprocessore non producono token.
+    Dei blocchi condizionali del preprocessore viene considerato solo il primo ramo
+    (#if 0 salta il primo ramo), così le graffe dei rami alternativi non sbilanciano il conteggio.
+    """
+    riga = 1
+    ultima_posizione = 0
+    # Pila dei blocchi #if aperti: per ciascuno, se il ramo corrente va saltato
+    # e se un ramo precedente è già stato considerato.
+    blocchi_condizionali = []
+    saltando = False
+    for match in _PATTERN_TOKEN_C.finditer(code_string):
+        inizio = match.start()
+        riga += code_string.count("\n", ultima_posizione, inizio)
+        ultima_posizione = inizio
+        tipo = match.lastgroup
+
+        if tipo == "preprocessore":
+            direttiva = _PATTERN_DIRETTIVA.match(match.group())
+            nome_direttiva = direttiva.group(1) if direttiva else ""
+            if nome_direttiva in ("if", "ifdef", "ifndef"):
+                salta_ramo = nome_direttiva == "if" and direttiva.group(2).strip() == "0"
+                blocchi_condizionali.append([salta_ramo, not salta_ramo])
+            elif nome_direttiva in ("elif", "else") and blocchi_condizionali:
+                blocco = blocchi_condizionali[-1]
+                blocco[0] = blocco[1]  # Salta il ramo se uno precedente è già stato considerato
+                blocco[1] = True
+            elif nome_direttiva == "endif" and blocchi_condizionali:
+                blocchi_condizionali.pop()
+            saltando = any(blocco[0] for blocco in blocchi_condizionali)
+            continue
+
+        if saltando or tipo not in ("identificatore", "punteggiatura"):
+            continue
+        yield tipo, match.group(), riga, inizio
+
+
+@memoizza_per_contenuto()
+def find_c_function_definitions(code_string):
+    """
+    Identifica le definizioni delle funzioni in una stringa di codice C.
+    Restituisce una lista di dizionari, ognuno con "name", "start_line", "end_line",
+    "body_start_line" (riga della '{' di apertura) e "body_start"/"body_end"
+    (offset nel testo del corpo, dalla '{' alla '}' inclusa).
+    start_line è la riga del primo token della dichiarazione (es. il tipo di ritorno).
+    Analizza il codice in tempo lineare con un solo passaggio di tokenizza_c: riconosce
+    firme su più righe e in stile K&R, e ignora le graffe in commenti, stringhe e preprocessore.
+    """
+    functions = []
+    profondita_graffe = 0
+    profondita_parentesi = 0
+
+    # Stato della dichiarazione corrente al livello più esterno (profondità 0)
+    riga_inizio_dichiarazione = None
+    nome_candidato = None  # Ultimo identificatore seguito da '(' nella dichiarazione
+    token_dopo_parametri = None  # Token visti dopo la ')' dei parametri (None: parametri non chiusi)
+    identificatore_precedente = None
+
+    # Funzione di cui si sta analizzando il corpo
+    funzione_corrente = None
+
+    for tipo, valore, riga, posizione in tokenizza_c(code_string):
+        if profondita_graffe > 0:
+            # Dentro un blocco: interessa solo trovarne la fine
+            if valore == "{":
+                profondita_graffe += 1
+            elif valore == "}":
+                profondita_graffe -= 1
+                if profondita_graffe == 0:
+                    if funzione_corrente is not None:
+                        funzione_corrente["end_line"] = riga
+                        funzione_corrente["body_end"] = posizione + 1
+                        functions.append(funzione_corrente)
+                        funzione_corrente = None
+                    riga_inizio_dichiarazione = None
+                    nome_candidato = None
+                    token_dopo_parametri = None
+            continue
+
+        if riga_inizio_dichiarazione is None:
+            riga_inizio_dichiarazione = riga
+
+        if tipo == "identificatore":
+            identificatore_precedente = valore
+            if token_dopo_parametri is not None and profondita_parentesi == 0:
+                token_dopo_parametri += 1
+            continue
+
+        if valore == "(":
+            if profondita_parentesi == 0 and identificatore_precedente and identificatore_precedente not in _PAROLE_CHIAVE_C:
+                nome_candidato = identificatore_precedente
+                token_dopo_parametri = None
+            profondita_parentesi += 1
+        elif valore == ")":
+            profondita_parentesi = max(0, profondita_parentesi - 1)
+            if profondita_parentesi == 0 and nome_candidato is not None and token_dopo_parametri is None:
+                token_dopo_parametri = 0
+        elif profondita_parentesi > 0:
+            pass  # Contenuto della lista dei parametri
+        elif valore == "{":
+            if nome_candidato is not None and token_dopo_parametri is not None:
+                funzione_corrente = {
+                    "name": nome_candidato,
+                    "start_line": riga_inizio_dichiarazione,
+                    "end_line": None,
+                    "body_start_line": riga,
+                    "body_start": posizione,
+                    "body_end": None,
+                }
+            profondita_graffe = 1
+        elif valore == ";" and (token_dopo_parametri is None or token_dopo_parametri == 0):
+            # Fine di una dichiarazione che non è una definizione (prototipo, variabile globale, ...)
+            riga_inizio_dichiarazione = None
+            nome_candidato = None
+            token_dopo_parametri = None
+        elif valore == "=" or (valore == "," and not token_dopo_parametri):
+            # Inizializzatore o lista di dichiarazioni: non è una definizione di funzione
+            nome_candidato = None
+            token_dopo_parametri = None
+        elif valore in (";", ","):
+            # Dichiarazione dei parametri in stile K&R: "int f(a, b) int a, b; { ... }"
+            token_dopo_parametri += 1
+        else:
+            if token_dopo_parametri is not None:
+                token_dopo_parametri += 1
+
+        identificatore_precedente = None
+    return functions
+
+def build_call_map(code_string, all_defined_functions):
+    """
+    Costruisce una mappa delle chiamate di funzione.
+    Restituisce un dizionario dove la chiave è il nome di una funzione (chiamante)
+    e il valore è una lista di nomi di funzioni che essa chiama (chiamate), nell'ordine di definizione.
+    Usa un solo passaggio sui token di tokenizza_c: una chiamata è un identificatore di una funzione
+    definita seguito da '(' all'interno del corpo di un'altra funzione. Le occorrenze in commenti
+    e stringhe vengono ignorate.
+    """
+    call_map = {func['name']: [] for func in all_defined_functions}
+    indice_definizione = {}
+    for indice, func in enumerate(all_defined_functions):
+        indice_definizione.setdefault(func['name'], indice)
+
+    # I corpi delle funzioni non si sovrappongono: ordinati per posizione, si scorrono insieme ai token
+    corpi = sorted(all_defined_functions, key=lambda func: func['body_start'])
+    chiamate_trovate = {func['name']: set() for func in all_defined_functions}
+    indice_corpo = 0
+    identificatore_precedente = None
+
+    for tipo, valore, riga, posizione in tokenizza_c(code_string):
+        while indice_corpo < len(corpi) and posizione >= corpi[indice_corpo]['body_end']:
+            indice_corpo += 1
+        if indice_corpo == len(corpi):
+            break
+        corpo = corpi[indice_corpo]
+        if posizione < corpo['body_start']:
+            identificatore_precedente = None
+            continue
+
+        if tipo == "identificatore":
+            identificatore_precedente = valore if valore in indice_definizione else None
+            continue
+        if valore == "(" and identificatore_precedente and identificatore_precedente != corpo['name']:
+            chiamate_trovate[corpo['name']].add(identificatore_precedente)
+        identificatore_precedente = None
+
+    for caller_name, callees in chiamate_trovate.items():
+        call_map[caller_name] = sorted(callees, key=indice_definizione.get)
+    return call_map
+
+def _cerca_chiamante_principale(aux_func_name, chiamanti, main_func_names):
+    # Ricerca in profondità sui chiamanti, iterativa (nessun limite di ricorsione sulle catene lunghe).
+    # Visita i chiamanti nello stesso ordine della versione ricorsiva di find_main_caller.
+    visited = {aux_func_name}
+    pila = [iter(chiamanti.get(aux_func_name, ()))]
+    while pila:
+        for caller in pila[-1]:
+            if caller in main_func_names:
+                return caller
+            if caller not in visited:
+                visited.add(caller)
+                pila.append(iter(chiamanti.get(caller, ())))
+                break
+        else:
+            pila.pop()
+    return None
+
+def _risolvi_chiamanti_principali(nomi, chiamanti, main_func_names):
+    # Calcola per tutti i nomi il risultato di _cerca_chiamante_principale in un'unica visita,
+    # riutilizzando i risultati già noti dei chiamanti (memoizzazione): O(F + E) sui grafi aciclici.
+    # Un risultato ottenuto saltando un nodo ancora in corso di visita (ciclo di ricorsione)
+    # dipende dal percorso e non viene memorizzato: quel nodo viene ricalcolato da capo.
+    # Sui grafi aciclici il risultato coincide con la ricerca ricorsiva; con funzioni mutuamente
+    # ricorsive può essere scelta un'altra funzione principale comunque raggiungibile.
+    risolti = {}
+    for nome in nomi:
+        if nome in risolti:
+            continue
+        in_corso = {nome}
+        # Ogni livello della pila: [nodo, iteratore sui chiamanti, risultato_dipende_dal_percorso]
+        pila = [[nome, iter(chiamanti.get(nome, ())), False]]
+        trovato = None
+        while pila:
+            livello = pila[-1]
+            nuovo_livello = None
+            for caller in livello[1]:
+                if caller in main_func_names:
+                    trovato = caller
+                    break
+                if caller in risolti:
+                    if risolti[caller] is not None:
+                        trovato = risolti[caller]
+                        break
+                    continue
+                if caller in in_corso:
+                    livello[2] = True  # Ciclo: come "visited" nella ricerca ricorsiva
+                    continue
+                nuovo_livello = [caller, iter(chiamanti.get(caller, ())), False]
+                break
+            if trovato is not None:
+                # Il risultato vale per tutti i nodi sul percorso corrente
+                for nodo, _, dipende_dal_percorso in pila:
+                    if not dipende_dal_percorso:
+                        risolti[nodo] = trovato
+                break
+            if nuovo_livello is not None:
+                in_corso.add(nuovo_livello[0])
+                pila.append(nuovo_livello)
+                continue
+            # Chiamanti esauriti senza trovare una funzione principale
+            nodo, _, dipende_dal_percorso = pila.pop()
+            in_corso.discard(nodo)
+            if dipende_dal_percorso:
+                if pila:
+                    pila[-1][2] = True
+            else:
+                risolti[nodo] = None
+        if nome not in risolti:
+            # Il nodo di partenza non dipende da altri percorsi: il risultato è definitivo
+            risolti[nome] = trovato
+    return risolti
+
+class GrafoChiamate:
+    """
+    Grafo delle chiamate di una versione del codice, con adiacenza diretta (chiamate)
+    e inversa (chiamanti). La funzione principale "proprietaria" di ogni funzione viene
+    calcolata una volta per insieme di funzioni principali e poi letta in O(1).
+    """
+
+    def __init__(self, call_map):
+        self.chiamate = call_map
+        self.chiamanti = {nome: [] for nome in call_map}
+        for caller, callees in call_map.items():
+            for callee in callees:
+                self.chiamanti.setdefault(callee, []).append(caller)
+        self._principali_per_insieme = {}
+
+    def risolvi_funzioni_principali(self, main_func_names):
+        """
+        Restituisce {nome_funzione: funzione_principale} per tutte le funzioni del grafo:
+        la funzione stessa se è principale, altrimenti il chiamante principale diretto
+        o indiretto (come find_main_caller), o None se non esiste.
+        """
+        chiave = frozenset(main_func_names)
+        principali = self._principali_per_insieme.get(chiave)
+        if principali is None:
+            principali = _risolvi_chiamanti_principali(self.chiamate, self.chiamanti, chiave)
+            for nome in chiave:
+                if nome in principali:
+                    principali[nome] = nome
+            self._principali_per_insieme[chiave] = principali
+        return principali
+
+@memoizza_per_contenuto()
+def analizza_funzioni(code_string):
+    """
+    Restituisce (defined_functions, grafo_chiamate) per il codice dato.
+    Il risultato è memorizzato per hash del contenuto: i rerun con lo stesso codice non ripetono
+    l'analisi, e il grafo conserva le funzioni principali già risolte.
+    """
+    defined_functions = find_c_function_definitions(code_string)
+    return defined_functions, GrafoChiamate(build_call_map(code_string, defined_functions))
+
+def find_main_caller(aux_func_name, call_map, main_func_names):
+    """
+    Trova una funzione principale che chiama, direttamente o indirettamente, la funzione ausiliaria data.
+    Esegue una ricerca inversa sulla mappa delle chiamate.
+    Restituisce il nome del chiamante della funzione principale, o None se non trovato.
+    Per molte ricerche sullo stesso codice conviene GrafoChiamate.risolvi_funzioni_principali,
+    che costruisce l'indice inverso una sola volta.
+    """
+    return _cerca_chiamante_principale(aux_func_name, GrafoChiamate(call_map).chiamanti, set(main_func_names))
@@ -0,0 +1,146 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+
+# Percorso predefinito del database della cache (relativo alla cartella di avvio dell'app)
+PERCORSO_CACHE_PREDEFINITO = os.path.join(".cache", "risposte_llm.sqlite3")
+
+# Limiti predefiniti per l'evizione
+MAX_VOCI_PREDEFINITO = 5000
+MAX_BYTE_PREDEFINITO = 200 * 1024 * 1024  # 200 MB di risposte
+MAX_ETA_SECONDI_PREDEFINITO = 30 * 24 * 3600  # 30 giorni
+
+
+def calcola_chiave_cache(codice_studente, criteri, testo_esame, modello, parametri):
+    """
+    Calcola la chiave (SHA-256) di una richiesta di correzione.
+    La chiave dipende da codice, criteri, testo d'esame, modello e parametri di campionamento:
+    se uno qualsiasi cambia, la risposta in cache non viene riutilizzata.
+    """
+    contenuto = json.dumps(
+        {
+            "codice": codice_studente or "",
+            "criteri": criteri or "",
+            "testo_esame": testo_esame or "",
+            "modello": modello,
+            "parametri": parametri or {},
+        },
+        sort_keys=True,
+        ensure_ascii=False,
+    )
+    return hashlib.sha256(contenuto.encode("utf-8")).hexdigest()
+
+
+class CacheRisposteLLM:
+    """
+    Cache persistente (SQLite) delle risposte LLM, indirizzata per contenuto.
+    Le voci vengono rimosse in ordine LRU quando si superano il numero massimo di voci
+    o la dimensione totale, e scadono dopo max_eta_secondi dall'inserimento.
+    È sicura da usare da più thread (es. la correzione in parallelo di tutti gli studenti).
+    """
+
+    def __init__(self, percorso_db=PERCORSO_CACHE_PREDEFINITO, max_voci=MAX_VOCI_PREDEFINITO,
+                 max_byte=MAX_BYTE_PREDEFINITO, max_eta_secondi=MAX_ETA_SECONDI_PREDEFINITO):
+        self.percorso_db = percorso_db
+        self.max_voci = max_voci
+        self.max_byte = max_byte
+        self.max_eta_secondi = max_eta_secondi
+        self.hit = 0
+        self.miss = 0
+        self._lock = threading.Lock()
+
+        cartella = os.path.dirname(percorso_db)
+        if cartella:
+            os.makedirs(cartella, exist_ok=True)
+        self._conn = sqlite3.connect(percorso_db, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS risposte (
+                chiave TEXT PRIMARY KEY,
+                modello TEXT,
+                risposta TEXT NOT NULL,
+                dimensione INTEGER NOT NULL,
+                creato REAL NOT NULL,
+                ultimo_accesso REAL NOT NULL
+            )
+            """
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_ultimo_accesso ON risposte(ultimo_accesso)")
+        self._conn.commit()
+
+    def get(self, chiave):
+        """Restituisce la risposta in cache per la chiave, o None (aggiorna i contatori hit/miss)."""
+        adesso = time.time()
+        with self._lock:
+            riga = self._conn.execute(
+                "SELECT risposta, creato FROM risposte WHERE chiave = ?", (chiave,)
+            ).fetchone()
+            if riga is None or (self.max_eta_secondi and adesso - riga[1] > self.max_eta_secondi):
+                if riga is not None:  # Voce scaduta
+                    self._conn.execute("DELETE FROM risposte WHERE chiave = ?", (chiave,))
+                    self._conn.commit()
+                self.miss += 1
+                return None
+            self._conn.execute("UPDATE risposte SET ultimo_accesso = ? WHERE chiave = ?", (adesso, chiave))
+            self._conn.commit()
+            self.hit += 1
+            return riga[0]
+
+    def put(self, chiave, risposta, modello=None):
+        """Salva una risposta in cache e applica l'evizione se necessario."""
+        adesso = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO risposte (chiave, modello, risposta, dimensione, creato, ultimo_accesso) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (chiave, modello, risposta, len(risposta.encode("utf-8")), adesso, adesso),
+            )
+            self._evict(adesso)
+            self._conn.commit()
+
+    def _evict(self, adesso):
+        # 1. Rimuove le voci scadute
+        if self.max_eta_secondi:
+            self._conn.execute("DELETE FROM risposte WHERE creato < ?", (adesso - self.max_eta_secondi,))
+        # 2. Rimuove le voci usate meno di recente finché non si rientra nei limiti
+        numero_voci, byte_totali = self._conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(dimensione), 0) FROM risposte"
+        ).fetchone()
+        if numero_voci <= self.max_voci and byte_totali <= self.max_byte:
+            return
+        voci_da_rimuovere = []
+        for chiave, dimensione in self._conn.execute(
+            "SELECT chiave, dimensione FROM risposte ORDER BY ultimo_accesso ASC"
+        ):
+            if numero_voci <= self.max_voci and byte_totali <= self.max_byte:
+                break
+            voci_da_rimuovere.append((chiave,))
+            numero_voci -= 1
+            byte_totali -= dimensione
+        self._conn.executemany("DELETE FROM risposte WHERE chiave = ?", voci_da_rimuovere)
+
+    def invalida(self, chiave):
+        """Rimuove una singola voce (es. dopo una ricorrezione forzata)."""
+        with self._lock:
+            self._conn.execute("DELETE FROM risposte WHERE chiave = ?", (chiave,))
+            self._conn.commit()
+
+    def svuota(self):
+        """Rimuove tutte le voci e azzera i contatori."""
+        with self._lock:
+            self._conn.execute("DELETE FROM risposte")
+            self._conn.commit()
+            self.hit = 0
+            self.miss = 0
+
+    def statistiche(self):
+        """Restituisce un dizionario con hit, miss, numero di voci e byte occupati."""
+        with self._lock:
+            numero_voci, byte_totali = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(dimensione), 0) FROM risposte"
+            ).fetchone()
+        return {"hit": self.hit, "miss": self.miss, "voci": numero_voci, "byte": byte_totali}
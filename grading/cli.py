@@ -0,0 +1,144 @@
+import os
+import sys
+import argparse
+
+from grading.archivio import ArchivioConsegne, nome_file_corretto
+from grading.cache import CacheRisposteLLM, PERCORSO_CACHE_PREDEFINITO
+from grading.deduplica import raggruppa_duplicati
+from grading.llm import URL_OPENROUTER, MODELLO_PREDEFINITO, crea_client, correggi_codici_in_parallelo
+from grading.matrice_punteggi import MatricePunteggi
+from grading.metrics import RegistroChiamate
+from grading.parsing import statistiche_riparazione_json
+from grading.pdf import estrai_testo_pdf
+from grading.resilienza import PoliticaChiamate
+from grading.pipeline import elabora_risposta_llm
+from grading.scoring import punteggi_base_funzioni
+
+
+def leggi_testo(percorso):
+    if percorso.lower().endswith(".pdf"):
+        with open(percorso, "rb") as f:
+            testo, errore = estrai_testo_pdf(f.read())
+        if errore:
+            print(f"Warning: {errore}", file=sys.stderr)
+        return testo or ""
+    with open(percorso, "r", encoding="utf-8") as f:
+        return f.read()
+
+
+def costruisci_parser():
+    parser = argparse.ArgumentParser(
+        prog="python -m grading",
+        description="Corregge con un LLM tutti i codici C di un archivio .zip d'esame, senza interfaccia Streamlit."
+    )
+    parser.add_argument("zip", help="Archivio .zip con una sottocartella per studente")
+    parser.add_argument("--criteri", required=True, help="File .txt con i criteri di correzione")
+    parser.add_argument("--testo-esame", help="File .txt o .pdf con il testo d'esame (opzionale)")
+    parser.add_argument("--modello", default=MODELLO_PREDEFINITO, help=f"Modello OpenRouter (default: {MODELLO_PREDEFINITO})")
+    parser.add_argument("--output", default="correzioni", help="Cartella in cui scrivere i file corretti e i punteggi")
+    parser.add_argument("--max-workers", type=int, default=8, help="Numero massimo di richieste in parallelo")
+    parser.add_argument("--api-key", default=os.environ.get("OPENROUTER_API_KEY"),
+                        help="Chiave API OpenRouter (default: variabile d'ambiente OPENROUTER_API_KEY)")
+    parser.add_argument("--base-url", default=URL_OPENROUTER, help="URL dell'API OpenAI-compatibile")
+    parser.add_argument("--cache", default=PERCORSO_CACHE_PREDEFINITO, help="Database SQLite della cache delle risposte")
+    parser.add_argument("--no-cache", action="store_true", help="Non usare la cache delle risposte")
+    parser.add_argument("--forza", action="store_true", help="Ignora le risposte in cache e ricorregge tutti gli studenti")
+    parser.add_argument("--budget", type=float, help="Budget massimo stimato in USD per l'esecuzione")
+    parser.add_argument("--timeout", type=float, default=60.0, help="Secondi massimi per singola richiesta")
+    parser.add_argument("--tentativi", type=int, default=3, help="Tentativi per modello sugli errori temporanei")
+    parser.add_argument("--scadenza", type=float, default=180.0,
+                        help="Secondi massimi per studente, tentativi e modelli di riserva compresi")
+    parser.add_argument("--hedging", action="store_true",
+                        help="Invia una seconda richiesta se la prima supera il 95° percentile delle latenze osservate")
+    parser.add_argument("--modelli-riserva", nargs="*", default=[],
+                        help="Modelli da provare, in ordine, se quello scelto non è disponibile")
+    parser.add_argument("--ensemble", nargs="*", default=[],
+                        help="Altri modelli che correggono ogni consegna insieme a --modello: si tengono gli errori "
+                             "indicati da almeno --soglia-voti modelli")
+    parser.add_argument("--soglia-voti", type=int,
+                        help="Voti necessari per tenere un errore con --ensemble (default: la maggioranza dei modelli)")
+    parser.add_argument("--no-deduplica", action="store_true",
+                        help="Corregge separatamente anche le consegne equivalenti (stesso codice a meno di spazi, commenti e nomi)")
+    parser.add_argument("--no-cache-funzioni", action="store_true",
+                        help="Non riutilizza i verdetti delle singole funzioni già corrette")
+    parser.add_argument("--output-strutturato", action="store_true",
+                        help="Chiede la risposta con uno schema JSON (response_format) ai modelli che lo supportano")
+    parser.add_argument("--parquet", action="store_true", help="Scrive anche i punteggi in formato Parquet (richiede pyarrow)")
+    return parser
+
+
+def main(argv=None):
+    args = costruisci_parser().parse_args(argv)
+    if not args.api_key:
+        print("Error: OpenRouter API key not found (use --api-key or OPENROUTER_API_KEY).", file=sys.stderr)
+        return 2
+
+    criteri = leggi_testo(args.criteri)
+    testo_esame = leggi_testo(args.testo_esame) if args.testo_esame else ""
+    archivio = ArchivioConsegne(args.zip)
+    codici_studenti = archivio.codici()
+    nomi_file = {nome: consegna.name for nome, consegna in archivio.items()}
+    if not codici_studenti:
+        print("Error: no student .c files found in the archive.", file=sys.stderr)
+        return 1
+
+    client = crea_client(args.api_key, args.base_url)
+    cache = None if args.no_cache else CacheRisposteLLM(args.cache)
+    registro = RegistroChiamate(budget=args.budget)
+    politica = PoliticaChiamate(
+        timeout=args.timeout, max_tentativi=args.tentativi, scadenza_totale=args.scadenza,
+        hedging=args.hedging, modelli_riserva=args.modelli_riserva
+    )
+    os.makedirs(args.output, exist_ok=True)
+
+    modelli_ensemble = [args.modello] + [m for m in args.ensemble if m != args.modello] if args.ensemble else None
+    if modelli_ensemble and args.soglia_voti is not None and not 1 <= args.soglia_voti <= len(modelli_ensemble):
+        print(f"Error: --soglia-voti must be between 1 and {len(modelli_ensemble)}.", file=sys.stderr)
+        return 2
+    gruppi = None if args.no_deduplica else raggruppa_duplicati(archivio.itera_codici())
+    punteggi_base = punteggi_base_funzioni(criteri, testo_esame)
+    risultati = {}
+    for indice, (nome_studente, contenuto, errore, _) in enumerate(correggi_codici_in_parallelo(
+        codici_studenti, criteri, testo_esame, args.modello, client,
+        max_workers=args.max_workers, cache=cache, forza_ricorrezione=args.forza, registro=registro,
+        politica=politica, gruppi=gruppi, cache_funzioni=not args.no_cache_funzioni,
+        output_strutturato=args.output_strutturato, modelli_ensemble=modelli_ensemble, soglia_voti=args.soglia_voti
+    ), start=1):
+        if errore:
+            risultati[nome_studente] = {"errore": errore}
+        else:
+            risultato = elabora_risposta_llm(codici_studenti[nome_studente], contenuto, criteri, testo_esame)
+            if risultato["codice_annotato"] is not None:
+                codice_da_salvare = risultato["codice_annotato"]
+                if risultato["riepilogo"]:
+                    codice_da_salvare += "\n\n" + risultato["riepilogo"] + "\n"
+                percorso_file = os.path.join(args.output, nome_file_corretto(nome_studente, nomi_file[nome_studente]))
+                with open(percorso_file, "w", encoding="utf-8") as f:
+                    f.write(codice_da_salvare)
+            risultati[nome_studente] = risultato
+        risultato = risultati[nome_studente]
+        stato = f"ERROR {risultato['errore']}" if risultato["errore"] else f"deductions {risultato['deduzioni']}"
+        print(f"[{indice}/{len(codici_studenti)}] {nome_studente}: {stato}", file=sys.stderr)
+
+    percorso_punteggi = os.path.join(args.output, "punteggi.csv")
+    matrice = MatricePunteggi.da_risultati(risultati, punteggi_base, nomi_file)
+    with open(percorso_punteggi, "w", encoding="utf-8", newline="") as f:
+        matrice.scrivi_csv(f)
+    if args.parquet:
+        try:
+            matrice.scrivi_parquet(os.path.join(args.output, "punteggi.parquet"))
+        except ImportError as e:
+            print(f"Warning: {e}", file=sys.stderr)
+
+    totali = registro.sessione()
+    riparazioni = statistiche_riparazione_json()
+    print(
+        f"Graded {len(risultati)} students: {totali['chiamate']} API calls, "
+        f"{totali['risposte_da_cache']} cache hits, {gruppi.chiamate_risparmiate if gruppi else 0} calls saved "
+        f"by grading equivalent submissions once, estimated cost {totali['costo']:.4f} USD. "
+        f"{sum(riparazioni['riparate'].values())} of {sum(riparazioni['riparate'].values()) + riparazioni['non_riparabili']} "
+        f"malformed JSON responses repaired locally. "
+        f"Scores written to {percorso_punteggi}",
+        file=sys.stderr
+    )
+    return 0
@@ -0,0 +1,432 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from grading.cache import PERCORSO_CACHE_PREDEFINITO
+from grading.deduplica import impronta_codice, riporta_correzioni
+from grading.ensemble import correggi_codice_ensemble
+from grading.llm import correggi_codice
+from grading.memo import hash_contenuto
+from grading.parsing import estrai_json_da_risposta
+
+# Database predefinito della coda, accanto alla cache delle risposte
+PERCORSO_CODA_PREDEFINITO = os.path.join(os.path.dirname(PERCORSO_CACHE_PREDEFINITO), "coda_correzioni.sqlite3")
+
+# Stati di un lavoro
+IN_ATTESA = "in_attesa"
+IN_CORSO = "in_corso"
+COMPLETATO = "completato"
+ERRORE = "errore"
+
+# Un lavoro "in_corso" non rinnovato da più di questi secondi è considerato interrotto (processo terminato)
+# e viene ripreso. Il lavoratore rinnova i lavori in esecuzione ogni INTERVALLO_RINNOVO_SECONDI, così una
+# correzione lenta (la scadenza totale della PoliticaChiamate può superare la scadenza del lavoro) non
+# viene ripresa, e pagata, una seconda volta mentre è ancora in corso
+SCADENZA_LAVORO_SECONDI = 15 * 60
+INTERVALLO_RINNOVO_SECONDI = 60
+
+# Numero massimo di volte che un lavoro interrotto viene ripreso prima di segnarlo come errore
+MAX_TENTATIVI_LAVORO = 3
+
+# Thread del lavoratore: il numero di chiamate in parallelo (max_workers) si può cambiare fino a questo valore
+MAX_THREAD_LAVORATORE = 32
+
+MESSAGGIO_BUDGET = "Skipped: session budget exceeded. Raise the budget and run again to resume."
+
+
+def impronta_rubrica(criteri, testo_esame):
+    """Hash dei criteri e del testo d'esame: i lavori di una correzione sono indicizzati per (studente, modello, rubrica)."""
+    return hash_contenuto(criteri or "", testo_esame)
+
+
+class CodaCorrezioni:
+    """
+    Coda persistente (SQLite) delle correzioni: un lavoro per (studente, modello, impronta della rubrica)
+    con stato (in_attesa, in_corso, completato, errore), tentativi, risposta grezza dell'LLM ed errori estratti.
+    Sopravvive ai rerun di Streamlit, alla chiusura della scheda e al riavvio del server: accodando di nuovo
+    la stessa classe i lavori completati vengono mantenuti e si riprende da quelli mancanti.
+    Le consegne equivalenti (GruppiDuplicati) sono accodate con il loro rappresentante: quando il suo
+    lavoro termina, la risposta viene riportata sulle loro righe senza altre chiamate.
+    È sicura da usare da più thread.
+    """
+
+    def __init__(self, percorso_db=PERCORSO_CODA_PREDEFINITO):
+        self.percorso_db = percorso_db
+        self._lock = threading.Lock()
+        cartella = os.path.dirname(percorso_db)
+        if cartella:
+            os.makedirs(cartella, exist_ok=True)
+        self._conn = sqlite3.connect(percorso_db, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS rubriche (
+                impronta TEXT PRIMARY KEY,
+                criteri TEXT NOT NULL,
+                testo_esame TEXT
+            );
+            CREATE TABLE IF NOT EXISTS lavori (
+                id INTEGER PRIMARY KEY,
+                studente TEXT NOT NULL,
+                modello TEXT NOT NULL,
+                impronta_rubrica TEXT NOT NULL,
+                impronta_codice TEXT NOT NULL,
+                codice TEXT NOT NULL,
+                rappresentante TEXT,
+                stato TEXT NOT NULL,
+                tentativi INTEGER NOT NULL DEFAULT 0,
+                forza INTEGER NOT NULL DEFAULT 0,
+                opzioni TEXT NOT NULL DEFAULT '{}',
+                risposta TEXT,
+                errori TEXT,
+                uso TEXT,
+                messaggio_errore TEXT,
+                creato REAL NOT NULL,
+                aggiornato REAL NOT NULL,
+                UNIQUE (studente, modello, impronta_rubrica)
+            );
+            CREATE INDEX IF NOT EXISTS idx_lavori_stato ON lavori(stato, id);
+            """
+        )
+        self._conn.commit()
+
+    def accoda(self, codici_studenti, criteri, testo_esame, modello, gruppi=None, forza=False, opzioni=None):
+        """
+        Accoda la correzione di codici_studenti ({nome_studente: codice}) e restituisce l'impronta della rubrica.
+        I lavori già completati con lo stesso codice vengono mantenuti, salvo forza=True; quelli in corso
+        con lo stesso codice vengono mantenuti sempre (la loro risposta arriverà comunque); gli altri
+        tornano in attesa.
+        """
+        rubrica = impronta_rubrica(criteri, testo_esame)
+        opzioni_json = json.dumps(opzioni or {}, sort_keys=True)
+        adesso = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR IGNORE INTO rubriche (impronta, criteri, testo_esame) VALUES (?, ?, ?)",
+                (rubrica, criteri or "", testo_esame),
+            )
+            esistenti = {
+                riga["studente"]: riga for riga in self._conn.execute(
+                    "SELECT studente, impronta_codice, rappresentante, stato FROM lavori "
+                    "WHERE modello = ? AND impronta_rubrica = ?", (modello, rubrica)
+                )
+            }
+            for nome_studente, codice in codici_studenti.items():
+                rappresentante = gruppi.rappresentante(nome_studente) if gruppi is not None else nome_studente
+                rappresentante = None if rappresentante == nome_studente else rappresentante
+                impronta = impronta_codice(codice)
+                riga = esistenti.get(nome_studente)
+                if riga is not None and riga["impronta_codice"] == impronta and riga["rappresentante"] == rappresentante \
+                        and (riga["stato"] == IN_CORSO or (not forza and riga["stato"] == COMPLETATO)):
+                    continue
+                self._conn.execute(
+                    "INSERT INTO lavori (studente, modello, impronta_rubrica, impronta_codice, codice, rappresentante, "
+                    "stato, tentativi, forza, opzioni, creato, aggiornato) VALUES (?, ?, ?, ?, ?, ?, ?, 0, ?, ?, ?, ?) "
+                    "ON CONFLICT (studente, modello, impronta_rubrica) DO UPDATE SET "
+                    "impronta_codice = excluded.impronta_codice, codice = excluded.codice, "
+                    "rappresentante = excluded.rappresentante, stato = excluded.stato, tentativi = 0, "
+                    "forza = excluded.forza, opzioni = excluded.opzioni, risposta = NULL, errori = NULL, uso = NULL, "
+                    "messaggio_errore = NULL, aggiornato = excluded.aggiornato",
+                    (nome_studente, modello, rubrica, impronta, codice, rappresentante, IN_ATTESA, int(forza),
+                     opzioni_json, adesso, adesso),
+                )
+            # Consegne equivalenti il cui rappresentante era già stato corretto
+            for riga in self._conn.execute(
+                "SELECT DISTINCT rappresentante FROM lavori WHERE modello = ? AND impronta_rubrica = ? "
+                "AND rappresentante IS NOT NULL AND stato = ?", (modello, rubrica, IN_ATTESA)
+            ).fetchall():
+                self._propaga(riga["rappresentante"], modello, rubrica)
+            self._conn.commit()
+        return rubrica
+
+    def prendi(self):
+        """
+        Assegna al chiamante il prossimo lavoro da eseguire (None se non ce ne sono): un lavoro in attesa
+        o uno rimasto in corso oltre SCADENZA_LAVORO_SECONDI. Restituisce un dizionario con i campi del
+        lavoro, i criteri e il testo d'esame.
+        """
+        adesso = time.time()
+        with self._lock:
+            while True:
+                riga = self._conn.execute(
+                    "SELECT lavori.*, rubriche.criteri, rubriche.testo_esame FROM lavori "
+                    "JOIN rubriche ON rubriche.impronta = lavori.impronta_rubrica "
+                    "WHERE lavori.rappresentante IS NULL AND (lavori.stato = ? OR (lavori.stato = ? AND lavori.aggiornato < ?)) "
+                    "ORDER BY lavori.id LIMIT 1",
+                    (IN_ATTESA, IN_CORSO, adesso - SCADENZA_LAVORO_SECONDI),
+                ).fetchone()
+                if riga is None:
+                    return None
+                if riga["tentativi"] >= MAX_TENTATIVI_LAVORO:
+                    self._segna_errore(riga["id"], "Error: grading was interrupted too many times.")
+                    self._conn.commit()
+                    continue
+                self._conn.execute(
+                    "UPDATE lavori SET stato = ?, tentativi = tentativi + 1, aggiornato = ? WHERE id = ?",
+                    (IN_CORSO, adesso, riga["id"]),
+                )
+                self._conn.commit()
+                lavoro = dict(riga)
+                lavoro["opzioni"] = json.loads(lavoro["opzioni"])
+                return lavoro
+
+    def rinnova(self, id_lavori):
+        """Segnala che i lavori sono ancora in esecuzione, così non scadono (heartbeat del lavoratore)."""
+        with self._lock:
+            self._conn.executemany(
+                "UPDATE lavori SET aggiornato = ? WHERE id = ? AND stato = ?",
+                [(time.time(), id_lavoro, IN_CORSO) for id_lavoro in id_lavori],
+            )
+            self._conn.commit()
+
+    def rilascia_interrotti(self):
+        """
+        Rimette in attesa i lavori rimasti in corso e non più rinnovati entro SCADENZA_LAVORO_SECONDI
+        (es. dopo il riavvio del processo che li eseguiva). Quelli ancora rinnovati da un altro processo
+        che usa lo stesso database non vengono toccati.
+        """
+        with self._lock:
+            self._conn.execute(
+                "UPDATE lavori SET stato = ? WHERE stato = ? AND aggiornato < ?",
+                (IN_ATTESA, IN_CORSO, time.time() - SCADENZA_LAVORO_SECONDI),
+            )
+            self._conn.commit()
+
+    def contesto_aperto(self, id_contesto):
+        """True se restano lavori in attesa o in corso accodati con il contesto id_contesto (vedi LavoratoreCoda.accoda)."""
+        with self._lock:
+            return self._conn.execute(
+                "SELECT 1 FROM lavori WHERE stato IN (?, ?) AND json_extract(opzioni, '$.contesto') = ? LIMIT 1",
+                (IN_ATTESA, IN_CORSO, id_contesto),
+            ).fetchone() is not None
+
+    def completa(self, id_lavoro, risposta, uso=None):
+        """Salva la risposta del lavoro (e degli equivalenti che rappresenta) e gli errori estratti."""
+        with self._lock:
+            riga = self._conn.execute(
+                "SELECT studente, modello, impronta_rubrica FROM lavori WHERE id = ?", (id_lavoro,)
+            ).fetchone()
+            self._conn.execute(
+                "UPDATE lavori SET stato = ?, forza = 0, risposta = ?, errori = ?, uso = ?, messaggio_errore = NULL, "
+                "aggiornato = ? WHERE id = ?",
+                (COMPLETATO, risposta, _errori_estratti(risposta), json.dumps(uso or {}), time.time(), id_lavoro),
+            )
+            self._propaga(riga["studente"], riga["modello"], riga["impronta_rubrica"])
+            self._conn.commit()
+
+    def fallisci(self, id_lavoro, messaggio_errore):
+        """Segna il lavoro (e gli equivalenti che rappresenta) come terminato con errore."""
+        with self._lock:
+            self._segna_errore(id_lavoro, messaggio_errore)
+            self._conn.commit()
+
+    def _segna_errore(self, id_lavoro, messaggio_errore):
+        riga = self._conn.execute(
+            "SELECT studente, modello, impronta_rubrica FROM lavori WHERE id = ?", (id_lavoro,)
+        ).fetchone()
+        self._conn.execute(
+            "UPDATE lavori SET stato = ?, messaggio_errore = ?, aggiornato = ? WHERE id = ? "
+            "OR (rappresentante = ? AND modello = ? AND impronta_rubrica = ? AND stato = ?)",
+            (ERRORE, messaggio_errore, time.time(), id_lavoro,
+             riga["studente"], riga["modello"], riga["impronta_rubrica"], IN_ATTESA),
+        )
+
+    def _propaga(self, rappresentante, modello, rubrica):
+        # Riporta la risposta del rappresentante completato sulle consegne equivalenti in attesa
+        origine = self._conn.execute(
+            "SELECT codice, risposta, uso FROM lavori WHERE studente = ? AND modello = ? AND impronta_rubrica = ? "
+            "AND stato = ?", (rappresentante, modello, rubrica, COMPLETATO)
+        ).fetchone()
+        if origine is None:
+            return
+        adesso = time.time()
+        for duplicato in self._conn.execute(
+            "SELECT id, codice FROM lavori WHERE rappresentante = ? AND modello = ? AND impronta_rubrica = ? AND stato = ?",
+            (rappresentante, modello, rubrica, IN_ATTESA),
+        ).fetchall():
+            risposta = riporta_correzioni(origine["risposta"], origine["codice"], duplicato["codice"])
+            self._conn.execute(
+                "UPDATE lavori SET stato = ?, risposta = ?, errori = ?, uso = '{}', aggiornato = ? WHERE id = ?",
+                (COMPLETATO, risposta, _errori_estratti(risposta), adesso, duplicato["id"]),
+            )
+
+    def lavori(self, modello, rubrica, studenti=None):
+        """
+        {nome_studente: lavoro} della correzione (modello, impronta della rubrica), eventualmente solo per
+        gli studenti indicati. Ogni lavoro ha stato, tentativi, rappresentante, risposta, errori (lista),
+        uso (token) e messaggio_errore.
+        """
+        with self._lock:
+            righe = self._conn.execute(
+                "SELECT studente, stato, tentativi, rappresentante, risposta, errori, uso, messaggio_errore "
+                "FROM lavori WHERE modello = ? AND impronta_rubrica = ?", (modello, rubrica)
+            ).fetchall()
+        risultato = {}
+        for riga in righe:
+            if studenti is not None and riga["studente"] not in studenti:
+                continue
+            lavoro = dict(riga)
+            lavoro["errori"] = json.loads(lavoro["errori"]) if lavoro["errori"] else None
+            lavoro["uso"] = json.loads(lavoro["uso"]) if lavoro["uso"] else {}
+            risultato[riga["studente"]] = lavoro
+        return risultato
+
+    def conteggi(self):
+        """Numero di lavori per stato, in tutta la coda."""
+        with self._lock:
+            return dict(self._conn.execute("SELECT stato, COUNT(*) FROM lavori GROUP BY stato").fetchall())
+
+
+def _errori_estratti(risposta):
+    # Lista degli errori in JSON, se la risposta ne contiene una valida
+    json_estratto, errore = estrai_json_da_risposta(risposta)
+    if errore:
+        return None
+    try:
+        errori = json.loads(json_estratto)
+    except json.JSONDecodeError:
+        return None
+    return json.dumps(errori, ensure_ascii=False) if isinstance(errori, list) else None
+
+
+class LavoratoreCoda:
+    """
+    Esegue in un thread in background, fuori dal thread dello script Streamlit, i lavori della CodaCorrezioni
+    con al massimo max_workers chiamate in parallelo (modificabile mentre è in esecuzione). Va creato una volta per processo (es. st.cache_resource):
+    continua anche se la sessione che ha accodato i lavori fa un rerun o viene chiusa.
+    I lavori accodati con accoda usano politica delle chiamate e registro (con il budget) della sessione che
+    li ha accodati, finché non terminano; dopo un riavvio i lavori ripresi usano i valori predefiniti.
+    client è il client OpenRouter o una funzione senza argomenti che lo restituisce (creato al primo lavoro).
+    """
+
+    def __init__(self, coda, client, cache=None, max_workers=8, intervallo_attesa=1.0):
+        self.coda = coda
+        self._client = client
+        self.cache = cache
+        self.max_workers = max_workers
+        self.intervallo_attesa = intervallo_attesa
+        self._contesti = {}  # id del contesto (nelle opzioni dei lavori) -> politica e registro della sessione
+        self._lock = threading.Lock()
+        self._risveglio = threading.Event()
+        self._fermato = threading.Event()
+        self._thread = None
+        self.errore = None  # Eccezione che ha fermato il thread, se si è interrotto per un errore
+
+    @property
+    def client(self):
+        return self._client() if callable(self._client) else self._client
+
+    def accoda(self, codici_studenti, criteri, testo_esame, modello, gruppi=None, forza=False, opzioni=None,
+               politica=None, registro=None):
+        """
+        Accoda i lavori come CodaCorrezioni.accoda e restituisce l'impronta della rubrica. I lavori ricordano
+        un contesto proprio di questa chiamata (politica e registro), così due sessioni che correggono con lo
+        stesso modello e la stessa rubrica non usano l'una il registro dell'altra; il contesto viene rimosso
+        quando i suoi lavori terminano.
+        """
+        id_contesto = uuid.uuid4().hex
+        with self._lock:
+            self._contesti[id_contesto] = {"politica": politica, "registro": registro}
+        rubrica = self.coda.accoda(codici_studenti, criteri, testo_esame, modello, gruppi=gruppi, forza=forza,
+                                   opzioni={**(opzioni or {}), "contesto": id_contesto})
+        self._rilascia_contesto(id_contesto)  # Nessun lavoro da eseguire (es. tutti già completati)
+        return rubrica
+
+    def _rilascia_contesto(self, id_contesto):
+        if id_contesto is not None and not self.coda.contesto_aperto(id_contesto):
+            with self._lock:
+                self._contesti.pop(id_contesto, None)
+
+    @property
+    def attivo(self):
+        """True se il thread è in esecuzione: se si è fermato, i lavori accodati non avanzano finché non si chiama avvia."""
+        return self._thread is not None and self._thread.is_alive()
+
+    def avvia(self):
+        """Avvia il thread se non è già attivo (i lavori rimasti in corso da un'esecuzione precedente vengono ripresi)."""
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return self
+            if self._thread is None:
+                self.coda.rilascia_interrotti()
+            self._fermato.clear()
+            self.errore = None
+            self._thread = threading.Thread(target=self._ciclo, name="lavoratore-coda-correzioni", daemon=True)
+            self._thread.start()
+        return self
+
+    def notifica(self):
+        """Sveglia il thread dopo aver accodato nuovi lavori."""
+        self._risveglio.set()
+
+    def ferma(self):
+        self._fermato.set()
+        self._risveglio.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _ciclo(self):
+        try:
+            with ThreadPoolExecutor(max_workers=MAX_THREAD_LAVORATORE) as executor:
+                in_corso = {}  # future -> id del lavoro
+                ultimo_rinnovo = time.monotonic()
+                while not self._fermato.is_set():
+                    while len(in_corso) < max(1, min(self.max_workers, MAX_THREAD_LAVORATORE)):
+                        lavoro = self.coda.prendi()
+                        if lavoro is None:
+                            break
+                        in_corso[executor.submit(self._esegui, lavoro)] = lavoro["id"]
+                    if in_corso:
+                        completati, _ = wait(in_corso, timeout=self.intervallo_attesa, return_when=FIRST_COMPLETED)
+                        for future in completati:
+                            del in_corso[future]
+                    else:
+                        self._risveglio.wait(self.intervallo_attesa)
+                        self._risveglio.clear()
+                    if in_corso and time.monotonic() - ultimo_rinnovo >= INTERVALLO_RINNOVO_SECONDI:
+                        self.coda.rinnova(list(in_corso.values()))
+                        ultimo_rinnovo = time.monotonic()
+                wait(in_corso)
+        except Exception as e:
+            # Il thread termina: la pagina che segue la correzione lo vede da attivo e mostra l'errore
+            self.errore = e
+            raise
+
+    def _esegui(self, lavoro):
+        with self._lock:
+            contesto = self._contesti.get(lavoro["opzioni"].get("contesto"), {})
+        registro = contesto.get("registro")
+        uso = {}
+        try:
+            opzioni = lavoro["opzioni"]
+            if registro is not None and registro.budget_superato():
+                contenuto, errore = None, MESSAGGIO_BUDGET
+            elif opzioni.get("modelli_ensemble"):
+                # Il modello del lavoro è l'etichetta dell'ensemble: i modelli e la soglia sono nelle opzioni
+                contenuto, errore = correggi_codice_ensemble(
+                    lavoro["codice"], lavoro["criteri"], lavoro["testo_esame"], opzioni["modelli_ensemble"],
+                    self.client, opzioni.get("soglia_voti"), self.cache, bool(lavoro["forza"]), info_uso=uso,
+                    registro=registro, studente=lavoro["studente"], politica=contesto.get("politica"),
+                    cache_funzioni=opzioni.get("cache_funzioni", False),
+                    output_strutturato=opzioni.get("output_strutturato", False)
+                )
+            else:
+                contenuto, errore = correggi_codice(
+                    lavoro["codice"], lavoro["criteri"], lavoro["testo_esame"], lavoro["modello"], self.client,
+                    cache=self.cache, forza_ricorrezione=bool(lavoro["forza"]), info_uso=uso, registro=registro,
+                    studente=lavoro["studente"], politica=contesto.get("politica"),
+                    cache_funzioni=opzioni.get("cache_funzioni", False),
+                    output_strutturato=opzioni.get("output_strutturato", False)
+                )
+        except Exception as e: # correggi_codice gestisce già gli errori, ma il lavoro non deve restare in corso
+            contenuto, errore = None, f"Unexpected Error: {e}"
+        if errore or contenuto is None:
+            self.coda.fallisci(lavoro["id"], errore or "Received no response content from the LLM.")
+        else:
+            self.coda.completa(lavoro["id"], contenuto, uso)
+        self._rilascia_contesto(lavoro["opzioni"].get("contesto"))
@@ -0,0 +1,168 @@
+import re
+import json
+import hashlib
+from collections.abc import Mapping
+
+from grading.memo import memoizza_per_contenuto
+from grading.c_analysis import _PAROLE_CHIAVE_C
+from grading.parsing import estrai_json_da_risposta
+
+# Scanner per la normalizzazione: a differenza di tokenizza_c produce tutti i token
+# (operatori, numeri e stringhe compresi), perché due consegne sono equivalenti solo
+# se differiscono esclusivamente per spazi, commenti e nomi delle variabili.
+_PATTERN_TOKEN_NORMALIZZAZIONE = re.compile(
+    r"(?P<commento>//[^\n]*|/\*[\s\S]*?(?:\*/|\Z))"
+    r"|(?P<stringa>\"(?:\\[\s\S]|[^\"\\\n])*\"?|'(?:\\[\s\S]|[^'\\\n])*'?)"
+    r"|(?P<preprocessore>^[ \t]*\#(?:\\\r?\n|[^\n])*)"
+    r"|(?P<identificatore>[A-Za-z_]\w*)"
+    r"|(?P<numero>\.?\d(?:[eEpP][+-]|[\w.])*)"
+    r"|(?P<operatore>->|\+\+|--|<<=?|>>=?|&&|\|\||\.\.\.|[-+*/%&|^!=<>]=?|\S)",
+    re.MULTILINE
+)
+
+# Nomi della libreria standard che non vengono rinominati: scambiarli con una variabile
+# cambierebbe il significato del programma
+_NOMI_LIBRERIA = frozenset((
+    "NULL", "EOF", "FILE", "stdin", "stdout", "stderr", "errno", "size_t", "bool", "true", "false",
+    "RAND_MAX", "INT_MAX", "INT_MIN", "UINT_MAX", "LONG_MAX", "LONG_MIN", "CHAR_MAX", "CHAR_MIN",
+    "EXIT_SUCCESS", "EXIT_FAILURE",
+))
+
+
+@memoizza_per_contenuto()
+def normalizza_codice(code_string):
+    """
+    Forma normalizzata di una consegna: commenti e spazi eliminati, direttive del preprocessore
+    con spazi uniformati, variabili (e tipi/campi definiti dallo studente) rinominate nell'ordine
+    di prima apparizione. Le parole chiave, i nomi della libreria standard e i nomi di funzione
+    (identificatori seguiti da '(') restano invariati: i criteri di correzione si riferiscono alle funzioni.
+    Restituisce (impronta, righe_token): l'hash SHA-256 della forma normalizzata e la riga
+    di ogni token, usata per riportare le annotazioni da una consegna equivalente all'altra.
+    """
+    token = []
+    riga = 1
+    ultima_posizione = 0
+    for match in _PATTERN_TOKEN_NORMALIZZAZIONE.finditer(code_string):
+        inizio = match.start()
+        riga += code_string.count("\n", ultima_posizione, inizio)
+        ultima_posizione = inizio
+        tipo = match.lastgroup
+        if tipo == "commento":
+            continue
+        valore = match.group()
+        if tipo == "preprocessore":
+            valore = " ".join(valore.replace("\\\n", " ").split())
+        token.append((tipo, valore, riga))
+
+    nomi_funzione = {
+        valore for (tipo, valore, _), successivo in zip(token, token[1:])
+        if tipo == "identificatore" and successivo[1] == "("
+    }
+    nomi_canonici = {}
+    parti = []
+    for tipo, valore, _ in token:
+        if tipo == "identificatore" and valore not in _PAROLE_CHIAVE_C and valore not in _NOMI_LIBRERIA \
+                and valore not in nomi_funzione:
+            valore = nomi_canonici.setdefault(valore, f"${len(nomi_canonici)}")
+        parti.append(valore)
+    impronta = hashlib.sha256("\x00".join(parti).encode("utf-8", "surrogatepass")).hexdigest()
+    return impronta, tuple(riga for _, _, riga in token)
+
+
+def impronta_codice(code_string):
+    """Hash della forma normalizzata del codice (vedi normalizza_codice)."""
+    return normalizza_codice(code_string)[0]
+
+
+@memoizza_per_contenuto()
+def mappa_righe(codice_origine, codice_destinazione):
+    """
+    Corrispondenza {riga di codice_origine: riga di codice_destinazione} tra due consegne con la
+    stessa impronta, ottenuta allineando i token uno a uno (ogni riga va alla riga del suo primo token).
+    Le righe senza token (vuote o di solo commento) vanno alla riga corrispondente più vicina che le precede.
+    """
+    _, righe_origine = normalizza_codice(codice_origine)
+    _, righe_destinazione = normalizza_codice(codice_destinazione)
+    corrispondenze = {}
+    for riga_origine, riga_destinazione in zip(righe_origine, righe_destinazione):
+        corrispondenze.setdefault(riga_origine, riga_destinazione)
+    mappa = {}
+    ultima = 1
+    for riga in range(1, codice_origine.count("\n") + 2):
+        ultima = corrispondenze.get(riga, ultima)
+        mappa[riga] = ultima
+    return mappa
+
+
+def riporta_correzioni(contenuto_risposta, codice_origine, codice_destinazione):
+    """
+    Adatta la risposta dell'LLM ottenuta per codice_origine a una consegna equivalente
+    (codice_destinazione): i numeri di riga delle annotazioni vengono riportati sulle righe
+    corrispondenti. Se la risposta non è un array JSON valido viene restituita invariata
+    (l'errore verrà segnalato come per la consegna originale).
+    """
+    if contenuto_risposta is None or codice_origine == codice_destinazione:
+        return contenuto_risposta
+    json_estratto, errore = estrai_json_da_risposta(contenuto_risposta)
+    if errore:
+        return contenuto_risposta
+    try:
+        annotazioni = json.loads(json_estratto)
+    except json.JSONDecodeError:
+        return contenuto_risposta
+    if not isinstance(annotazioni, list):
+        return contenuto_risposta
+
+    mappa = mappa_righe(codice_origine, codice_destinazione)
+    riportate = []
+    for annotazione in annotazioni:
+        if isinstance(annotazione, dict) and "line" in annotazione:
+            try:
+                riga = int(annotazione["line"])
+            except (TypeError, ValueError):
+                pass
+            else:
+                if riga in mappa:
+                    annotazione = dict(annotazione, line=str(mappa[riga]))
+        riportate.append(annotazione)
+    return json.dumps(riportate, ensure_ascii=False)
+
+
+class GruppiDuplicati:
+    """
+    Consegne raggruppate per impronta normalizzata: ogni gruppo viene corretto una sola volta
+    (dal suo rappresentante, il primo nome in ordine alfabetico) e il risultato viene riportato
+    sugli altri membri.
+    """
+
+    def __init__(self, impronte):
+        self.impronte = dict(impronte)
+        self.gruppi = {}
+        for nome_studente in sorted(self.impronte):
+            self.gruppi.setdefault(self.impronte[nome_studente], []).append(nome_studente)
+
+    def rappresentante(self, nome_studente):
+        impronta = self.impronte.get(nome_studente)
+        return self.gruppi[impronta][0] if impronta is not None else nome_studente
+
+    def duplicati(self, nome_rappresentante):
+        """Gli altri membri del gruppo di nome_rappresentante."""
+        impronta = self.impronte.get(nome_rappresentante)
+        return self.gruppi[impronta][1:] if impronta is not None else []
+
+    def gruppi_con_duplicati(self):
+        return [nomi for nomi in self.gruppi.values() if len(nomi) > 1]
+
+    @property
+    def chiamate_risparmiate(self):
+        return len(self.impronte) - len(self.gruppi)
+
+
+def raggruppa_duplicati(codici_studenti):
+    """
+    Calcola l'impronta di ogni consegna e restituisce i GruppiDuplicati. codici_studenti è un mapping
+    {nome_studente: codice_c} o un iterabile di coppie (nome_studente, codice_c) letto una sola volta,
+    es. ArchivioConsegne.itera_codici(): dei codici resta solo l'impronta.
+    """
+    coppie = codici_studenti.items() if isinstance(codici_studenti, Mapping) else codici_studenti
+    return GruppiDuplicati({nome_studente: impronta_codice(codice) for nome_studente, codice in coppie})
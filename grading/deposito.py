@@ -0,0 +1,363 @@
+import os
+import mmap
+import time
+import hashlib
+import zipfile
+import tempfile
+import threading
+from collections import OrderedDict
+
+from grading.cache import PERCORSO_CACHE_PREDEFINITO
+
+# Cartella predefinita dei contenuti, accanto alla cache delle risposte
+CARTELLA_DEPOSITO_PREDEFINITA = os.path.join(os.path.dirname(PERCORSO_CACHE_PREDEFINITO), "contenuti")
+
+# Limite predefinito dei caratteri di testo decodificato tenuti in memoria (condivisi da tutte le sessioni)
+MAX_CARATTERI_TESTI_PREDEFINITO = 64 * 1024 * 1024
+
+# Limiti predefiniti dei contenuti su disco, come per la cache delle risposte: dimensione totale
+# e tempo dall'ultimo uso
+MAX_BYTE_PREDEFINITO = 2 * 1024 * 1024 * 1024  # 2 GB
+MAX_ETA_SECONDI_PREDEFINITO = 7 * 24 * 3600  # 7 giorni
+
+# File tenuti aperti al più (contenuti mappati e archivi zip), riaperti se servono di nuovo
+MAX_MAPPE_APERTE = 256
+MAX_ZIP_APERTI = 8
+
+# Dimensione dei blocchi con cui vengono copiati i file caricati non già in memoria
+DIMENSIONE_BLOCCO = 1024 * 1024
+
+
+class DepositoContenuti:
+    """
+    Deposito dei file caricati (archivi .zip e consegne) indirizzato per contenuto, condiviso dal processo:
+    ogni contenuto è scritto una sola volta su disco con nome uguale al suo hash SHA-256 e letto
+    tramite mmap, così le viste (memoryview) e le loro slice non copiano i byte e le pagine
+    sono condivise da tutte le sessioni. Nello stato di una sessione restano solo gli hash.
+    I testi decodificati (UTF-8) sono tenuti in una cache LRU unica, limitata a max_caratteri_testi.
+    Su disco i contenuti non usati da max_eta_secondi vengono rimossi, e quelli usati meno di recente
+    quando si supera max_byte, tranne gli archivi trattenuti da una sessione (vedi trattieni) e le loro
+    consegne. Restano aperti al più MAX_MAPPE_APERTE contenuti mappati e MAX_ZIP_APERTI archivi.
+    È sicuro da usare da più thread e da più sessioni Streamlit.
+    """
+
+    def __init__(self, cartella=CARTELLA_DEPOSITO_PREDEFINITA, max_caratteri_testi=MAX_CARATTERI_TESTI_PREDEFINITO,
+                 max_byte=MAX_BYTE_PREDEFINITO, max_eta_secondi=MAX_ETA_SECONDI_PREDEFINITO):
+        self.cartella = cartella
+        self.max_caratteri_testi = max_caratteri_testi
+        self.max_byte = max_byte
+        self.max_eta_secondi = max_eta_secondi
+        os.makedirs(cartella, exist_ok=True)
+        self._lock = threading.Lock()
+        self._mappe = OrderedDict()  # impronta -> mmap in sola lettura (ordine LRU)
+        self._testi = OrderedDict()  # impronta -> testo decodificato (ordine LRU)
+        self._caratteri_testi = 0
+        self._zip = OrderedDict()  # impronta dell'archivio -> (zipfile.ZipFile, lock delle letture) (ordine LRU)
+        self._membri = {}  # (impronta dell'archivio, nome del membro) -> impronta del membro
+        self._trattenuti = {}  # impronta dell'archivio -> numero di sessioni che lo usano
+        self._indice = None  # impronta -> [dimensione, ultimo uso] (ordine LRU), letto dal disco al primo uso
+        self._byte_totali = 0
+
+    def _percorso(self, impronta):
+        return os.path.join(self.cartella, impronta[:2], impronta)
+
+    def _carica_indice(self):
+        """Indice dei contenuti su disco, ordinati per ultima modifica (chiamata con il lock)."""
+        if self._indice is not None:
+            return
+        voci = []
+        for sottocartella in os.scandir(self.cartella):
+            if not sottocartella.is_dir() or len(sottocartella.name) != 2:
+                continue
+            for voce in os.scandir(sottocartella.path):
+                if voce.is_file() and voce.name.startswith(sottocartella.name):
+                    stato = voce.stat()
+                    voci.append((stato.st_mtime, voce.name, stato.st_size))
+        self._indice = OrderedDict((impronta, [dimensione, ultimo_uso]) for ultimo_uso, impronta, dimensione in sorted(voci))
+        self._byte_totali = sum(dimensione for dimensione, _ in self._indice.values())
+
+    def _usa(self, impronta, dimensione=None):
+        """Segna il contenuto come appena usato (chiamata con il lock)."""
+        self._carica_indice()
+        voce = self._indice.get(impronta)
+        if voce is None:
+            if dimensione is None:
+                return
+            voce = self._indice[impronta] = [dimensione, 0.0]
+            self._byte_totali += dimensione
+        voce[1] = time.time()
+        self._indice.move_to_end(impronta)
+
+    def _registra_scrittura(self, impronta, dimensione):
+        with self._lock:
+            self._usa(impronta, dimensione)
+            self._evict(time.time(), appena_scritto=impronta)
+
+    def _evict(self, adesso, appena_scritto=None):
+        # Consegne degli archivi in uso: rimuoverle costringerebbe a decomprimerle di nuovo a ogni accesso.
+        # Il contenuto appena scritto serve a chi l'ha aggiunto, anche se da solo supera il limite
+        protetti = set(self._trattenuti) | {appena_scritto}
+        protetti.update(membro for (archivio, _), membro in self._membri.items() if archivio in self._trattenuti)
+        da_rimuovere = []
+        byte_totali = self._byte_totali
+        for impronta, (dimensione, ultimo_uso) in self._indice.items():
+            # 1. I contenuti non usati da max_eta_secondi (anche se trattenuti: la sessione è ormai inattiva)
+            scaduto = self.max_eta_secondi and adesso - ultimo_uso > self.max_eta_secondi
+            # 2. Quelli usati meno di recente finché non si rientra nel limite
+            if scaduto or (byte_totali > self.max_byte and impronta not in protetti):
+                da_rimuovere.append(impronta)
+                byte_totali -= dimensione
+            elif byte_totali <= self.max_byte:
+                break
+        for impronta in da_rimuovere:
+            self._rimuovi(impronta)
+
+    def _rimuovi(self, impronta):
+        """Rimuove un contenuto dal disco, dall'indice e dalle cache, chiudendone mappa e archivio (con il lock)."""
+        voce = self._indice.pop(impronta, None)
+        if voce is not None:
+            self._byte_totali -= voce[0]
+        self._chiudi_mappa(self._mappe.pop(impronta, None))
+        testo = self._testi.pop(impronta, None)
+        if testo is not None:
+            self._caratteri_testi -= len(testo)
+        self._chiudi_zip(self._zip.pop(impronta, None))
+        for chiave in [chiave for chiave, membro in self._membri.items() if impronta in (chiave[0], membro)]:
+            del self._membri[chiave]
+        try:
+            os.remove(self._percorso(impronta))
+        except OSError:  # Già rimosso da un altro processo, o ancora aperto (Windows): riprova alla prossima evizione
+            pass
+
+    @staticmethod
+    def _chiudi_mappa(mappa):
+        if mappa is None:
+            return
+        try:
+            mappa.close()
+        except BufferError:
+            # Ci sono ancora viste in uso: la mappa si chiude da sola quando vengono rilasciate
+            pass
+
+    @staticmethod
+    def _chiudi_zip(voce):
+        if voce is not None:
+            archivio, lock_letture = voce
+            with lock_letture:
+                archivio.close()
+
+    def _scrivi(self, impronta, blocchi):
+        percorso = self._percorso(impronta)
+        if os.path.exists(percorso):
+            return
+        cartella = os.path.dirname(percorso)
+        os.makedirs(cartella, exist_ok=True)
+        # Scrittura atomica: un'altra sessione non vede mai un file scritto a metà
+        descrittore, temporaneo = tempfile.mkstemp(dir=cartella)
+        try:
+            with os.fdopen(descrittore, "wb") as f:
+                for blocco in blocchi:
+                    f.write(blocco)
+            os.replace(temporaneo, percorso)
+        except BaseException:
+            if os.path.exists(temporaneo):
+                os.remove(temporaneo)
+            raise
+
+    def aggiungi(self, dati):
+        """Salva dati (bytes, bytearray o memoryview) se non sono già presenti e ne restituisce l'impronta."""
+        vista = memoryview(dati)
+        impronta = hashlib.sha256(vista).hexdigest()
+        self._scrivi(impronta, [vista])
+        self._registra_scrittura(impronta, vista.nbytes)
+        return impronta
+
+    def aggiungi_file(self, file_obj):
+        """
+        Salva il contenuto di un file (es. l'UploadedFile di Streamlit) e ne restituisce l'impronta.
+        I file già in memoria (io.BytesIO) vengono letti senza copia; gli altri a blocchi.
+        """
+        if hasattr(file_obj, "getbuffer"):
+            with file_obj.getbuffer() as vista:
+                return self.aggiungi(vista)
+        file_obj.seek(0)
+        h = hashlib.sha256()
+        dimensione = 0
+        descrittore, temporaneo = tempfile.mkstemp(dir=self.cartella)
+        try:
+            with os.fdopen(descrittore, "wb") as f:
+                for blocco in iter(lambda: file_obj.read(DIMENSIONE_BLOCCO), b""):
+                    h.update(blocco)
+                    f.write(blocco)
+                    dimensione += len(blocco)
+            impronta = h.hexdigest()
+            percorso = self._percorso(impronta)
+            if not os.path.exists(percorso):
+                os.makedirs(os.path.dirname(percorso), exist_ok=True)
+                os.replace(temporaneo, percorso)
+        finally:
+            if os.path.exists(temporaneo):
+                os.remove(temporaneo)
+        self._registra_scrittura(impronta, dimensione)
+        return impronta
+
+    def contiene(self, impronta):
+        return os.path.exists(self._percorso(impronta))
+
+    def trattieni(self, impronta):
+        """
+        Segna l'archivio come in uso da una sessione: né lui né le sue consegne vengono rimossi
+        per fare spazio finché la sessione non chiama rilascia.
+        """
+        with self._lock:
+            self._trattenuti[impronta] = self._trattenuti.get(impronta, 0) + 1
+
+    def rilascia(self, impronta):
+        """
+        La sessione non usa più l'archivio: se nessun'altra lo trattiene, l'archivio e le sue consegne
+        (quelle che non appartengono ad altri archivi in uso) vengono rimossi dal deposito.
+        """
+        with self._lock:
+            rimanenti = self._trattenuti.get(impronta, 0) - 1
+            if rimanenti > 0:
+                self._trattenuti[impronta] = rimanenti
+                return
+            self._trattenuti.pop(impronta, None)
+            self._carica_indice()
+            in_uso = {membro for (archivio, _), membro in self._membri.items() if archivio in self._trattenuti}
+            membri = {membro for (archivio, _), membro in self._membri.items() if archivio == impronta}
+            for membro in membri - in_uso:
+                self._rimuovi(membro)
+            self._rimuovi(impronta)
+
+    def vista(self, impronta):
+        """memoryview in sola lettura del contenuto: mappato in memoria, senza copie (anche per le slice)."""
+        with self._lock:
+            mappa = self._mappe.get(impronta)
+            if mappa is None:
+                with open(self._percorso(impronta), "rb") as f:
+                    if os.fstat(f.fileno()).st_size == 0:
+                        return memoryview(b"")  # mmap non accetta file vuoti
+                    mappa = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                self._mappe[impronta] = mappa
+                # Chiude le mappe usate meno di recente: le viste ancora in uso restano valide
+                while len(self._mappe) > MAX_MAPPE_APERTE:
+                    self._chiudi_mappa(self._mappe.popitem(last=False)[1])
+            self._mappe.move_to_end(impronta)
+            self._usa(impronta)
+        return memoryview(mappa)
+
+    def testo(self, impronta, decodifica=None):
+        """
+        Contenuto decodificato, dalla cache LRU condivisa o decodificato ora dalla vista mappata
+        con decodifica (funzione byte -> str; predefinita UTF-8).
+        """
+        with self._lock:
+            if impronta in self._testi:
+                self._testi.move_to_end(impronta)
+                self._usa(impronta)
+                return self._testi[impronta]
+        testo = decodifica(self.vista(impronta)) if decodifica is not None else str(self.vista(impronta), "utf-8")
+        with self._lock:
+            if impronta not in self._testi and len(testo) <= self.max_caratteri_testi:
+                self._testi[impronta] = testo
+                self._caratteri_testi += len(testo)
+                # Rimuove i testi usati meno di recente finché non si rientra nel limite
+                while self._caratteri_testi > self.max_caratteri_testi:
+                    _, testo_rimosso = self._testi.popitem(last=False)
+                    self._caratteri_testi -= len(testo_rimosso)
+        return testo
+
+    def _apri_zip(self, impronta):
+        """(ZipFile, lock delle letture) dell'archivio, riaperto se era stato chiuso."""
+        with self._lock:
+            voce = self._zip.get(impronta)
+            if voce is None:
+                voce = self._zip[impronta] = (zipfile.ZipFile(self._percorso(impronta), "r"), threading.Lock())
+                while len(self._zip) > MAX_ZIP_APERTI:
+                    self._chiudi_zip(self._zip.popitem(last=False)[1])
+            self._zip.move_to_end(impronta)
+            self._usa(impronta)
+            return voce
+
+    def membri_zip(self, impronta):
+        """
+        Elenco dei membri (zipfile.ZipInfo) dell'archivio salvato con questa impronta.
+        Solleva zipfile.BadZipFile se il contenuto non è un archivio valido.
+        """
+        archivio, lock_letture = self._apri_zip(impronta)
+        with lock_letture:
+            return archivio.infolist()
+
+    def leggi_membro_zip(self, impronta_zip, nome_membro):
+        """Byte del membro dell'archivio, letti dallo zip (senza salvarli nel deposito)."""
+        while True:
+            archivio, lock_letture = self._apri_zip(impronta_zip)
+            with lock_letture:
+                # Chiuso da un altro thread per far posto a un altro archivio: lo si riapre
+                if archivio.fp is not None:
+                    return archivio.read(nome_membro)
+
+    def membro_zip(self, impronta_zip, nome_membro):
+        """
+        Impronta del file nome_membro dell'archivio: al primo accesso (di qualunque sessione)
+        il membro viene decompresso e salvato nel deposito, poi basta l'indice.
+        """
+        chiave = (impronta_zip, nome_membro)
+        with self._lock:
+            if chiave in self._membri:
+                return self._membri[chiave]
+        impronta = self.aggiungi(self.leggi_membro_zip(impronta_zip, nome_membro))
+        with self._lock:
+            self._membri[chiave] = impronta
+        return impronta
+
+    def statistiche(self):
+        with self._lock:
+            self._carica_indice()
+            return {
+                "contenuti": len(self._indice),
+                "byte_su_disco": self._byte_totali,
+                "contenuti_mappati": len(self._mappe),
+                "byte_mappati": sum(len(mappa) for mappa in self._mappe.values() if not mappa.closed),
+                "testi": len(self._testi),
+                "caratteri_testi": self._caratteri_testi,
+                "archivi": len(self._zip),
+            }
+
+
+class FileDeposito:
+    """
+    Riferimento a un file del deposito con l'interfaccia usata dalle pagine per i file caricati
+    (name, size, getvalue()): nello stato della sessione occupa solo il nome e l'impronta.
+    """
+
+    def __init__(self, deposito, impronta, name):
+        self.deposito = deposito
+        self.impronta = impronta
+        self.name = name
+
+    @property
+    def size(self):
+        return len(self.deposito.vista(self.impronta))
+
+    def getvalue(self):
+        """Vista (memoryview) del contenuto, senza copia."""
+        return self.deposito.vista(self.impronta)
+
+    def getbytes(self):
+        """Copia del contenuto in bytes, per le API che non accettano memoryview (es. st.download_button)."""
+        return self.deposito.vista(self.impronta).tobytes()
+
+
+_deposito_processo = None
+_lock_deposito_processo = threading.Lock()
+
+
+def deposito_condiviso():
+    """Il DepositoContenuti del processo (nella cartella predefinita), creato al primo uso."""
+    global _deposito_processo
+    with _lock_deposito_processo:
+        if _deposito_processo is None:
+            _deposito_processo = DepositoContenuti()
+        return _deposito_processo
@@ -0,0 +1,202 @@
+import re
+import copy
+import json
+import difflib
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from grading.llm import correggi_codice, _somma_uso
+from grading.parsing import estrai_json_da_risposta
+from grading.resilienza import PoliticaChiamate
+
+# Due annotazioni sulla stessa riga descrivono lo stesso errore se i testi dei criteri
+# (normalizzati) hanno almeno questa similarità (difflib, da 0 a 1)
+SOGLIA_SIMILARITA_CRITERI = 0.5
+
+# Deduzione indicata nel commento in linea, come in evidenzia_errori_json: il commento prevale su point_deduction
+_PATTERN_PUNTI_COMMENTO = re.compile(r"//\*+\s*(.*?)\s*(-?\d+(?:\.\d+)?)(?:\s*\*+)?$")
+
+
+def soglia_maggioranza(numero_modelli):
+    """Voti necessari per tenere un errore se non indicati: la maggioranza dei modelli."""
+    return numero_modelli // 2 + 1
+
+
+def etichetta_ensemble(modelli, soglia_voti=None):
+    """Nome con cui la correzione di un ensemble compare nella coda, nel registro e nei messaggi."""
+    soglia_voti = soglia_voti or soglia_maggioranza(len(modelli))
+    return f"ensemble({', '.join(modelli)}; {soglia_voti}/{len(modelli)})"
+
+
+def _normalizza_criterio(testo):
+    return " ".join(re.findall(r"\w+", str(testo or "").lower()))
+
+
+def _deduzione(errore):
+    commento = errore.get("inline_comment")
+    if commento:
+        match = _PATTERN_PUNTI_COMMENTO.search(str(commento).strip())
+        if match:
+            return float(match.group(2))
+    try:
+        return float(errore.get("point_deduction", 0))
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def _riga(errore):
+    try:
+        return int(errore.get("line"))
+    except (TypeError, ValueError):
+        return None
+
+
+def raggruppa_errori(errori_per_modello, soglia_similarita=SOGLIA_SIMILARITA_CRITERI):
+    """
+    Raggruppa le annotazioni dei modelli ({modello: lista di errori}, nell'ordine dei modelli) che indicano
+    lo stesso errore: stessa riga e criteri simili. Ogni modello vota al più una volta per gruppo.
+    Restituisce la lista dei gruppi, ciascuno {"riga", "criterio", "voti": {modello: errore}}.
+    """
+    gruppi = []
+    for modello, errori in errori_per_modello.items():
+        for errore in errori:
+            if not isinstance(errore, dict):
+                continue
+            riga, criterio = _riga(errore), _normalizza_criterio(errore.get("criteria"))
+            migliore, similarita_migliore = None, soglia_similarita
+            for gruppo in gruppi:
+                if gruppo["riga"] != riga or modello in gruppo["voti"]:
+                    continue
+                similarita = difflib.SequenceMatcher(None, gruppo["criterio"], criterio).ratio()
+                if similarita >= similarita_migliore:
+                    migliore, similarita_migliore = gruppo, similarita
+            if migliore is None:
+                gruppi.append({"riga": riga, "criterio": criterio, "voti": {modello: errore}})
+            else:
+                migliore["voti"][modello] = errore
+    return gruppi
+
+
+def unisci_errori_votati(gruppi, soglia_voti):
+    """
+    Errori tenuti dall'ensemble: un'annotazione per ogni gruppo con almeno soglia_voti voti.
+    Tra le annotazioni del gruppo si usa quella con la deduzione mediana (la più lieve tra le due
+    centrali), così commento e punti restano quelli scritti da un modello.
+    """
+    uniti = []
+    for gruppo in gruppi:
+        if len(gruppo["voti"]) < soglia_voti:
+            continue
+        annotazioni = sorted(gruppo["voti"].values(), key=_deduzione, reverse=True)
+        uniti.append(annotazioni[(len(annotazioni) - 1) // 2])
+    uniti.sort(key=lambda errore: (_riga(errore) is None, _riga(errore) or 0))
+    return uniti
+
+
+def esito_deciso(gruppi, risposte_mancanti, soglia_voti):
+    """
+    True se le risposte ancora mancanti non possono più cambiare il risultato del voto: nessun errore
+    nuovo può raggiungere la soglia e ogni gruppo l'ha già raggiunta o non può più raggiungerla.
+    """
+    if risposte_mancanti >= soglia_voti:
+        return False
+    return all(
+        len(gruppo["voti"]) >= soglia_voti or len(gruppo["voti"]) + risposte_mancanti < soglia_voti
+        for gruppo in gruppi
+    )
+
+
+# Correzione dello stesso codice con più modelli in parallelo (ensemble), con le stesse opzioni di correggi_codice.
+# Gli errori delle risposte vengono raggruppati per riga e criterio e si tengono quelli indicati da almeno
+# soglia_voti modelli (predefinito: la maggioranza). Appena le risposte arrivate bastano a decidere il voto,
+# le chiamate ancora in corso non vengono più attese: come per l'hedging non vengono interrotte, ma la loro
+# risposta viene solo salvata in cache. Il tempo totale resta quindi quello del modello più lento tra quelli necessari.
+# Le chiamate non attese sono comunque pagate: vengono registrate nel registro quando terminano, e il loro uso
+# di token viene aggiunto a info_uso in quel momento (dopo che la funzione ha già restituito il risultato).
+# I modelli di riserva della politica non si applicano: un modello non disponibile conta come un voto mancante.
+# Se info_ensemble è un dizionario, viene riempito con gli errori trovati da ogni modello, i modelli in errore,
+# quelli non attesi e se il consenso è stato raggiunto prima di tutte le risposte.
+# Restituisce (contenuto_risposta, errore) come correggi_codice: contenuto_risposta è l'array JSON degli errori uniti.
+def correggi_codice_ensemble(codice_studente, criteri, testo_esame, modelli, client, soglia_voti=None, cache=None,
+                             forza_ricorrezione=False, info_uso=None, registro=None, studente=None, politica=None,
+                             cache_funzioni=False, output_strutturato=False, info_ensemble=None):
+    modelli = list(dict.fromkeys(modello for modello in modelli if modello))
+    if not modelli:
+        return None, "Error: no models selected for the ensemble."
+    soglia_voti = soglia_voti or soglia_maggioranza(len(modelli))
+    if not 1 <= soglia_voti <= len(modelli):
+        return None, f"Error: the voting threshold must be between 1 and {len(modelli)}."
+
+    politica_modelli = copy.copy(politica if politica is not None else PoliticaChiamate())
+    politica_modelli.modelli_riserva = []
+    usi = {modello: {} for modello in modelli}
+
+    def correggi_con(modello):
+        return correggi_codice(
+            codice_studente, criteri, testo_esame, modello, client, cache, forza_ricorrezione,
+            info_uso=usi[modello], registro=registro, studente=studente, politica=politica_modelli,
+            cache_funzioni=cache_funzioni, output_strutturato=output_strutturato
+        )
+
+    errori_per_modello = {}
+    errori_modelli = {}
+    in_corso = {}
+    executor = ThreadPoolExecutor(max_workers=len(modelli))
+    try:
+        in_corso = {executor.submit(correggi_con, modello): modello for modello in modelli}
+        gruppi = []
+        while in_corso:
+            completati, _ = wait(in_corso, return_when=FIRST_COMPLETED)
+            for future in completati:
+                modello = in_corso.pop(future)
+                try:
+                    contenuto, errore = future.result()
+                except Exception as e: # correggi_codice gestisce già gli errori, ma per sicurezza
+                    contenuto, errore = None, f"Unexpected Error: {e}"
+                errori = None
+                if not errore:
+                    json_estratto, errore = estrai_json_da_risposta(contenuto)
+                if not errore:
+                    try:
+                        errori = json.loads(json_estratto)
+                    except ValueError as e: # Anche json.JSONDecodeError: un modello non valido conta come in errore
+                        errore = f"Error parsing LLM JSON response: {e}"
+                if not isinstance(errori, list):
+                    errori_modelli[modello] = errore or "Expected a JSON array (list) from LLM."
+                    continue
+                errori_per_modello[modello] = errori
+            # Raggruppa nell'ordine dei modelli, non di arrivo, così il risultato non dipende dalle latenze
+            gruppi = raggruppa_errori({m: errori_per_modello[m] for m in modelli if m in errori_per_modello})
+            if in_corso and esito_deciso(gruppi, len(in_corso), soglia_voti):
+                break
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    non_attesi = [modello for modello in modelli if modello in in_corso.values()]
+    if info_uso is not None:
+        lock_uso = threading.Lock()
+
+        def aggiungi_uso(modello):
+            with lock_uso:
+                info_uso.update(_somma_uso([info_uso, usi[modello]]))
+
+        with lock_uso:
+            info_uso.update(_somma_uso(usi[modello] for modello in modelli if modello not in non_attesi))
+        # Il callback parte nel thread della chiamata quando termina (subito, se è già terminata)
+        for future, modello in in_corso.items():
+            future.add_done_callback(lambda _, modello=modello: aggiungi_uso(modello))
+    if info_ensemble is not None:
+        info_ensemble.update({
+            "errori_per_modello": {modello: len(errori) for modello, errori in errori_per_modello.items()},
+            "errori_modelli": errori_modelli,
+            "non_attesi": non_attesi,
+            "consenso_anticipato": bool(non_attesi) and len(errori_per_modello) + len(non_attesi) >= soglia_voti,
+            "soglia_voti": soglia_voti,
+        })
+    # Con meno risposte (arrivate o attese) della soglia nessun errore potrebbe essere tenuto:
+    # il risultato sembrerebbe quello di una consegna perfetta
+    if len(errori_per_modello) + len(non_attesi) < soglia_voti:
+        dettagli = "; ".join(f"{modello}: {errore}" for modello, errore in errori_modelli.items())
+        return None, (f"Error: {len(errori_modelli)} of {len(modelli)} ensemble models failed, too many to reach "
+                      f"the {soglia_voti} votes needed. {dettagli}")
+    return json.dumps(unisci_errori_votati(gruppi, soglia_voti)), None
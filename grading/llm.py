@@ -0,0 +1,395 @@
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from grading.cache import calcola_chiave_cache
+from grading.deduplica import riporta_correzioni
+from grading.verdetti_funzioni import VerdettiFunzioni
+from grading.blocchi import MAX_CARATTERI_BLOCCO, suddividi_in_blocchi, unisci_risposte_blocchi
+from grading.prompt import (
+    costruisci_messaggi, supporta_cache_control, estrai_uso, supporta_output_strutturato, FORMATO_RISPOSTA_STRUTTURATA
+)
+from grading.resilienza import (
+    PoliticaChiamate, errore_ritentabile, errore_modello, errore_richiesta_non_valida, messaggio_errore, esegui_con_hedging
+)
+
+# URL dell'API OpenAI-compatibile di OpenRouter, che fornisce accesso unificato a più modelli LLM
+URL_OPENROUTER = "https://openrouter.ai/api/v1"
+
+# Modello usato se non ne viene scelto un altro
+MODELLO_PREDEFINITO = "deepseek/deepseek-chat-v3-0324"
+
+
+# Connessioni HTTP tenute aperte dal client tra una chiamata e l'altra (keep-alive)
+MAX_CONNESSIONI = 64
+SCADENZA_KEEPALIVE_SECONDI = 300
+
+
+def crea_client(api_key, base_url=URL_OPENROUTER):
+    """
+    Crea il client OpenRouter (usa l'API OpenAI-compatibile).
+    Il client va riutilizzato: tiene un pool di connessioni keep-alive, così le chiamate successive
+    non ripetono l'handshake TLS. L'SDK viene importato qui e non all'import del modulo,
+    perché il suo caricamento è lento e serve solo quando si chiama davvero un modello.
+    """
+    import openai
+
+    # I tentativi sono gestiti da correggi_codice (PoliticaChiamate): l'SDK non ritenta da solo,
+    # altrimenti i due backoff si sommerebbero
+    try:
+        import httpx
+    except ImportError: # SDK con un altro client HTTP: si usa il suo pool predefinito
+        return openai.OpenAI(api_key=api_key, base_url=base_url, max_retries=0)
+    http_client = openai.DefaultHttpxClient(limits=httpx.Limits(
+        max_connections=MAX_CONNESSIONI,
+        max_keepalive_connections=MAX_CONNESSIONI,
+        keepalive_expiry=SCADENZA_KEEPALIVE_SECONDI
+    ))
+    return openai.OpenAI(api_key=api_key, base_url=base_url, max_retries=0, http_client=http_client)
+
+
+def _richiesta_llm(client, modello, messaggi, max_tokens, temperature, timeout, callback_streaming, stato_streaming,
+                   formato_risposta=None):
+    """
+    Esegue una singola richiesta al modello, in streaming se c'è callback_streaming.
+    formato_risposta, se presente, viene inviato come response_format (schema JSON della risposta).
+    Restituisce (contenuto_risposta, uso, tempo_primo_token, troncata), dove troncata indica che la
+    risposta si è interrotta per il limite max_tokens. stato_streaming["frammenti_inviati"]
+    diventa True appena un frammento è stato passato al callback (da lì non si può più ritentare).
+    """
+    inizio_chiamata = time.perf_counter()
+    parametri_formato = {"response_format": formato_risposta} if formato_risposta else {}
+    if not callback_streaming:
+        risposta = client.chat.completions.create(
+            model=modello,
+            messages=messaggi,
+            max_tokens=max_tokens,
+            temperature=temperature,
+            timeout=timeout,
+            **parametri_formato
+        )
+        # Senza streaming il primo token arriva insieme all'intera risposta
+        scelta = risposta.choices[0]
+        return (scelta.message.content, estrai_uso(risposta.usage), time.perf_counter() - inizio_chiamata,
+                getattr(scelta, "finish_reason", None) == "length")
+
+    frammenti = []
+    tempo_primo_token = None
+    uso = None
+    troncata = False
+    stream = client.chat.completions.create(
+        model=modello,
+        messages=messaggi,
+        max_tokens=max_tokens,
+        temperature=temperature,
+        timeout=timeout, # Per lo streaming vale come attesa massima tra un chunk e l'altro
+        stream=True,
+        stream_options={"include_usage": True}, # L'ultimo chunk riporta l'utilizzo dei token
+        **parametri_formato
+    )
+    for chunk in stream:
+        if time.perf_counter() - inizio_chiamata > timeout:
+            stream.close()
+            raise TimeoutError(f"streaming response exceeded {timeout:.0f} seconds")
+        if getattr(chunk, "usage", None):
+            uso = estrai_uso(chunk.usage)
+        if not chunk.choices:
+            continue
+        if getattr(chunk.choices[0], "finish_reason", None) == "length":
+            troncata = True
+        frammento = chunk.choices[0].delta.content
+        if frammento:
+            if tempo_primo_token is None:
+                tempo_primo_token = time.perf_counter() - inizio_chiamata
+            frammenti.append(frammento)
+            stato_streaming["frammenti_inviati"] = True
+            callback_streaming(frammento)
+    return "".join(frammenti), uso, tempo_primo_token, troncata
+
+
+def _chiama_modello(client, codice, criteri, testo_esame, modello_scelto, cache_control, max_tokens, temperature,
+                    callback_streaming, politica, registro, studente, output_strutturato=False):
+    """
+    Invia il codice al modello applicando la PoliticaChiamate (timeout, tentativi con backoff,
+    hedging, modelli di riserva) e registra ogni tentativo nel registro.
+    Con output_strutturato, ai modelli che lo supportano viene chiesto di rispettare lo schema JSON
+    della risposta; se il provider rifiuta response_format si ripete la richiesta senza schema.
+    Restituisce (contenuto_risposta, uso, modello_che_ha_risposto, troncata, errore): in caso di
+    fallimento contenuto_risposta è None ed errore è il messaggio per l'utente.
+    """
+    inizio_correzione = time.perf_counter()
+    stato_streaming = {"frammenti_inviati": False}
+    errore, modello_errore, timeout_errore = None, modello_scelto, None
+
+    for modello in politica.modelli_da_provare(modello_scelto):
+        # Crea i messaggi da inviare al modello: un prefisso stabile (istruzioni, formato JSON, testo d'esame, criteri)
+        # uguale per tutta la classe, seguito dal solo codice dello studente, così da sfruttare la cache dei prompt del provider.
+        # Il modello deve rispondere ESCLUSIVAMENTE con un array JSON di oggetti errore.
+        messaggi = costruisci_messaggi(
+            codice, criteri, testo_esame,
+            cache_control=supporta_cache_control(modello) if cache_control is None else cache_control
+        )
+        stato_formato = {
+            "formato": FORMATO_RISPOSTA_STRUTTURATA if output_strutturato and supporta_output_strutturato(modello) else None
+        }
+        for tentativo in range(1, politica.max_tentativi + 1):
+            tempo_residuo = politica.scadenza_totale - (time.perf_counter() - inizio_correzione)
+            if tempo_residuo <= 0:
+                break
+            timeout = min(politica.timeout, tempo_residuo)
+
+            def esegui():
+                # Utilizzo generico di qualsiasi modello tramite OpenRouter
+                formato = stato_formato["formato"]
+                try:
+                    return _richiesta_llm(client, modello, messaggi, max_tokens, temperature, timeout,
+                                          callback_streaming, stato_streaming, formato)
+                except Exception as e:
+                    if formato is None or stato_streaming["frammenti_inviati"] or not errore_richiesta_non_valida(e):
+                        raise
+                # Schema non accettato dal provider per questo modello: la risposta verrà riparata localmente
+                stato_formato["formato"] = None
+                return _richiesta_llm(client, modello, messaggi, max_tokens, temperature, timeout,
+                                      callback_streaming, stato_streaming)
+
+            inizio_chiamata = time.perf_counter()
+            try:
+                # L'hedging non si applica allo streaming: i frammenti delle due risposte si mescolerebbero
+                soglia_hedging = None if callback_streaming else politica.soglia_hedging(modello)
+                if soglia_hedging is not None and soglia_hedging < timeout:
+                    def registra_scartata(risultato, modello=modello, inizio_chiamata=inizio_chiamata):
+                        # La copia più lenta è pagata anche se la sua risposta non viene usata
+                        registro.registra(modello, studente, latenza=time.perf_counter() - inizio_chiamata,
+                                          tempo_primo_token=risultato[2], **(risultato[1] or {}))
+                    (contenuto_risposta, uso, tempo_primo_token, troncata), _ = esegui_con_hedging(
+                        esegui, soglia_hedging, al_termine_scartata=registra_scartata if registro is not None else None
+                    )
+                else:
+                    contenuto_risposta, uso, tempo_primo_token, troncata = esegui()
+            except Exception as e:
+                if registro is not None:
+                    registro.registra(modello, studente, latenza=time.perf_counter() - inizio_chiamata, errore=str(e))
+                errore, modello_errore, timeout_errore = e, modello, timeout
+                # Una risposta già mostrata in parte non si può ritentare
+                if stato_streaming["frammenti_inviati"] or not errore_ritentabile(e) or tentativo == politica.max_tentativi:
+                    break
+                attesa = politica.attesa(tentativo, e)
+                if time.perf_counter() - inizio_correzione + attesa >= politica.scadenza_totale:
+                    break
+                time.sleep(attesa)
+                continue
+
+            latenza = time.perf_counter() - inizio_chiamata
+            politica.registra_latenza(modello, latenza)
+            if registro is not None:
+                registro.registra(modello, studente, latenza=latenza, tempo_primo_token=tempo_primo_token, **(uso or {}))
+            return contenuto_risposta, uso, modello, troncata, None
+
+        # Si passa al modello di riserva solo se il problema riguarda il modello e c'è ancora tempo
+        if errore is None or stato_streaming["frammenti_inviati"] or not errore_modello(errore):
+            break
+
+    if errore is None:
+        return None, None, modello_scelto, False, \
+            f"Error: Model '{modello_scelto}' did not answer within {politica.scadenza_totale:.0f} seconds."
+    return None, None, modello_errore, False, messaggio_errore(errore, modello_errore, timeout_errore)
+
+
+def _somma_uso(usi):
+    totale = {}
+    for uso in usi:
+        for chiave, valore in (uso or {}).items():
+            totale[chiave] = totale.get(chiave, 0) + (valore or 0)
+    return totale
+
+
+# Funzione per correzione automatica del codice C di uno studente tramite modelli LLM.
+# Se viene passata una cache, le risposte già ottenute per lo stesso input vengono riutilizzate
+# senza una nuova chiamata a pagamento; forza_ricorrezione ignora la cache e la aggiorna.
+# Se viene passato callback_streaming, la risposta viene richiesta in streaming (stream=True)
+# e la funzione viene chiamata con ogni frammento di testo appena arriva.
+# cache_control aggiunge i marcatori di prompt caching del provider (None: automatico in base al modello).
+# Se info_uso è un dizionario, viene riempito con i token usati (prompt, completamento, in cache) della risposta.
+# Se viene passato un RegistroChiamate, la chiamata vi viene registrata (token, latenza, tempo al primo token, costo).
+# La PoliticaChiamate stabilisce timeout, tentativi con backoff, hedging e modelli di riserva
+# (None: valori predefiniti, senza hedging né modelli di riserva).
+# Con cache_funzioni (e una cache) i verdetti vengono riutilizzati anche per singola funzione: al modello
+# si inviano solo le funzioni mai viste, e se sono tutte note la chiamata non viene fatta (vedi VerdettiFunzioni).
+# I file più lunghi di max_caratteri_blocco (o la cui risposta viene troncata da max_tokens) vengono
+# corretti a blocchi di funzioni in parallelo, e le risposte unite (vedi grading.blocchi).
+# Con output_strutturato la risposta viene richiesta con lo schema JSON (response_format) ai modelli che lo
+# supportano; le risposte quasi valide degli altri vengono riparate localmente (vedi grading.parsing.ripara_json).
+def correggi_codice(codice_studente, criteri, testo_esame, modello_scelto, client, cache=None, forza_ricorrezione=False,
+                    callback_streaming=None, cache_control=None, info_uso=None, registro=None, studente=None,
+                    politica=None, cache_funzioni=False, max_caratteri_blocco=MAX_CARATTERI_BLOCCO,
+                    output_strutturato=False):
+    # Parametri per la generazione della risposta LLM
+    max_tokens = 2048 # Massimo numero di token che il modello può generare nella risposta.
+    temperature = 0.2 # Controlla la casualità della risposta: valori più bassi la rendono più focalizzata e deterministica.
+
+    def chiave_cache_per(modello):
+        return calcola_chiave_cache(
+            codice_studente, criteri, testo_esame, modello,
+            {"max_tokens": max_tokens, "temperature": temperature}
+        )
+
+    if cache is not None and not forza_ricorrezione:
+        inizio_lettura_cache = time.perf_counter()
+        risposta_in_cache = cache.get(chiave_cache_per(modello_scelto))
+        if risposta_in_cache is not None:
+            if registro is not None:
+                registro.registra(modello_scelto, studente, latenza=time.perf_counter() - inizio_lettura_cache, da_cache=True)
+            if callback_streaming:
+                callback_streaming(risposta_in_cache)
+            return risposta_in_cache, None
+
+    verdetti = None
+    codice_da_inviare = codice_studente
+    if cache is not None and cache_funzioni:
+        inizio_lettura_cache = time.perf_counter()
+        verdetti = VerdettiFunzioni(
+            cache, codice_studente, criteri, testo_esame, modello_scelto,
+            {"max_tokens": max_tokens, "temperature": temperature}
+        )
+        if not forza_ricorrezione:
+            verdetti.carica()
+        if verdetti.completi():
+            contenuto_risposta = verdetti.componi()
+            if registro is not None:
+                registro.registra(modello_scelto, studente, latenza=time.perf_counter() - inizio_lettura_cache, da_cache=True)
+            if callback_streaming:
+                callback_streaming(contenuto_risposta)
+            cache.put(chiave_cache_per(modello_scelto), contenuto_risposta, modello_scelto)
+            return contenuto_risposta, None
+        codice_da_inviare = verdetti.codice_ridotto()
+
+    if not client:
+        return None, "Error: OpenRouter client not initialized. Check API key."
+
+    if politica is None:
+        politica = PoliticaChiamate()
+
+    def chiama(codice, callback=None):
+        return _chiama_modello(client, codice, criteri, testo_esame, modello_scelto, cache_control, max_tokens,
+                               temperature, callback, politica, registro, studente, output_strutturato)
+
+    usi = []
+    blocchi = None
+    if len(codice_da_inviare) > max_caratteri_blocco:
+        blocchi = suddividi_in_blocchi(codice_da_inviare, max_caratteri_blocco)
+    if blocchi is None:
+        contenuto_risposta, uso, modello, troncata, errore = chiama(codice_da_inviare, callback_streaming)
+        if errore:
+            return None, errore
+        usi.append(uso)
+        # Risposta interrotta da max_tokens: si ricorregge il file una funzione per blocco
+        if troncata:
+            blocchi = suddividi_in_blocchi(codice_da_inviare, 0)
+            if blocchi is None:
+                # Una risposta troncata non va né completata né salvata in cache: mancherebbero degli errori
+                if info_uso is not None and uso: info_uso.update(uso)
+                return None, (f"Error: the answer was cut off by the {max_tokens}-token limit and the code "
+                              f"cannot be split into functions to grade them separately.")
+            # L'anteprima in streaming ha già ricevuto la risposta troncata: non la si alimenta di nuovo
+            callback_streaming = None
+    while blocchi is not None:
+        # Blocchi in parallelo, senza streaming: i frammenti di risposte diverse si mescolerebbero
+        with ThreadPoolExecutor(max_workers=min(len(blocchi), politica.max_blocchi_paralleli)) as executor:
+            risultati = list(executor.map(lambda blocco: chiama(blocco["codice"]), blocchi))
+        usi.extend(r[1] for r in risultati)
+        for _, _, _, _, errore in risultati:
+            if errore:
+                return None, errore
+        troncati = [blocco for blocco, r in zip(blocchi, risultati) if r[3]]
+        if not troncati:
+            contenuto_risposta = unisci_risposte_blocchi(blocchi, [r[0] for r in risultati])
+            modello = risultati[0][2]
+            break
+        # Unire una risposta troncata perderebbe in silenzio le sue ultime annotazioni
+        if all(len(blocco["intervalli"]) == 1 for blocco in troncati):
+            righe = ", ".join(f"{prima}-{ultima}" for blocco in troncati for prima, ultima in blocco["intervalli"])
+            return None, (f"Error: the answer for the code at lines {righe} was cut off by the "
+                          f"{max_tokens}-token limit even when graded on its own.")
+        # Un blocco di più funzioni troncato: si ricorregge il file una funzione per blocco
+        blocchi = suddividi_in_blocchi(codice_da_inviare, 0)
+    if blocchi is not None and callback_streaming:
+        callback_streaming(contenuto_risposta)
+
+    uso = _somma_uso(usi)
+    if info_uso is not None and uso:
+        info_uso.update(uso)
+
+    # Le annotazioni del modello si uniscono ai verdetti già noti delle funzioni omesse
+    if verdetti is not None and contenuto_risposta:
+        contenuto_risposta = verdetti.completa(contenuto_risposta, modello)
+    # Salva in cache solo le risposte non vuote, con la chiave del modello che ha risposto
+    if cache is not None and contenuto_risposta:
+        cache.put(chiave_cache_per(modello), contenuto_risposta, modello)
+    return contenuto_risposta, None
+
+# Funzione per correggere in parallelo i codici di più studenti.
+def correggi_codici_in_parallelo(codici_studenti, criteri, testo_esame, modello_scelto, client, max_workers=8,
+                                 cache=None, forza_ricorrezione=False, registro=None, politica=None, gruppi=None,
+                                 cache_funzioni=False, output_strutturato=False, modelli_ensemble=None, soglia_voti=None):
+    """
+    Invia le richieste di correzione per tutti gli studenti usando un pool di thread limitato.
+    codici_studenti è un mapping {nome_studente: codice_c}; ogni codice viene letto solo dal
+    thread che lo corregge, quindi può essere una vista lazy (es. ArchivioConsegne.codici()).
+    È un generatore: restituisce (nome_studente, contenuto_risposta, errore, uso_token) man mano che
+    le singole chiamate terminano, in ordine di completamento e non di invio.
+    L'elaborazione dei risultati avviene nel thread che consuma il generatore: nell'interfaccia
+    Streamlit è il thread dello script, perché le funzioni st.* non vanno chiamate dai thread del pool.
+    Se il budget del registro viene superato, le chiamate non ancora partite vengono saltate
+    e restituite con un errore: rilanciando la correzione (con la cache) si riprende da lì.
+    La stessa PoliticaChiamate è condivisa da tutti i thread, così la soglia di hedging si basa
+    sulle latenze osservate nell'intero lotto.
+    Con i GruppiDuplicati (vedi grading.deduplica) viene corretto solo un rappresentante per ogni
+    gruppo di consegne equivalenti: la sua risposta, con le righe riportate sul codice di ciascuno,
+    viene restituita anche per gli altri membri (con uso_token vuoto, perché non costano chiamate).
+    Con modelli_ensemble (lista che comprende modello_scelto) ogni consegna è corretta dall'ensemble
+    di modelli con soglia_voti (vedi grading.ensemble.correggi_codice_ensemble).
+    """
+    if not codici_studenti:
+        return
+    uso_per_studente = {nome_studente: {} for nome_studente in codici_studenti}
+    membri_per_impronta = {}
+    for nome_studente in sorted(codici_studenti):
+        impronta = gruppi.impronte.get(nome_studente) if gruppi is not None else None
+        membri_per_impronta.setdefault(impronta or ("studente", nome_studente), []).append(nome_studente)
+    duplicati = {membri[0]: membri[1:] for membri in membri_per_impronta.values()}
+    if politica is None:
+        politica = PoliticaChiamate()
+
+    def correggi_se_nel_budget(nome_studente):
+        if registro is not None and registro.budget_superato():
+            return None, "Skipped: session budget exceeded. Raise the budget and run again to resume."
+        if modelli_ensemble:
+            # Import qui: grading.ensemble dipende a sua volta da questo modulo
+            from grading.ensemble import correggi_codice_ensemble
+            return correggi_codice_ensemble(
+                codici_studenti[nome_studente], criteri, testo_esame, modelli_ensemble, client, soglia_voti, cache,
+                forza_ricorrezione, info_uso=uso_per_studente[nome_studente], registro=registro, studente=nome_studente,
+                politica=politica, cache_funzioni=cache_funzioni, output_strutturato=output_strutturato
+            )
+        return correggi_codice(
+            codici_studenti[nome_studente], criteri, testo_esame, modello_scelto, client, cache, forza_ricorrezione,
+            info_uso=uso_per_studente[nome_studente], registro=registro, studente=nome_studente,
+            politica=politica, cache_funzioni=cache_funzioni, output_strutturato=output_strutturato
+        )
+
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(duplicati)))) as executor:
+        futures = {
+            executor.submit(correggi_se_nel_budget, nome_studente): nome_studente
+            for nome_studente in duplicati
+        }
+        for future in as_completed(futures):
+            nome_studente = futures[future]
+            try:
+                contenuto, errore = future.result()
+            except Exception as e: # correggi_codice gestisce già gli errori, ma per sicurezza
+                contenuto, errore = None, f"Unexpected Error: {e}"
+            yield nome_studente, contenuto, errore, uso_per_studente[nome_studente]
+            for nome_duplicato in duplicati[nome_studente]:
+                contenuto_duplicato = riporta_correzioni(
+                    contenuto, codici_studenti[nome_studente], codici_studenti[nome_duplicato]
+                )
+                yield nome_duplicato, contenuto_duplicato, errore, uso_per_studente[nome_duplicato]
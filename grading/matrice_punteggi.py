@@ -0,0 +1,170 @@
+import csv
+
+import numpy as np
+
+# Numero di studenti scritti per blocco durante l'esportazione
+RIGHE_PER_BLOCCO = 1000
+
+
+class MatricePunteggi:
+    """
+    Punteggi di tutta la classe: una riga per studente e una colonna per funzione della griglia
+    (quelle con un punteggio base). Le deduzioni e il numero di deduzioni sono matrici NumPy,
+    così gli aggregati (media, mediana, istogramma, frequenza delle deduzioni per criterio)
+    sono calcolati in modo vettoriale. Gli studenti con una correzione non riuscita hanno
+    una riga di NaN e sono esclusi dagli aggregati.
+    """
+
+    def __init__(self, studenti, funzioni, punteggi_base, deduzioni, numero_deduzioni, deduzioni_totali,
+                 errori=None, nomi_file=None):
+        self.studenti = list(studenti)
+        self.funzioni = list(funzioni)
+        self.punteggi_base = np.asarray(punteggi_base, dtype=np.float64).reshape(len(self.funzioni))
+        self.deduzioni = np.asarray(deduzioni, dtype=np.float64).reshape(len(self.studenti), len(self.funzioni))
+        self.numero_deduzioni = np.asarray(numero_deduzioni, dtype=np.float64).reshape(self.deduzioni.shape)
+        self.deduzioni_totali = np.asarray(deduzioni_totali, dtype=np.float64).reshape(len(self.studenti))
+        self.errori = list(errori) if errori is not None else [None] * len(self.studenti)
+        self.nomi_file = list(nomi_file) if nomi_file is not None else None
+
+    @classmethod
+    def da_risultati(cls, risultati, punteggi_base, nomi_file=None):
+        """
+        Costruisce la matrice dai risultati per studente ({nome_studente: risultato}) nel formato
+        di elabora_risposta_llm ("errore", "deduzioni", "deduzioni_funzioni", "numero_deduzioni_funzioni").
+        punteggi_base è il dizionario {funzione: punteggio_base} della griglia.
+        """
+        studenti = sorted(risultati)
+        funzioni = list(punteggi_base)
+        deduzioni = np.full((len(studenti), len(funzioni)), np.nan)
+        numero_deduzioni = np.full((len(studenti), len(funzioni)), np.nan)
+        deduzioni_totali = np.full(len(studenti), np.nan)
+        errori = []
+        for riga, nome_studente in enumerate(studenti):
+            risultato = risultati[nome_studente]
+            errori.append(risultato.get("errore"))
+            if risultato.get("errore"):
+                continue
+            deduzioni_funzioni = risultato.get("deduzioni_funzioni") or {}
+            conteggi_funzioni = risultato.get("numero_deduzioni_funzioni") or {}
+            deduzioni[riga] = [deduzioni_funzioni.get(func_name, 0.0) for func_name in funzioni]
+            numero_deduzioni[riga] = [conteggi_funzioni.get(func_name, 0) for func_name in funzioni]
+            deduzioni_totali[riga] = risultato.get("deduzioni") or 0.0
+        file_per_studente = [nomi_file.get(nome_studente) for nome_studente in studenti] if nomi_file else None
+        return cls(studenti, funzioni, [punteggi_base[f] for f in funzioni], deduzioni, numero_deduzioni,
+                   deduzioni_totali, errori, file_per_studente)
+
+    @property
+    def punteggi_finali(self):
+        """Punteggio finale per studente e funzione: base + deduzioni, mai negativo."""
+        return np.maximum(0.0, self.punteggi_base + self.deduzioni)
+
+    @property
+    def punteggi_totali(self):
+        """Somma dei punteggi finali di ogni studente (NaN per le correzioni non riuscite)."""
+        if not self.funzioni:
+            return np.full(len(self.studenti), np.nan)
+        return self.punteggi_finali.sum(axis=1)
+
+    @property
+    def corretti(self):
+        """Maschera degli studenti con una correzione riuscita."""
+        return ~np.isnan(self.deduzioni_totali)
+
+    def statistiche(self):
+        """Media, mediana, minimo e massimo dei punteggi totali degli studenti corretti."""
+        totali = self.punteggi_totali[self.corretti]
+        if totali.size == 0 or np.isnan(totali).all():
+            return {"studenti": int(self.corretti.sum()), "media": None, "mediana": None, "minimo": None, "massimo": None}
+        return {
+            "studenti": int(self.corretti.sum()),
+            "media": float(np.nanmean(totali)),
+            "mediana": float(np.nanmedian(totali)),
+            "minimo": float(np.nanmin(totali)),
+            "massimo": float(np.nanmax(totali)),
+        }
+
+    def statistiche_per_funzione(self):
+        """
+        Per ogni funzione della griglia: punteggio base, media e mediana del punteggio finale,
+        deduzione media e frequenza delle deduzioni (quota di studenti con almeno una deduzione).
+        """
+        corretti = self.corretti
+        if not corretti.any():
+            return {}
+        finali = self.punteggi_finali[corretti]
+        deduzioni = self.deduzioni[corretti]
+        con_deduzioni = self.numero_deduzioni[corretti] > 0
+        medie = finali.mean(axis=0)
+        mediane = np.median(finali, axis=0)
+        deduzioni_medie = deduzioni.mean(axis=0)
+        frequenze = con_deduzioni.mean(axis=0)
+        return {
+            func_name: {
+                "base": float(self.punteggi_base[colonna]),
+                "media": float(medie[colonna]),
+                "mediana": float(mediane[colonna]),
+                "deduzione_media": float(deduzioni_medie[colonna]),
+                "frequenza_deduzioni": float(frequenze[colonna]),
+            }
+            for colonna, func_name in enumerate(self.funzioni)
+        }
+
+    def istogramma(self, numero_classi=10):
+        """Istogramma dei punteggi totali: (conteggi, estremi delle classi)."""
+        totali = self.punteggi_totali[self.corretti]
+        totali = totali[~np.isnan(totali)]
+        massimo = float(self.punteggi_base.sum()) if self.funzioni else 0.0
+        return np.histogram(totali, bins=numero_classi, range=(0.0, max(massimo, 1e-9)))
+
+    def intestazione(self):
+        colonne = ["studente"]
+        if self.nomi_file is not None:
+            colonne.append("file")
+        return colonne + ["deduzioni"] + self.funzioni + ["totale", "errore"]
+
+    def blocchi_righe(self, righe_per_blocco=RIGHE_PER_BLOCCO):
+        """Genera le righe del registro a blocchi, senza costruire l'intera tabella in memoria."""
+        for inizio in range(0, len(self.studenti), righe_per_blocco):
+            fine = min(inizio + righe_per_blocco, len(self.studenti))
+            finali = self.punteggi_finali[inizio:fine]
+            totali = self.punteggi_totali[inizio:fine]
+            blocco = []
+            for offset, riga in enumerate(range(inizio, fine)):
+                corretto = not np.isnan(self.deduzioni_totali[riga])
+                valori = [self.studenti[riga]]
+                if self.nomi_file is not None:
+                    valori.append(self.nomi_file[riga])
+                valori.append(float(self.deduzioni_totali[riga]) if corretto else None)
+                valori.extend(float(v) if corretto else None for v in finali[offset])
+                valori.append(float(totali[offset]) if corretto and self.funzioni else None)
+                valori.append(self.errori[riga])
+                blocco.append(valori)
+            yield blocco
+
+    def scrivi_csv(self, file_testo):
+        """Scrive il registro in formato CSV su un file di testo aperto, un blocco di studenti alla volta."""
+        writer = csv.writer(file_testo)
+        writer.writerow(self.intestazione())
+        for blocco in self.blocchi_righe():
+            writer.writerows(["" if valore is None else valore for valore in riga] for riga in blocco)
+
+    def scrivi_parquet(self, destinazione):
+        """
+        Scrive il registro in formato Parquet (percorso o file binario), un row group per blocco.
+        Richiede il pacchetto opzionale pyarrow.
+        """
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError as e:
+            raise ImportError("Parquet export requires the 'pyarrow' package.") from e
+
+        colonne = self.intestazione()
+        tipi = [pa.string() if nome in ("studente", "file", "errore") else pa.float64() for nome in colonne]
+        schema = pa.schema(list(zip(colonne, tipi)))
+        with pq.ParquetWriter(destinazione, schema) as writer:
+            for blocco in self.blocchi_righe():
+                colonne_blocco = list(zip(*blocco))
+                writer.write_table(pa.Table.from_arrays(
+                    [pa.array(valori, type=tipo) for valori, tipo in zip(colonne_blocco, tipi)], schema=schema
+                ))
@@ -0,0 +1,67 @@
+import hashlib
+import functools
+import threading
+from collections import OrderedDict
+
+# Numero massimo predefinito di risultati memorizzati per funzione
+MAX_VOCI_PREDEFINITO = 256
+
+
+def hash_contenuto(*argomenti):
+    """Hash SHA-256 degli argomenti (stringhe, byte o valori con repr stabile)."""
+    h = hashlib.sha256()
+    for argomento in argomenti:
+        if isinstance(argomento, (bytes, bytearray, memoryview)):
+            h.update(b"b")  # I byte non collidono con la stringa della loro repr
+            h.update(argomento)
+        else:
+            testo = argomento if isinstance(argomento, str) else repr(argomento)
+            h.update(testo.encode("utf-8", "surrogatepass"))
+        h.update(b"\x00")  # Separatore: ("ab", "c") e ("a", "bc") hanno hash diversi
+    return h.hexdigest()
+
+
+def memoizza_per_contenuto(max_voci=MAX_VOCI_PREDEFINITO):
+    """
+    Decoratore che memorizza il risultato di una funzione pura in base all'hash del contenuto
+    dei suoi argomenti posizionali, con evizione LRU oltre max_voci risultati.
+    La cache è a livello di processo: è condivisa tra studenti, sessioni e rerun di Streamlit.
+    Come chiave viene tenuto solo l'hash, non il testo (es. il codice dello studente).
+    I risultati restituiti sono condivisi tra le chiamate: non vanno modificati dal chiamante.
+    La funzione originale resta disponibile come __wrapped__.
+    """
+    def decoratore(funzione):
+        cache = OrderedDict()
+        lock = threading.Lock()
+        contatori = {"hit": 0, "miss": 0}
+
+        @functools.wraps(funzione)
+        def wrapper(*argomenti):
+            chiave = hash_contenuto(*argomenti)
+            with lock:
+                if chiave in cache:
+                    cache.move_to_end(chiave)
+                    contatori["hit"] += 1
+                    return cache[chiave]
+                contatori["miss"] += 1
+            risultato = funzione(*argomenti)
+            with lock:
+                cache[chiave] = risultato
+                cache.move_to_end(chiave)
+                while len(cache) > max_voci:
+                    cache.popitem(last=False)
+            return risultato
+
+        def cache_info():
+            with lock:
+                return {"hit": contatori["hit"], "miss": contatori["miss"], "voci": len(cache), "max_voci": max_voci}
+
+        def cache_clear():
+            with lock:
+                cache.clear()
+                contatori["hit"] = contatori["miss"] = 0
+
+        wrapper.cache_info = cache_info
+        wrapper.cache_clear = cache_clear
+        return wrapper
+    return decoratore
@@ -0,0 +1,120 @@
+import time
+import threading
+
+# Prezzi stimati in USD per milione di token: (input, output, input servito dalla cache dei prompt).
+# Valori indicativi dei listini OpenRouter: aggiornarli se cambiano i prezzi dei provider.
+PREZZI_MODELLI = {
+    "deepseek/deepseek-chat-v3-0324": (0.27, 1.10, 0.07),
+    "openai/gpt-4o": (2.50, 10.00, 1.25),
+    "anthropic/claude-3.5-sonnet": (3.00, 15.00, 0.30),
+    "google/gemini-flash-1.5": (0.075, 0.30, 0.01875),
+}
+
+
+def stima_costo(modello, prompt_tokens, completion_tokens, cached_tokens=0, prezzi=None):
+    """
+    Stima il costo (USD) di una chiamata. I token in cache sono inclusi in prompt_tokens
+    e vengono conteggiati al prezzo ridotto. Restituisce None se il modello non ha un prezzo noto.
+    """
+    prezzi = prezzi if prezzi is not None else PREZZI_MODELLI
+    if modello not in prezzi:
+        return None
+    prezzo_input, prezzo_output, prezzo_cache = prezzi[modello]
+    token_non_in_cache = max(0, prompt_tokens - cached_tokens)
+    return (token_non_in_cache * prezzo_input + cached_tokens * prezzo_cache + completion_tokens * prezzo_output) / 1_000_000
+
+
+def _percentile(valori, percentuale):
+    if not valori:
+        return None
+    ordinati = sorted(valori)
+    indice = min(len(ordinati) - 1, int(round(percentuale / 100 * (len(ordinati) - 1))))
+    return ordinati[indice]
+
+
+class RegistroChiamate:
+    """
+    Registro delle chiamate LLM di una sessione di correzione: modello, token, latenza,
+    tempo al primo token e costo stimato di ogni chiamata, con aggregati per studente,
+    per modello e per sessione. Un budget (USD, None = nessun limite) permette di
+    sospendere la correzione in parallelo quando viene superato.
+    È sicuro da usare dai thread della correzione in parallelo.
+    """
+
+    def __init__(self, budget=None):
+        self.budget = budget
+        self.chiamate = []
+        self._lock = threading.Lock()
+
+    def registra(self, modello, studente=None, prompt_tokens=0, completion_tokens=0, cached_tokens=0,
+                 latenza=0.0, tempo_primo_token=None, da_cache=False, errore=None):
+        """Aggiunge una chiamata al registro e ne restituisce il record."""
+        costo = 0.0 if da_cache else stima_costo(modello, prompt_tokens, completion_tokens, cached_tokens)
+        record = {
+            "timestamp": time.time(),
+            "studente": studente,
+            "modello": modello,
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "cached_tokens": cached_tokens,
+            "latenza": latenza,
+            "tempo_primo_token": tempo_primo_token,
+            "costo": costo,
+            "da_cache": da_cache,
+            "errore": errore,
+        }
+        with self._lock:
+            self.chiamate.append(record)
+        return record
+
+    def costo_totale(self):
+        with self._lock:
+            return sum(record["costo"] or 0.0 for record in self.chiamate)
+
+    def budget_superato(self):
+        """True se è impostato un budget e il costo stimato della sessione lo ha raggiunto."""
+        return self.budget is not None and self.costo_totale() >= self.budget
+
+    def _aggrega(self, records):
+        chiamate_api = [r for r in records if not r["da_cache"]]
+        latenze = [r["latenza"] for r in chiamate_api if r["errore"] is None]
+        tempi_primo_token = [r["tempo_primo_token"] for r in chiamate_api if r["tempo_primo_token"] is not None]
+        costo = sum(r["costo"] or 0.0 for r in records)
+        completion_tokens = sum(r["completion_tokens"] for r in records)
+        tempo_totale = sum(latenze)
+        return {
+            "chiamate": len(chiamate_api),
+            "risposte_da_cache": len(records) - len(chiamate_api),
+            "errori": sum(1 for r in chiamate_api if r["errore"] is not None),
+            "prompt_tokens": sum(r["prompt_tokens"] for r in records),
+            "cached_tokens": sum(r["cached_tokens"] for r in records),
+            "completion_tokens": completion_tokens,
+            "costo": costo,
+            "latenza_media": tempo_totale / len(latenze) if latenze else None,
+            "latenza_p50": _percentile(latenze, 50),
+            "latenza_p99": _percentile(latenze, 99),
+            "tempo_primo_token_p50": _percentile(tempi_primo_token, 50),
+            # Confronto tra modelli: token generati al secondo e correzioni riuscite (chiamate senza errore,
+            # escluse le risposte dalla cache) per USD speso; i prezzi di PREZZI_MODELLI sono in USD
+            "token_al_secondo": completion_tokens / tempo_totale if tempo_totale else None,
+            "correzioni_per_usd": len(latenze) / costo if costo else None,
+        }
+
+    def _aggrega_per(self, campo):
+        with self._lock:
+            records = list(self.chiamate)
+        gruppi = {}
+        for record in records:
+            gruppi.setdefault(record[campo], []).append(record)
+        return {chiave: self._aggrega(gruppo) for chiave, gruppo in gruppi.items()}
+
+    def per_modello(self):
+        return self._aggrega_per("modello")
+
+    def per_studente(self):
+        return self._aggrega_per("studente")
+
+    def sessione(self):
+        with self._lock:
+            records = list(self.chiamate)
+        return self._aggrega(records)
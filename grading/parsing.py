@@ -0,0 +1,372 @@
+import re
+import json
+import logging
+import threading
+
+from grading.memo import memoizza_per_contenuto
+from grading.prompt import CHIAVE_ERRORI_STRUTTURATI
+
+logger = logging.getLogger(__name__)
+
+# Esito delle riparazioni locali del JSON (vedi ripara_json), condiviso da tutte le sessioni del processo
+_statistiche_riparazione = {"valide": 0, "riparate": {}, "non_riparabili": 0}
+_lock_statistiche = threading.Lock()
+
+_LETTERALI_PYTHON = {"True": "true", "False": "false", "None": "null"}
+
+
+def _normalizza_json_quasi_valido(testo):
+    """
+    Corregge in un solo passaggio gli errori di sintassi più comuni delle risposte degli LLM:
+    stringhe tra apici singoli, virgole prima di ']' o '}', letterali Python (True/False/None).
+    Restituisce (testo_normalizzato, aperto), dove aperto è True se il testo finisce con una stringa
+    o una parentesi non chiusa (risposta troncata).
+    """
+    parti = []
+    profondita = 0
+    i, n = 0, len(testo)
+    while i < n:
+        carattere = testo[i]
+        if carattere == '"':
+            j = i + 1
+            while j < n and testo[j] != '"':
+                j += 2 if testo[j] == "\\" else 1
+            if j >= n:
+                parti.append(testo[i:])
+                return "".join(parti), True
+            parti.append(testo[i:j + 1])
+            i = j + 1
+            continue
+        if carattere == "'":
+            contenuto = []
+            j = i + 1
+            while j < n and testo[j] != "'":
+                if testo[j] == "\\" and j + 1 < n:
+                    contenuto.append("'" if testo[j + 1] == "'" else testo[j:j + 2])
+                    j += 2
+                    continue
+                contenuto.append('\\"' if testo[j] == '"' else testo[j])
+                j += 1
+            parti.append('"' + "".join(contenuto) + ('"' if j < n else ""))
+            if j >= n:
+                return "".join(parti), True
+            i = j + 1
+            continue
+        if carattere == ",":
+            k = i + 1
+            while k < n and testo[k].isspace():
+                k += 1
+            if k < n and testo[k] in "]}":
+                i += 1
+                continue
+        elif carattere.isalpha():
+            j = i
+            while j < n and (testo[j].isalnum() or testo[j] == "_"):
+                j += 1
+            parola = testo[i:j]
+            parti.append(_LETTERALI_PYTHON.get(parola, parola))
+            i = j
+            continue
+        elif carattere in "[{":
+            profondita += 1
+        elif carattere in "]}":
+            profondita -= 1
+        parti.append(carattere)
+        i += 1
+    return "".join(parti), profondita > 0
+
+
+def _oggetti_completi(testo):
+    """Elementi completi dell'array JSON che inizia alla prima '[' di testo, fino al primo non decodificabile."""
+    inizio = testo.find("[")
+    if inizio < 0:
+        return []
+    decoder = json.JSONDecoder(strict=False)
+    oggetti = []
+    posizione = inizio + 1
+    while True:
+        while posizione < len(testo) and (testo[posizione].isspace() or testo[posizione] == ","):
+            posizione += 1
+        if posizione >= len(testo) or testo[posizione] == "]":
+            return oggetti
+        try:
+            oggetto, posizione = decoder.raw_decode(testo, posizione)
+        except json.JSONDecodeError:
+            return oggetti
+        oggetti.append(oggetto)
+
+
+def _come_array(valore):
+    """Riporta ad array la risposta in formato strutturato ({"errors": [...]}); None se non è un array."""
+    if isinstance(valore, dict) and isinstance(valore.get(CHIAVE_ERRORI_STRUTTURATI), list):
+        return valore[CHIAVE_ERRORI_STRUTTURATI]
+    return valore if isinstance(valore, list) else None
+
+
+def _registra_esito(tipo_riparazione):
+    with _lock_statistiche:
+        if tipo_riparazione is None:
+            _statistiche_riparazione["non_riparabili"] += 1
+        elif tipo_riparazione == "valida":
+            _statistiche_riparazione["valide"] += 1
+        else:
+            riparate = _statistiche_riparazione["riparate"]
+            riparate[tipo_riparazione] = riparate.get(tipo_riparazione, 0) + 1
+        totale_riparate = sum(_statistiche_riparazione["riparate"].values())
+        totale_invalide = totale_riparate + _statistiche_riparazione["non_riparabili"]
+    if tipo_riparazione is None:
+        logger.warning("LLM JSON response could not be repaired (%d/%d invalid responses repaired so far)",
+                       totale_riparate, totale_invalide)
+    elif tipo_riparazione != "valida":
+        logger.info("LLM JSON response repaired locally (%s): %d/%d invalid responses repaired so far",
+                    tipo_riparazione, totale_riparate, totale_invalide)
+
+
+def statistiche_riparazione_json():
+    """
+    Esito della riparazione locale delle risposte distinte viste dal processo: "valide", "riparate"
+    ({tipo di riparazione: numero}), "non_riparabili" e "tasso_riparazione" (riparate / non valide, None se nessuna).
+    """
+    with _lock_statistiche:
+        riparate = dict(_statistiche_riparazione["riparate"])
+        non_riparabili = _statistiche_riparazione["non_riparabili"]
+        valide = _statistiche_riparazione["valide"]
+    invalide = sum(riparate.values()) + non_riparabili
+    return {
+        "valide": valide,
+        "riparate": riparate,
+        "non_riparabili": non_riparabili,
+        "tasso_riparazione": sum(riparate.values()) / invalide if invalide else None,
+    }
+
+
+@memoizza_per_contenuto()
+def ripara_json(testo):
+    """
+    Riporta a un array JSON valido una risposta quasi valida, prima di dichiararla non analizzabile:
+    - "sintassi": apici singoli, virgole finali, letterali Python (vedi _normalizza_json_quasi_valido);
+    - "testo_extra": testo dopo la chiusura dell'array;
+    - "troncata": risposta interrotta, si tengono gli oggetti completi e si scarta l'ultimo incompleto.
+    Anche la risposta in formato strutturato ({"errors": [...]}) viene riportata all'array.
+    Restituisce (stringa_json, tipo_riparazione): tipo_riparazione è "valida" se non serviva
+    nessuna riparazione; stringa_json è None se la risposta non è riparabile.
+    Memoizzata: ogni risposta distinta viene analizzata (e contata nelle statistiche) una sola volta.
+    """
+    stringa_json, tipo_riparazione = None, None
+    try:
+        valore = json.loads(testo)
+    except json.JSONDecodeError:
+        valore = None
+    else:
+        array = _come_array(valore)
+        if array is not None:
+            stringa_json = testo if array is valore else json.dumps(array, ensure_ascii=False)
+            tipo_riparazione = "valida"
+
+    if tipo_riparazione is None and valore is None:
+        # Il testo prima del JSON (es. "Here's the result:") non va normalizzato: i suoi apostrofi
+        # verrebbero presi per l'inizio di una stringa
+        inizio = min((p for p in (testo.find("["), testo.find("{")) if p >= 0), default=-1)
+        normalizzato, aperto = _normalizza_json_quasi_valido(testo[max(inizio, 0):])
+        decoder = json.JSONDecoder(strict=False) # Ammette anche gli a capo non escapati nelle stringhe
+        array = None
+        if inizio >= 0:
+            try:
+                valore, fine = decoder.raw_decode(normalizzato)
+            except json.JSONDecodeError:
+                pass
+            else:
+                array = _come_array(valore)
+                if array is not None:
+                    tipo_riparazione = "sintassi" if not normalizzato[fine:].strip() and inizio == 0 else "testo_extra"
+        if array is None and aperto and inizio >= 0:
+            array = _oggetti_completi(normalizzato)
+            tipo_riparazione = "troncata" if array else None
+        if tipo_riparazione is not None:
+            stringa_json = json.dumps(array, ensure_ascii=False)
+
+    _registra_esito(tipo_riparazione)
+    return stringa_json, tipo_riparazione
+
+# Funzione per estrarre la stringa JSON dalla risposta grezza dell'LLM
+def estrai_json_da_risposta(llm_response_content):
+    """
+    Pulisce la risposta dell'LLM (BOM, blocchi Markdown ```json ... ```) e restituisce
+    la tupla (stringa_json_estratta, messaggio_errore). Uno dei due valori è sempre None.
+    """
+    if llm_response_content is None:
+        return None, "Received no response content from the LLM (response was None)."
+
+    processed_response = llm_response_content.strip()
+
+    # Rimuovi UTF-8 BOM se presente
+    if processed_response.startswith('\ufeff'):
+        processed_response = processed_response[1:] # noqa: E203
+
+    # Tenta di estrarre il contenuto JSON da un blocco di codice Markdown
+    # Cerca ```json ... ``` o ``` ... ```
+    # Il regex cattura il contenuto tra i delimitatori.
+    # Gestisce il specificatore di linguaggio "json" opzionale e spazi/newline circostanti.
+    match = re.search(r"```(?:json)?\s*([\s\S]+?)\s*```", processed_response)
+    if match:
+        extracted_json_str = match.group(1).strip() # Ottiene il contenuto e fa lo strip
+    else:
+        extracted_json_str = processed_response # Suppone sia JSON grezzo o qualcos'altro
+
+    if not extracted_json_str:
+        return None, "LLM returned an empty response or content that became empty after attempting to extract JSON from potential Markdown. Expected a JSON array."
+    # JSON quasi valido (virgole finali, apici singoli, risposta troncata) o in formato strutturato:
+    # viene riparato o riportato ad array localmente
+    json_riparato, _ = ripara_json(extracted_json_str)
+    if json_riparato is not None:
+        return json_riparato, None
+    # La risposta non è vuota. Se è ancora JSON non valido (es. "abc" o malformato),
+    # evidenzia_errori_json intercetterà l'errore di parsing e lo segnalerà.
+    return extracted_json_str, None
+
+# Se avvisi è una lista, vi vengono aggiunti i messaggi sulle annotazioni malformate
+# (il chiamante decide se mostrarli, es. con st.warning); con avvisi=None vengono ignorati.
+def evidenzia_errori_json(codice_c, correzioni_json_str, avvisi=None):
+    try:
+        # Tenta di parsare la stringa JSON.
+        # È cruciale che correzioni_json_str sia un JSON valido qui.
+        dati_correzione = json.loads(correzioni_json_str)
+        if not isinstance(dati_correzione, list): # L'LLM è istruito a restituire una lista
+            # Il prompt si aspetta un array JSON. Se non è una lista, trattalo come errore.
+            raise json.JSONDecodeError("Expected a JSON array (list) from LLM.", correzioni_json_str, 0)
+    
+    except json.JSONDecodeError as e:
+        # Se il parsing JSON fallisce, restituisci il codice originale con un commento di errore
+        # e l'errore di parsing stesso.
+        messaggio_errore_parsing = f"/* Error parsing LLM JSON response: {str(e)}. \n   Raw response was: \n{correzioni_json_str}\n*/"
+        codice_con_errore_parsing = codice_c + "\n\n" + messaggio_errore_parsing
+        return codice_con_errore_parsing, 0, str(e), None # Aggiunto None per i dati analizzati
+
+    codice_lines = codice_c.split('\n')
+    totale_deduzioni = 0
+    # Memorizza le annotazioni per riga. Una riga può avere più commenti.
+    annotazioni_per_linea = {}  # Usa int come chiave (numero di riga 1-based)
+
+    # Regex per parsare i dettagli (criterio e punti) dall'intero commento catturato.
+    # Gruppo 1: Testo del criterio (e.g., "NEVER ENTERS THE LOOP!")
+    # Gruppo 2: Punti dedotti (e.g., "-5")
+    pattern_dettagli_commento_per_correzione = re.compile(r"//\*+\s*(.*?)\s*(-?\d+(?:\.\d+)?)(?:\s*\*+)?$")
+
+    for item_idx, item in enumerate(dati_correzione):
+        if not isinstance(item, dict):
+            # Ogni elemento nell'array dovrebbe essere un oggetto (dict).
+            # Salta elementi malformati o registra un avviso se necessario.
+            continue
+
+        inline_comment_str = item.get("inline_comment")
+        
+        # Tentativo di correggere point_deduction basandosi sull'inline_comment
+        if inline_comment_str:
+            match_comment_details = pattern_dettagli_commento_per_correzione.search(inline_comment_str.strip())
+            if match_comment_details:
+                punti_str_from_comment = match_comment_details.group(2)
+                try:
+                    punti_float_from_comment = float(punti_str_from_comment)
+                    item["point_deduction"] = punti_float_from_comment # Sovrascrive con il valore dal commento
+                except ValueError:
+                    # Il commento è formattato ma i punti non sono un numero valido.
+                    if avvisi is not None:
+                        avvisi.append(
+                            f"Avviso: Non è stato possibile analizzare la deduzione punti dall'inline_comment: '{inline_comment_str}' (item {item_idx}). "
+                            f"Il formato dei punti nel commento non è valido. "
+                            f"Verranno usati 0 punti per questo errore specifico. La deduzione punti originale dell'LLM era: {item.get('point_deduction')}"
+                        )
+                    item["point_deduction"] = 0.0 # Predefinito a 0 se il commento è malformato nei punti
+            else:
+                # L'inline_comment non corrisponde al formato atteso per estrarre i punti.
+                if avvisi is not None:
+                    avvisi.append(
+                        f"Avviso: L'inline_comment '{inline_comment_str}' (item {item_idx}) non corrisponde al formato atteso per estrarre la deduzione punti. "
+                        f"Verranno usati 0 punti per questo errore specifico. La deduzione punti originale dell'LLM era: {item.get('point_deduction')}"
+                    )
+                item["point_deduction"] = 0.0 # Predefinito a 0 se il formato del commento è errato
+
+        line_str = item.get("line")
+        point_deduction_val = item.get("point_deduction", 0)
+        inline_comment = item.get("inline_comment") # Commento pre-formattato dall'LLM
+
+        try:
+            # Somma le deduzioni di punti (assicurati che point_deduction sia un numero)
+            totale_deduzioni += float(point_deduction_val)
+        except (ValueError, TypeError):
+            # Gestisci i casi in cui point_deduction potrebbe non essere un numero valido
+            # o registra questo come un problema con il formato di output dell'LLM.
+            pass
+
+        if line_str and inline_comment:
+            try:
+                line_num_int = int(line_str)  # Converte il numero di riga da stringa a intero
+                if line_num_int <= 0:  # I numeri di riga sono tipicamente basati su 1 (1-based)
+                    continue  # Salta numeri di riga non validi (es. 0 o negativi)
+
+                # Aggiunge il commento alla lista per questa riga
+                annotazioni_per_linea.setdefault(line_num_int, []).append(inline_comment)
+            except ValueError:
+                # Gestisci i casi in cui line_str non è una stringa intera valida.
+                pass # Salta questa annotazione di errore
+
+    # Aggiungi commenti alle righe di codice
+    codice_evidenziato_lines = []
+    for i, line_content in enumerate(codice_lines, start=1):
+        current_line_with_comments = line_content
+        if i in annotazioni_per_linea:
+            for comment in annotazioni_per_linea[i]:
+                current_line_with_comments += f" {comment}" # Aggiunge spazio prima del commento
+        codice_evidenziato_lines.append(current_line_with_comments)
+
+    codice_evidenziato_final = "\n".join(codice_evidenziato_lines)
+    return codice_evidenziato_final, totale_deduzioni, None, dati_correzione # Restituisce la lista analizzata
+
+@memoizza_per_contenuto()
+def ricostruisci_errori_da_testo_commentato(testo_editato_con_commenti):
+    """
+    Analizza il testo del codice (che può contenere commenti di errore)
+    per estrarre tutti gli errori formattati, ricalcolare il punteggio
+    e generare una nuova lista di oggetti errore.
+    Il formato del commento atteso è: //******** CRITERIA_TEXT -POINTS_DEDUCTED
+    Questo pattern cerca il formato //*** ... -POINTS alla FINE della riga.
+    """
+    # Pattern per catturare l'intero commento di errore formattato alla fine di una riga.
+    # Gruppo 1: L'intero commento formattato.
+    # Gruppo 2: I punti dedotti.
+    # Gruppo 1: Testo del criterio (e.g., "NEVER ENTERS THE LOOP!")
+    # Gruppo 2: Punti dedotti (e.g., "-5")
+    pattern_dettagli_commento = r"//\*+\s*(.*?)\s*(-?\d+(?:\.\d+)?)\s*(?:\s*\*+)?$"
+
+    errori_ricostruiti = []
+    punteggio_ricalcolato = 0
+
+    if testo_editato_con_commenti:
+        righe_codice = testo_editato_con_commenti.splitlines() # Più robusto per i fine riga
+        for idx, riga_contenuto in enumerate(righe_codice, start=1):
+            # Trova tutti i commenti di errore formattati sulla riga
+            # Questa regex cattura l'intera stringa del commento (Gruppo 1) e i punti (Gruppo 2)
+            pattern_comment_and_points_at_end_of_line = re.compile(r"(//\*+\s*.*?\s*(-?\d+(?:\.\d+)?)\s*(?:\s*\*+)?)$")
+            match_full_comment_and_points = pattern_comment_and_points_at_end_of_line.search(riga_contenuto)
+
+            if match_full_comment_and_points:
+                full_matched_comment_string = match_full_comment_and_points.group(1) # L'intera stringa del commento
+                punti_str = match_full_comment_and_points.group(2) # La stringa dei punti
+                # Ora, estrai il criterio dalla stringa completa del commento
+                # Rimuovi la parte dei punti dalla fine della stringa completa del commento
+                criteria = full_matched_comment_string[:-len(match_full_comment_and_points.group(2))].strip() # Rimuove la stringa dei punti dalla fine
+                # È necessario rimuovere i //*** iniziali e gli spazi bianchi dal criterio
+                criteria = re.sub(r"//\*+\s*", "", criteria).strip()
+                try:
+                    punti = float(punti_str)
+                    errori_ricostruiti.append({
+                        "line": str(idx),
+                        "criteria": criteria,
+                        "point_deduction": punti,
+                        "inline_comment": full_matched_comment_string.strip()
+                    })
+                    punteggio_ricalcolato += punti
+                except ValueError:
+                    pass # Ignora se i punti non sono un numero valido
+    
+    return punteggio_ricalcolato, errori_ricostruiti
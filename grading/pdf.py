@@ -0,0 +1,28 @@
+import io
+
+from grading.memo import memoizza_per_contenuto
+
+
+@memoizza_per_contenuto(max_voci=16)
+def estrai_testo_pdf(dati_pdf):
+    """
+    Estrae il testo di un PDF (es. il testo d'esame), pagina per pagina.
+    Il risultato è memorizzato per hash del contenuto: lo stesso file non viene rianalizzato
+    a ogni rerun né tra sessioni diverse.
+    Restituisce (testo, errore); richiede il pacchetto pypdf.
+    """
+    try:
+        from pypdf import PdfReader
+    except ImportError:
+        return None, "PDF text extraction requires the 'pypdf' package."
+
+    try:
+        lettore = PdfReader(io.BytesIO(dati_pdf))
+        pagine = [(pagina.extract_text() or "").strip() for pagina in lettore.pages]
+    except Exception as e:
+        return None, f"Could not extract text from the PDF: {e}"
+
+    testo = "\n\n".join(pagina for pagina in pagine if pagina)
+    if not testo:
+        return None, "The PDF contains no extractable text (is it a scanned document?)."
+    return testo, None
@@ -0,0 +1,52 @@
+from grading.parsing import estrai_json_da_risposta, evidenzia_errori_json, ricostruisci_errori_da_testo_commentato
+from grading.scoring import punteggi_base_funzioni, calcola_deduzioni_per_funzione, calcola_punteggi_finali
+
+
+def elabora_risposta_llm(codice, contenuto_risposta, testo_criteri, testo_esame=None, avvisi=None):
+    """
+    Applica alla risposta grezza dell'LLM gli stessi passaggi della pagina di correzione:
+    estrazione del JSON, annotazione del codice, ricostruzione degli errori dal codice annotato
+    e calcolo dei punteggi per funzione.
+    Restituisce un dizionario con "errore" (None se tutto è andato a buon fine), "json" (il JSON
+    estratto dalla risposta), "codice_annotato", "deduzioni", "errori", "punteggi_funzioni",
+    "deduzioni_funzioni", "numero_deduzioni_funzioni", "punteggio_totale" e "riepilogo".
+    """
+    risultato = {
+        "errore": None,
+        "json": None,
+        "codice_annotato": None,
+        "deduzioni": 0,
+        "errori": [],
+        "punteggi_funzioni": {},
+        "deduzioni_funzioni": {},
+        "numero_deduzioni_funzioni": {},
+        "punteggio_totale": None,
+        "riepilogo": None,
+    }
+    json_estratto, errore_estrazione = estrai_json_da_risposta(contenuto_risposta)
+    if errore_estrazione:
+        risultato["errore"] = errore_estrazione
+        return risultato
+
+    risultato["json"] = json_estratto
+    codice_annotato, _, parsing_error, _ = evidenzia_errori_json(codice, json_estratto, avvisi)
+    risultato["codice_annotato"] = codice_annotato
+    if parsing_error:
+        risultato["errore"] = f"JSON Parsing Error: {parsing_error}"
+        return risultato
+
+    # Come nella pagina, punteggio ed errori vengono ricalcolati dal codice annotato
+    risultato["deduzioni"], risultato["errori"] = ricostruisci_errori_da_testo_commentato(codice_annotato)
+
+    all_function_base_scores = punteggi_base_funzioni(testo_criteri, testo_esame)
+    if all_function_base_scores:
+        function_deductions, function_deduction_details = calcola_deduzioni_per_funzione(
+            codice_annotato, risultato["errori"], all_function_base_scores
+        )
+        risultato["deduzioni_funzioni"] = function_deductions
+        risultato["numero_deduzioni_funzioni"] = {
+            func_name: len(dettagli) for func_name, dettagli in function_deduction_details.items()
+        }
+        (risultato["punteggi_funzioni"], risultato["punteggio_totale"],
+         risultato["riepilogo"]) = calcola_punteggi_finali(all_function_base_scores, function_deductions)
+    return risultato
@@ -0,0 +1,165 @@
+import textwrap
+
+# Messaggio di sistema: identico per tutte le richieste
+MESSAGGIO_SISTEMA = "Sei un esperto di programmazione in C."
+
+# Istruzioni fisse, formato dell'output ed esempi JSON: identici per tutte le richieste
+ISTRUZIONI_VALUTAZIONE = """
+##1.Istruzioni e regole di valutazione:
+Rivedi i dettagli dell'assegnazione e la griglia di valutazione in modo approfondito.
+Analizza la sottomissione del codice dello studente (fornita nel messaggio successivo) rispetto a ciascun criterio.
+Valuta SOLO in base ai criteri di correzione forniti.
+Se il codice dello studente include funzioni di supporto
+non esplicitamente menzionate nei criteri di correzione, non creare nuovi punteggi per esse.
+Se un errore in una funzione di supporto causa la violazione di un criterio per una funzione principale,
+segnala l'errore sulla riga corrispondente nella funzione di supporto,
+ma collega la deduzione e la descrizione del criterio a quello della funzione principale che è stata impattata.
+Aggiungi commenti in-line posizionandoli direttamente dopo la riga di codice pertinente.
+Non scrivere mai il commento al di fuori della funzione corrispondente.
+Non scrivere mai i commenti tra due funzioni.
+Non scrivere mai più di un commento per linea.
+Non creare più oggetti JSON per lo stesso errore ripetuto nella medesima funzione.
+Non modificare o correggere il codice dello studente.
+Mantieni l'oggettività ed evita preferenze personali di codifica.
+Non rimuovere punti per errori di battitura. Fornisci feedback specifico e attuabile.
+
+##2. Formato dell'output:
+Restituisci ESCLUSIVAMENTE un array JSON contenente oggetti per ogni errore identificato.
+
+Ogni oggetto deve avere la seguente struttura:
+{
+  "line": "string",         // Il numero della riga (1-based) in cui si trova l'errore. Es: "4".
+  "criteria": "string",       // La descrizione COMPLETA del criterio di correzione violato o dell'errore. Es: "Base case should check for length < 3 instead of <= 2".
+  "point_deduction": number,  // La deduzione di punti numerica per questo errore (es. -5, -0.3). QUESTO VALORE DEVE CORRISPONDERE ESATTAMENTE ALLA PARTE NUMERICA "-POINTS_DEDUCTED" del campo "inline_comment". Non confondere con altri numeri presenti nel testo del criterio.
+  "inline_comment": "string"  // Un commento COMPLETO da inserire accanto alla riga di codice, formattato RIGOROSAMENTE come "//******** CRITERIA_TEXT -POINTS_DEDUCTED". Esempio: "//******** Base case should check for length < 3 instead of <= 2 -0.3". Assicurati che l'INTERA stringa del commento, inclusi i punti alla fine, sia presente qui.
+}
+Esempio di output JSON (DEVE essere un array valido):
+[
+  {
+    "line": "4",
+    "criteria": "NEVER ENTERS THE LOOP!",
+    "point_deduction": -5,
+    "inline_comment": "//******** NEVER ENTERS THE LOOP! -5"
+  },
+  {
+    "line": "12",
+    "criteria": "Variabile non inizializzata",
+    "point_deduction": -3,
+    "inline_comment": "//******** Variabile non inizializzata -3"
+  },
+  {
+    "line": "6",
+    "criteria": "Base case should check for length < 3 instead of <= 2",
+    "point_deduction": -0.3,
+    "inline_comment": "//******** Base case should check for length < 3 instead of <= 2 -0.3"
+  }
+]
+Se non ci sono errori, restituisci un array JSON vuoto: [].
+Non includere NESSUN testo al di fuori dell'array JSON nella tua risposta.
+"""
+
+# Prefissi dei modelli OpenRouter che richiedono marcatori espliciti "cache_control"
+# per il prompt caching (OpenAI e DeepSeek lo applicano automaticamente ai prefissi lunghi).
+PREFISSI_MODELLI_CACHE_CONTROL = ("anthropic/", "google/")
+
+
+def supporta_cache_control(modello):
+    """True se il modello richiede marcatori cache_control espliciti per il prompt caching."""
+    return bool(modello) and modello.startswith(PREFISSI_MODELLI_CACHE_CONTROL)
+
+
+# Prefissi dei modelli OpenRouter che accettano response_format con uno schema JSON (structured outputs)
+PREFISSI_MODELLI_OUTPUT_STRUTTURATO = ("openai/", "google/")
+
+# Chiave dell'oggetto restituito con lo schema: gli structured outputs richiedono un oggetto alla radice,
+# quindi l'array degli errori viene incapsulato in {"errors": [...]} (estrai_json_da_risposta lo riporta ad array)
+CHIAVE_ERRORI_STRUTTURATI = "errors"
+
+FORMATO_RISPOSTA_STRUTTURATA = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "grading_errors",
+        "strict": True,
+        "schema": {
+            "type": "object",
+            "properties": {
+                CHIAVE_ERRORI_STRUTTURATI: {
+                    "type": "array",
+                    "items": {
+                        "type": "object",
+                        "properties": {
+                            "line": {"type": "string"},
+                            "criteria": {"type": "string"},
+                            "point_deduction": {"type": "number"},
+                            "inline_comment": {"type": "string"},
+                        },
+                        "required": ["line", "criteria", "point_deduction", "inline_comment"],
+                        "additionalProperties": False,
+                    },
+                },
+            },
+            "required": [CHIAVE_ERRORI_STRUTTURATI],
+            "additionalProperties": False,
+        },
+    },
+}
+
+
+def supporta_output_strutturato(modello):
+    """True se il modello accetta response_format con uno schema JSON."""
+    return bool(modello) and modello.startswith(PREFISSI_MODELLI_OUTPUT_STRUTTURATO)
+
+
+def costruisci_prefisso(criteri, testo_esame):
+    """
+    Costruisce la parte del prompt condivisa da tutti gli studenti dello stesso esame:
+    istruzioni, formato JSON con esempi, testo d'esame e criteri.
+    """
+    return (
+        ISTRUZIONI_VALUTAZIONE
+        + "\nExam Text (if present):\n"
+        + (textwrap.dedent(testo_esame) if testo_esame else "N/D")
+        + "\n\nCriteri di correzione:\n"
+        + textwrap.dedent(criteri or "")
+        + "\n"
+    )
+
+
+def costruisci_suffisso(codice_studente):
+    """Costruisce la parte del prompt specifica dello studente: solo il codice."""
+    return f"Codice dello studente:\n```c\n{codice_studente}\n```\n"
+
+
+def costruisci_messaggi(codice_studente, criteri, testo_esame, cache_control=False):
+    """
+    Restituisce la lista dei messaggi chat con un prefisso stabile (messaggio di sistema con
+    istruzioni, esempi, testo d'esame e criteri) e un suffisso per studente (solo il codice).
+    In questo modo il prefisso è identico per tutta la classe e può essere servito dalla
+    cache dei prompt del provider. Con cache_control=True il prefisso viene marcato con
+    {"cache_control": {"type": "ephemeral"}} (formato accettato da OpenRouter per Anthropic/Gemini).
+    """
+    prefisso = MESSAGGIO_SISTEMA + "\n" + costruisci_prefisso(criteri, testo_esame)
+    if cache_control:
+        contenuto_sistema = [{"type": "text", "text": prefisso, "cache_control": {"type": "ephemeral"}}]
+    else:
+        contenuto_sistema = prefisso
+    return [
+        {"role": "system", "content": contenuto_sistema},
+        {"role": "user", "content": costruisci_suffisso(codice_studente)},
+    ]
+
+
+def estrai_uso(usage):
+    """
+    Converte l'oggetto usage della risposta (SDK OpenAI / OpenRouter) in un dizionario
+    con prompt_tokens, completion_tokens e cached_tokens. Restituisce None se assente.
+    """
+    if usage is None:
+        return None
+    dettagli_prompt = getattr(usage, "prompt_tokens_details", None)
+    cached_tokens = getattr(dettagli_prompt, "cached_tokens", None) if dettagli_prompt is not None else None
+    return {
+        "prompt_tokens": getattr(usage, "prompt_tokens", 0) or 0,
+        "completion_tokens": getattr(usage, "completion_tokens", 0) or 0,
+        "cached_tokens": cached_tokens or 0,
+    }
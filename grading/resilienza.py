@@ -0,0 +1,180 @@
+import time
+import random
+import threading
+from collections import deque
+from email.utils import parsedate_to_datetime
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from grading.metrics import _percentile
+
+# Codici HTTP per cui ha senso ritentare la stessa richiesta
+STATI_RITENTABILI = {408, 409, 429, 500, 502, 503, 504}
+
+# Le funzioni che classificano gli errori importano openai solo quando servono: a quel punto
+# l'SDK è già caricato dal client, mentre l'import di questo modulo resta leggero.
+
+# Numero minimo di latenze osservate per un modello prima di attivare l'hedging
+CAMPIONI_MINIMI_HEDGING = 10
+
+
+class PoliticaChiamate:
+    """
+    Parametri di affidabilità delle chiamate all'LLM:
+    - timeout: secondi massimi per singola richiesta;
+    - max_tentativi: tentativi per modello (il primo compreso) sugli errori temporanei;
+    - attesa_base / attesa_massima: backoff esponenziale con jitter completo tra un tentativo e l'altro,
+      sostituito dal valore di Retry-After se il provider lo indica;
+    - scadenza_totale: secondi massimi complessivi per una correzione (tentativi e modelli di riserva
+      compresi), così la latenza nel caso peggiore resta limitata;
+    - hedging: se una richiesta non in streaming supera il percentile_hedging delle latenze osservate
+      per quel modello, ne parte una seconda identica e si usa la prima risposta che arriva;
+    - modelli_riserva: modelli da provare, in ordine, se quello scelto non è disponibile;
+    - max_blocchi_paralleli: richieste contemporanee al più per un file corretto a blocchi di funzioni
+      (vedi grading.blocchi), così un file con molte funzioni non apre decine di connessioni.
+    Tiene anche lo storico recente delle latenze per modello, usato per la soglia di hedging:
+    un'istanza va condivisa tra le chiamate (thread-safe).
+    """
+
+    def __init__(self, timeout=60.0, max_tentativi=3, attesa_base=1.0, attesa_massima=20.0, scadenza_totale=180.0,
+                 hedging=False, percentile_hedging=95, modelli_riserva=(), max_blocchi_paralleli=4):
+        self.timeout = timeout
+        self.max_tentativi = max_tentativi
+        self.attesa_base = attesa_base
+        self.attesa_massima = attesa_massima
+        self.scadenza_totale = scadenza_totale
+        self.hedging = hedging
+        self.percentile_hedging = percentile_hedging
+        self.modelli_riserva = list(modelli_riserva)
+        self.max_blocchi_paralleli = max(1, int(max_blocchi_paralleli))
+        self._latenze = {}
+        self._lock = threading.Lock()
+
+    def modelli_da_provare(self, modello_scelto):
+        return [modello_scelto] + [m for m in self.modelli_riserva if m and m != modello_scelto]
+
+    def registra_latenza(self, modello, latenza):
+        with self._lock:
+            self._latenze.setdefault(modello, deque(maxlen=200)).append(latenza)
+
+    def soglia_hedging(self, modello):
+        """Ritardo dopo cui inviare la richiesta di riserva (None: hedging non attivo o dati insufficienti)."""
+        if not self.hedging:
+            return None
+        with self._lock:
+            latenze = list(self._latenze.get(modello, ()))
+        if len(latenze) < CAMPIONI_MINIMI_HEDGING:
+            return None
+        return _percentile(latenze, self.percentile_hedging)
+
+    def attesa(self, tentativo, errore=None):
+        """Secondi da attendere prima del tentativo successivo (tentativo parte da 1)."""
+        retry_after = leggi_retry_after(errore)
+        if retry_after is not None:
+            return min(retry_after, self.attesa_massima)
+        # Jitter completo: evita che i thread del pool ritentino tutti nello stesso istante
+        return random.uniform(0, min(self.attesa_massima, self.attesa_base * 2 ** (tentativo - 1)))
+
+
+def leggi_retry_after(errore):
+    """Secondi indicati dall'header Retry-After (o retry-after-ms) della risposta d'errore, se presente."""
+    risposta = getattr(errore, "response", None)
+    if risposta is None:
+        return None
+    headers = risposta.headers
+    try:
+        if headers.get("retry-after-ms"):
+            return max(0.0, float(headers["retry-after-ms"]) / 1000)
+        valore = headers.get("retry-after")
+        if not valore:
+            return None
+        try:
+            return max(0.0, float(valore))
+        except ValueError:
+            # Formato data HTTP
+            return max(0.0, parsedate_to_datetime(valore).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def errore_ritentabile(errore):
+    """True per gli errori temporanei (timeout, connessione, rate limit, errori del server)."""
+    import openai
+    if isinstance(errore, openai.APIConnectionError): # Comprende APITimeoutError
+        return True
+    if isinstance(errore, openai.APIStatusError):
+        return errore.status_code in STATI_RITENTABILI and not errore_quota(errore)
+    return False
+
+
+def errore_quota(errore):
+    """True se il credito o la quota dell'account sono esauriti (inutile ritentare o cambiare modello)."""
+    import openai
+    if not isinstance(errore, openai.APIStatusError):
+        return False
+    return errore.status_code == 402 or getattr(errore, "code", None) == "insufficient_quota"
+
+
+def errore_modello(errore):
+    """True se l'errore riguarda il modello (non trovato o non disponibile): si può provare un modello di riserva."""
+    import openai
+    return isinstance(errore, (openai.NotFoundError, openai.UnprocessableEntityError)) or errore_ritentabile(errore)
+
+
+def errore_richiesta_non_valida(errore):
+    """True se il provider ha rifiutato i parametri della richiesta (HTTP 400), es. un response_format non supportato."""
+    import openai
+    return isinstance(errore, openai.BadRequestError)
+
+
+def messaggio_errore(errore, modello, timeout=None):
+    """Messaggio per l'utente in base al tipo di errore restituito dall'SDK."""
+    import openai
+    if errore_quota(errore):
+        return "Error: You have exhausted your OpenRouter quota. Check your plan or wait for monthly renewal."
+    if isinstance(errore, openai.NotFoundError):
+        return f"Error: Model '{modello}' not found on OpenRouter. Please check the model name."
+    if isinstance(errore, openai.AuthenticationError):
+        return "Error: OpenRouter rejected the API key. Check the configured key."
+    if isinstance(errore, (openai.APITimeoutError, TimeoutError)):
+        return f"Error: Model '{modello}' did not answer within {timeout:.0f} seconds." if timeout else \
+            f"Error: Model '{modello}' did not answer in time."
+    if isinstance(errore, openai.RateLimitError):
+        return f"Error: Model '{modello}' is rate limited by OpenRouter. Try again later or lower the parallel requests."
+    if isinstance(errore, openai.APIError):
+        return f"Error API OpenRouter: {errore}"
+    return f"Unexpected Error: {errore}"
+
+
+def esegui_con_hedging(esegui, ritardo, al_termine_scartata=None):
+    """
+    Esegue esegui(); se non termina entro ritardo secondi ne avvia una seconda copia e
+    restituisce il risultato della prima che termina senza errori (o solleva l'ultimo errore).
+    La richiesta più lenta non viene interrotta: il suo risultato viene scartato, ma se termina
+    senza errori viene passato ad al_termine_scartata (es. per registrarne i token, comunque pagati).
+    Restituisce (risultato, True se ha risposto la copia di riserva).
+    """
+    def scartata_terminata(future):
+        if not future.cancelled() and future.exception() is None:
+            al_termine_scartata(future.result())
+
+    executor = ThreadPoolExecutor(max_workers=2)
+    try:
+        primo = executor.submit(esegui)
+        completati, _ = wait([primo], timeout=ritardo)
+        if completati:
+            return primo.result(), False
+        secondo = executor.submit(esegui)
+        in_corso = {primo, secondo}
+        ultimo_errore = None
+        while in_corso:
+            completati, in_corso = wait(in_corso, return_when=FIRST_COMPLETED)
+            for future in completati:
+                if future.exception() is None:
+                    if al_termine_scartata is not None:
+                        # Richiamato subito se l'altra copia è già terminata, altrimenti dal suo thread
+                        (secondo if future is primo else primo).add_done_callback(scartata_terminata)
+                    return future.result(), future is secondo
+                ultimo_errore = future.exception()
+        raise ultimo_errore
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,84 @@
+import re
+
+from grading.attribuzione import motore_attribuzione
+from grading.memo import memoizza_per_contenuto
+
+
+@memoizza_per_contenuto()
+def parse_criteria_function_scores(criteria_text):
+    """
+    Estrae i punteggi base per funzione dal testo dei criteri.
+    Formato atteso: "nome_funzione: punteggio" (es. "massimoPari: 5.0").
+    Restituisce un dizionario {nome_funzione: punteggio_base}.
+    """
+    scores = {}
+    # Pattern 1: "nome_funzione: punteggio" (commento opzionale #...)
+    pattern_colon = re.compile(r"^\s*([a-zA-Z_]\w*)\s*:\s*(\d+(?:\.\d+)?)\s*(?:#.*)?$")
+    # Pattern 2: "nomeFunzione (punteggio pt)..." (caratteri finali opzionali)
+    # Esempio: "massimoPari (5.0 pt)........."
+    # Reso più flessibile per accettare (5.0), (5.0 pt), (5.0 pt.), ecc.
+    pattern_parenthesis_pt = re.compile(
+        r"^\s*([a-zA-Z_]\w*)\s*"       # Nome funzione (es. massimoPari)
+        r"\(\s*(\d+(?:\.\d+)?)\s*(?:pt\.?)?\s*\)" # Punteggio tra parentesi, "pt" e il punto sono opzionali
+        r".*$"                          # Consuma il resto della riga (es. .........) # noqa: E501
+    )
+
+    for line in criteria_text.splitlines():
+        line_stripped = line.strip()
+        match_colon = pattern_colon.match(line_stripped)
+        if match_colon:
+            func_name = match_colon.group(1)
+            score = float(match_colon.group(2))
+            scores[func_name] = score
+        else:
+            match_parenthesis_pt = pattern_parenthesis_pt.match(line_stripped)
+            if match_parenthesis_pt:
+                func_name = match_parenthesis_pt.group(1)
+                score = float(match_parenthesis_pt.group(2))
+                scores[func_name] = score
+    return scores
+
+def punteggi_base_funzioni(testo_criteri, testo_esame=None):
+    """
+    Unisce i punteggi base per funzione del testo d'esame e dei criteri di correzione.
+    I punteggi dei criteri sovrascrivono/integrano quelli dell'esame.
+    """
+    # Estrai punteggi base dal testo d'esame (se presente e contiene definizioni)
+    # Copia: il risultato di parse_criteria_function_scores è memorizzato e condiviso
+    all_function_base_scores = dict(parse_criteria_function_scores(testo_esame)) if testo_esame else {}
+    # Estrai punteggi base dai criteri di correzione
+    all_function_base_scores.update(parse_criteria_function_scores(testo_criteri or ""))
+    return all_function_base_scores
+
+def calcola_deduzioni_per_funzione(codice, lista_errori, all_function_base_scores):
+    """
+    Assegna ogni errore a una funzione principale (quelle con un punteggio base).
+    Restituisce (function_deductions, function_deduction_details): la somma delle deduzioni
+    e la lista delle stringhe di dettaglio (es. " - 0.5") per ogni funzione principale.
+    Le regole di attribuzione sono in MotoreAttribuzione.
+    """
+    motore = motore_attribuzione(codice, tuple(all_function_base_scores.keys()))
+    return motore.attribuisci(lista_errori)
+
+def calcola_punteggi_finali(all_function_base_scores, function_deductions):
+    """
+    Calcola il punteggio finale di ogni funzione principale e il commento di riepilogo.
+    Restituisce (function_final_scores, total_final_score, summary_comment).
+    """
+    summary_lines = []
+    total_final_score = 0.0
+    function_final_scores = {} # Memorizza i punteggi finali per riutilizzarli nella visualizzazione dettagliata
+
+    for func_name, base_score in all_function_base_scores.items():
+        deductions_for_func_val = function_deductions.get(func_name, 0.0)
+        # Assicura che il punteggio finale non sia negativo
+        final_score = max(0, base_score + deductions_for_func_val)
+        function_final_scores[func_name] = final_score
+        total_final_score += final_score
+        # Formatta la riga per il riepilogo, allineando il testo per leggibilità
+        summary_lines.append(f"  {func_name:<20} ({base_score:<4.1f}) ...... {final_score:.1f}")
+
+    summary_lines.append(f"  {'TOTAL':<20} {'':<7} ...... {total_final_score:.1f}")
+
+    summary_comment = "/*\n" + "\n".join(summary_lines) + "\n*/"
+    return function_final_scores, total_final_score, summary_comment
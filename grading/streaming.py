@@ -0,0 +1,70 @@
+import json
+
+
+class ParserArrayJSONIncrementale:
+    """
+    Parser incrementale per un array JSON di oggetti che arriva a pezzi (streaming LLM).
+    Ad ogni chiamata di feed() restituisce gli oggetti dell'array completati nel frammento,
+    cioè appena arriva la loro parentesi graffa di chiusura.
+    Il testo prima della '[' iniziale (es. "```json") viene ignorato; le parentesi
+    all'interno delle stringhe JSON non vengono contate.
+    """
+
+    def __init__(self):
+        self.oggetti = []  # Tutti gli oggetti completati finora
+        self._array_iniziato = False
+        self._array_terminato = False
+        self._profondita = 0  # Profondità di annidamento all'interno dell'array
+        self._in_stringa = False
+        self._escape = False
+        self._oggetto_corrente = []  # Caratteri dell'oggetto di primo livello in costruzione
+
+    def feed(self, frammento):
+        nuovi_oggetti = []
+        for carattere in frammento:
+            if self._array_terminato:
+                break
+            if not self._array_iniziato:
+                if carattere == "[":
+                    self._array_iniziato = True
+                continue
+
+            if self._profondita > 0:
+                self._oggetto_corrente.append(carattere)
+
+            if self._in_stringa:
+                if self._escape:
+                    self._escape = False
+                elif carattere == "\\":
+                    self._escape = True
+                elif carattere == '"':
+                    self._in_stringa = False
+                continue
+
+            if carattere == '"':
+                self._in_stringa = True
+            elif carattere in "{[":
+                if self._profondita == 0:
+                    self._oggetto_corrente = [carattere]
+                self._profondita += 1
+            elif carattere in "}]":
+                if self._profondita == 0:
+                    # Chiusura dell'array principale
+                    self._array_terminato = True
+                    continue
+                self._profondita -= 1
+                if self._profondita == 0:
+                    testo_oggetto = "".join(self._oggetto_corrente)
+                    self._oggetto_corrente = []
+                    try:
+                        oggetto = json.loads(testo_oggetto)
+                    except json.JSONDecodeError:
+                        continue  # Oggetto malformato: verrà segnalato dal parsing completo finale
+                    self.oggetti.append(oggetto)
+                    nuovi_oggetti.append(oggetto)
+        return nuovi_oggetti
+
+    @property
+    def completato(self):
+        """True se è già arrivata la ']' di chiusura dell'array."""
+        return self._array_terminato
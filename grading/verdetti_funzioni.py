@@ -0,0 +1,166 @@
+import json
+from bisect import bisect_left
+
+from grading.cache import calcola_chiave_cache
+from grading.c_analysis import find_c_function_definitions
+from grading.deduplica import normalizza_codice
+from grading.memo import memoizza_per_contenuto
+from grading.parsing import estrai_json_da_risposta
+
+# Nome dell'unità che raccoglie tutto il codice fuori dalle funzioni (include, globali, prototipi)
+UNITA_GLOBALE = "<globale>"
+
+# Riga che sostituisce, nel codice inviato al modello, una funzione corretta a parte (verdetto già
+# in cache o altro blocco). Le altre righe della funzione restano vuote, così i numeri di riga non cambiano.
+SEGNAPOSTO_FUNZIONE = "/* function '{nome}' omitted: graded separately, do not annotate */"
+
+
+@memoizza_per_contenuto()
+def unita_codice(code_string):
+    """
+    Suddivide il codice in unità di correzione: una per ogni funzione definita e una (UNITA_GLOBALE)
+    per il codice fuori dalle funzioni. Ogni unità è un dizionario con "nome", "prima_riga" e
+    "ultima_riga" (None per l'unità globale), "impronta" (forma normalizzata, vedi
+    grading.deduplica) e "righe_token" (riga assoluta di ogni suo token).
+    Restituisce None se due funzioni condividono una riga: in quel caso si corregge il file intero.
+    """
+    righe = code_string.split("\n")
+    funzioni = sorted(find_c_function_definitions(code_string), key=lambda f: f["start_line"])
+    for precedente, successiva in zip(funzioni, funzioni[1:]):
+        if successiva["start_line"] <= precedente["end_line"]:
+            return None
+
+    unita = []
+    righe_globali = list(righe)
+    for funzione in funzioni:
+        prima, ultima = funzione["start_line"], funzione["end_line"]
+        impronta, righe_token = normalizza_codice("\n".join(righe[prima - 1:ultima]))
+        unita.append({
+            "nome": funzione["name"],
+            "prima_riga": prima,
+            "ultima_riga": ultima,
+            "impronta": impronta,
+            "righe_token": tuple(riga + prima - 1 for riga in righe_token),
+        })
+        righe_globali[prima - 1:ultima] = [""] * (ultima - prima + 1)
+    impronta, righe_token = normalizza_codice("\n".join(righe_globali))
+    unita.append({
+        "nome": UNITA_GLOBALE, "prima_riga": None, "ultima_riga": None,
+        "impronta": impronta, "righe_token": righe_token,
+    })
+    return unita
+
+
+def _unita_della_riga(unita, riga):
+    for indice, u in enumerate(unita[:-1]):
+        if u["prima_riga"] <= riga <= u["ultima_riga"]:
+            return indice
+    return len(unita) - 1
+
+
+class VerdettiFunzioni:
+    """
+    Cache dei verdetti a livello di funzione: le annotazioni dell'LLM vengono salvate per
+    (impronta del corpo della funzione, nome della funzione, criteri/testo d'esame/modello),
+    con la posizione espressa come indice del token dentro la funzione, così possono essere
+    riportate sulle righe di un'altra consegna che contiene la stessa funzione.
+    Usa lo stesso archivio della cache delle risposte (CacheRisposteLLM), con chiavi distinte.
+    Uso: carica() cerca i verdetti noti; se completi() la risposta si ottiene con componi(),
+    altrimenti si invia al modello codice_ridotto() e si passa la risposta a completa().
+    """
+
+    def __init__(self, cache, codice, criteri, testo_esame, modello, parametri):
+        self.cache = cache
+        self.codice = codice
+        self.criteri = criteri
+        self.testo_esame = testo_esame
+        self.parametri = dict(parametri, granularita="funzione")
+        self.unita = unita_codice(codice)
+        self.noti = {}  # {indice unità: [(indice_token, annotazione senza "line"), ...]}
+        self.modello = modello
+
+    def _chiave(self, unita, modello):
+        return calcola_chiave_cache(
+            f"{unita['nome']}\x00{unita['impronta']}", self.criteri, self.testo_esame, modello, self.parametri
+        )
+
+    def carica(self):
+        if self.unita is None:
+            return
+        for indice, unita in enumerate(self.unita):
+            verdetto = self.cache.get(self._chiave(unita, self.modello))
+            if verdetto is not None:
+                self.noti[indice] = json.loads(verdetto)
+
+    def completi(self):
+        return self.unita is not None and len(self.noti) == len(self.unita)
+
+    def codice_ridotto(self):
+        """Il codice da inviare al modello: le funzioni con un verdetto noto sono sostituite dal segnaposto."""
+        if not self.noti:
+            return self.codice
+        righe = self.codice.split("\n")
+        for indice in self.noti:
+            unita = self.unita[indice]
+            if unita["nome"] == UNITA_GLOBALE:
+                continue # Il codice globale resta: dà il contesto alle funzioni da correggere
+            prima, ultima = unita["prima_riga"], unita["ultima_riga"]
+            righe[prima - 1:ultima] = [SEGNAPOSTO_FUNZIONE.format(nome=unita["nome"])] + [""] * (ultima - prima)
+        return "\n".join(righe)
+
+    def _annotazioni_note(self):
+        annotazioni = []
+        for indice, verdetto in self.noti.items():
+            righe_token = self.unita[indice]["righe_token"]
+            for indice_token, annotazione in verdetto:
+                if indice_token is not None and indice_token < len(righe_token):
+                    riga = righe_token[indice_token]
+                else:
+                    riga = self.unita[indice]["prima_riga"] or 1
+                annotazioni.append(dict(annotazione, line=str(riga)))
+        return annotazioni
+
+    def componi(self):
+        """Risposta (array JSON) composta solo dai verdetti noti."""
+        return json.dumps(self._annotazioni_note(), ensure_ascii=False)
+
+    def completa(self, contenuto_risposta, modello):
+        """
+        Unisce la risposta del modello (sul codice ridotto, con le stesse righe dell'originale)
+        ai verdetti noti e salva i verdetti delle unità appena corrette.
+        Se la risposta non è un array JSON valido viene restituita invariata, senza salvare nulla.
+        """
+        if self.unita is None:
+            return contenuto_risposta
+        json_estratto, errore = estrai_json_da_risposta(contenuto_risposta)
+        if errore:
+            return contenuto_risposta
+        try:
+            annotazioni = json.loads(json_estratto)
+        except json.JSONDecodeError:
+            return contenuto_risposta
+        if not isinstance(annotazioni, list):
+            return contenuto_risposta
+
+        nuovi = {indice: [] for indice in range(len(self.unita)) if indice not in self.noti}
+        annotazioni_valide = []
+        for annotazione in annotazioni:
+            try:
+                riga = int(annotazione["line"])
+            except (TypeError, ValueError, KeyError):
+                # Senza una riga valida non si sa a quale unità appartiene: vale solo per questa risposta
+                annotazioni_valide.append(annotazione)
+                continue
+            indice = _unita_della_riga(self.unita, riga)
+            if indice not in nuovi:
+                continue # Annotazione su una funzione omessa: vale il verdetto noto
+            annotazioni_valide.append(annotazione)
+            righe_token = self.unita[indice]["righe_token"]
+            indice_token = bisect_left(righe_token, riga) if righe_token else None
+            if indice_token is not None and indice_token == len(righe_token):
+                indice_token -= 1
+            nuovi[indice].append([indice_token, {k: v for k, v in annotazione.items() if k != "line"}])
+
+        for indice, verdetto in nuovi.items():
+            self.cache.put(self._chiave(self.unita[indice], modello), json.dumps(verdetto, ensure_ascii=False), modello)
+        return json.dumps(annotazioni_valide + self._annotazioni_note(), ensure_ascii=False)
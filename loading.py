@@ -1,7 +1,9 @@
 import streamlit as st
 import os
 import zipfile
-import io
+from collections.abc import Mapping
+from grading.archivio import ArchivioConsegne
+from grading.deposito import FileDeposito, deposito_condiviso
 
 # Configura la pagina
 st.set_page_config(layout="wide")
@@ -19,19 +21,13 @@ def carica_file(file, key):
         st.success(f"File '{file.name}' successfully uploaded!")
 
 # Funzione per processare il file .zip
+# Viene letta solo la central directory dello zip: il codice di ogni studente
+# viene letto e decodificato solo quando serve (vedi ArchivioConsegne).
+# Lo zip e le consegne vanno nel deposito condiviso del processo: chi carica lo stesso archivio
+# in un'altra sessione non ne crea un'altra copia, e la sessione tiene solo le impronte.
 def process_zip_file(uploaded_file):
-    student_files = {}
     try:
-        with zipfile.ZipFile(uploaded_file, 'r') as zip_ref:
-            for file_info in zip_ref.infolist():
-                # Cerca file .c in sottocartelle, ignorando i metadati di macOS
-                if file_info.filename.endswith('.c') and not file_info.filename.startswith('__MACOSX'):
-                    parts = file_info.filename.split('/')
-                    if len(parts) > 1:
-                        student_name = parts[0]
-                        file_content = io.BytesIO(zip_ref.read(file_info.filename))
-                        file_content.name = os.path.basename(file_info.filename)
-                        student_files[student_name] = file_content
+        student_files = ArchivioConsegne(uploaded_file, deposito=deposito_condiviso())
     except zipfile.BadZipFile:
         st.error("The uploaded file is not a valid .zip file.")
         return None
@@ -43,7 +39,10 @@ def process_zip_file(uploaded_file):
 # Funzione per eliminare file
 def elimina_file(file_key):
     if file_key in st.session_state:
-        del st.session_state[file_key]
+        valore = st.session_state.pop(file_key)
+        # L'archivio delle consegne viene rimosso anche dal deposito condiviso (se nessun'altra sessione lo usa)
+        if isinstance(valore, ArchivioConsegne):
+            valore.chiudi()
 
     if file_key == "testo_esame":
         st.toast("✅ Exam Text successfully deleted!", icon="🗑️")
@@ -55,6 +54,8 @@ def elimina_file(file_key):
         st.toast("✅ Student Codes successfully deleted!", icon="🗑️")
         if "zip_file_object" in st.session_state:
             del st.session_state["zip_file_object"]
+        if "gruppi_duplicati" in st.session_state:
+            del st.session_state["gruppi_duplicati"]
     st.rerun()
 
 
@@ -120,19 +121,23 @@ with col3:
         student_codes_dict = process_zip_file(zip_file)
         if student_codes_dict:
             st.session_state["cartella_codici"] = student_codes_dict
-            st.session_state["zip_file_object"] = zip_file
+            st.session_state["zip_file_object"] = FileDeposito(student_codes_dict.deposito, student_codes_dict.impronta, zip_file.name)
             st.success(f"File '{zip_file.name}' processed. Found code for {len(student_codes_dict)} students.")
             st.rerun()
 
     # Visualizza lo zip caricato
     if st.session_state.get("cartella_codici"):
-        if isinstance(st.session_state["cartella_codici"], dict):
+        if isinstance(st.session_state["cartella_codici"], Mapping):
             zip_obj = st.session_state.get("zip_file_object")
             if zip_obj:
                 st.write(f"📄 **File uploaded:** {zip_obj.name}")
                 st.write(f"👥 **Students found:** {len(st.session_state['cartella_codici'])}")
+                gruppi_duplicati = st.session_state.get("gruppi_duplicati")
+                if gruppi_duplicati and gruppi_duplicati.chiamate_risparmiate:
+                    st.write(f"♻️ **Equivalent submissions:** {gruppi_duplicati.chiamate_risparmiate} (graded once)")
                 
-                st.download_button("💾 Download ZIP", zip_obj.getvalue(), file_name=zip_obj.name, mime="application/zip")
+                # I byte dello zip vengono copiati dal deposito solo al momento del download
+                st.download_button("💾 Download ZIP", zip_obj.getbytes, file_name=zip_obj.name, mime="application/zip")
                 if st.button("🗑️ Delete Student Codes"):
                     elimina_file("cartella_codici")
     
@@ -1,33 +1,101 @@
+import time
+# Inizio del rerun corrente, per il report dei tempi della pagina
+inizio_rerun = time.perf_counter()
+
 import streamlit as st
 import os
-import base64
-import openai
-import textwrap
-import re 
+import sys
 import json
+import io
+import tempfile
+from collections.abc import Mapping
+from grading.cache import CacheRisposteLLM
+from grading.streaming import ParserArrayJSONIncrementale
+from grading.metrics import RegistroChiamate
+from grading.resilienza import PoliticaChiamate
+from grading.llm import crea_client, correggi_codice
+from grading.coda import CodaCorrezioni, LavoratoreCoda, COMPLETATO, ERRORE
+from grading.ensemble import correggi_codice_ensemble, etichetta_ensemble, soglia_maggioranza
+from grading.parsing import (
+    estrai_json_da_risposta, evidenzia_errori_json, ricostruisci_errori_da_testo_commentato, statistiche_riparazione_json
+)
+from grading.c_analysis import find_c_function_definitions
+from grading.scoring import (
+    parse_criteria_function_scores, punteggi_base_funzioni,
+    calcola_deduzioni_per_funzione, calcola_punteggi_finali
+)
+from grading.archivio import ArchivioConsegne, nome_file_corretto
+from grading.deduplica import raggruppa_duplicati
+from grading.pdf import estrai_testo_pdf
+from grading.memo import hash_contenuto
+from grading.pipeline import elabora_risposta_llm
 
 # Configurazione della chiave API OpenRouter usando Streamlit secrets
 # OpenRouter fornisce accesso unificato a più modelli LLM
+openrouter_api_key = None
 try:
     openrouter_api_key = st.secrets.get("openrouter_api_key")
 except Exception:
     print("OpenRouter API key not found.")
 
-# Inizializzazione del client OpenRouter (usa l'API OpenAI-compatibile)
-client = None
-if openrouter_api_key:
+if not openrouter_api_key:
+    st.warning("OpenRouter API key not found. LLM features will be unavailable.", icon="⚠️")
+
+# Client OpenRouter (usa l'API OpenAI-compatibile) condiviso da tutte le sessioni del processo:
+# il suo pool di connessioni keep-alive viene riutilizzato, quindi l'handshake TLS non si ripete
+# a ogni chiamata o rerun. Viene creato alla prima correzione richiesta, così l'SDK openai
+# non viene importato all'apertura della pagina.
+@st.cache_resource(show_spinner=False)
+def get_client(api_key):
+    return crea_client(api_key)
+
+def client_openrouter():
+    if not openrouter_api_key:
+        return None
     try:
-        client = openai.OpenAI(
-            api_key=openrouter_api_key,
-            base_url="https://openrouter.ai/api/v1"
-        )
+        return get_client(openrouter_api_key)
     except Exception as e:
         st.error(f"Failed to initialize OpenRouter client: {e}")
-else:
-    st.warning("OpenRouter API key not found. LLM features will be unavailable.", icon="⚠️")
+        return None
+
+# Cache persistente delle risposte LLM, condivisa tra sessioni e rerun dello stesso processo
+@st.cache_resource
+def get_cache_risposte():
+    return CacheRisposteLLM()
+
+cache_risposte = get_cache_risposte()
+
+# Lavoratore della coda persistente delle correzioni della classe, unico per processo: i lavori accodati
+# proseguono in background anche se la sessione fa un rerun o viene chiusa, e dopo un riavvio si riprende
+# dai lavori non completati. Creato alla prima correzione della classe (importa l'SDK al primo lavoro).
+@st.cache_resource(show_spinner=False)
+def get_lavoratore_coda(api_key):
+    return LavoratoreCoda(CodaCorrezioni(), lambda: get_client(api_key), cache=get_cache_risposte())
+
+# Intervallo (secondi) con cui la pagina legge dalla coda l'avanzamento della correzione della classe
+INTERVALLO_AGGIORNAMENTO_CODA = 0.5
+
+# Intervallo minimo (secondi) tra due aggiornamenti dell'anteprima della risposta in streaming
+INTERVALLO_ANTEPRIMA_STREAMING = 0.3
+
+# Cartella delle anteprime dei PDF d'esame, dentro la cartella static servita da Streamlit accanto a loading.py,
+# ed età (secondi) oltre la quale un'anteprima viene rimossa
+CARTELLA_ANTEPRIME_PDF = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "static", "anteprime")
+MAX_ETA_ANTEPRIME_PDF_SECONDI = 24 * 3600
 
 st.set_page_config(layout="wide")
 st.title("Correction Page")
+
+# Registro delle chiamate LLM (token, latenza, costo) della sessione corrente
+if "registro_chiamate" not in st.session_state:
+    st.session_state["registro_chiamate"] = RegistroChiamate()
+registro_chiamate = st.session_state["registro_chiamate"]
+
+# Politica delle chiamate LLM (timeout, tentativi, hedging, modelli di riserva) della sessione corrente:
+# conserva anche le latenze osservate, usate come soglia per l'hedging
+if "politica_chiamate" not in st.session_state:
+    st.session_state["politica_chiamate"] = PoliticaChiamate()
+politica_chiamate = st.session_state["politica_chiamate"]
 col1, col2 = st.columns(2)
 
 # Funzione per resettare gli stati relativi alla visualizzazione della correzione
@@ -35,7 +103,7 @@ def reset_correction_display_states():
     keys_to_delete = [
         "correzioni_json_originale_llm", "api_error_message",
         "lista_oggetti_errore_iniziali", "codice_corretto_editabile",
-        "punteggio_attuale", "json_attuale_da_visualizzare",
+        "punteggio_attuale", "errori_attuali",
         "last_processed_llm_json"
     ]
     for key in keys_to_delete:
@@ -53,417 +121,389 @@ def elimina_file(file_key):
 # Funzione per eliminare la cartella caricata
 def elimina_cartella():
     if "cartella_codici" in st.session_state:
-        del st.session_state["cartella_codici"]
+        # Con il deposito condiviso l'archivio e le consegne vengono rimossi anche dal disco
+        cartella = st.session_state.pop("cartella_codici")
+        if isinstance(cartella, ArchivioConsegne):
+            cartella.chiudi()
+        st.session_state.pop("zip_file_object", None)
+        if "risultati_batch" in st.session_state:
+            del st.session_state["risultati_batch"]
+        if "gruppi_duplicati" in st.session_state:
+            del st.session_state["gruppi_duplicati"]
         st.success("Student Codes Folder Deleted Successfully!")
         st.rerun()
 
+# Scrive il PDF d'esame nella cartella servita da Streamlit come app/static (server.enableStaticServing,
+# attivato in .streamlit/config.toml) e ne restituisce l'URL relativo. Il nome è l'hash del contenuto:
+# lo stesso file viene scritto una volta sola, anche se caricato da più sessioni.
+def pubblica_anteprima_pdf(dati_pdf):
+    nome = f"{hash_contenuto(dati_pdf)}.pdf"
+    percorso = os.path.join(CARTELLA_ANTEPRIME_PDF, nome)
+    if not os.path.exists(percorso):
+        os.makedirs(CARTELLA_ANTEPRIME_PDF, exist_ok=True)
+        # Le anteprime non più recenti vengono rimosse: la cartella non cresce con i caricamenti
+        limite = time.time() - MAX_ETA_ANTEPRIME_PDF_SECONDI
+        for voce in os.scandir(CARTELLA_ANTEPRIME_PDF):
+            try:
+                if voce.is_file() and voce.stat().st_mtime < limite:
+                    os.remove(voce.path)
+            except FileNotFoundError:
+                pass
+        # Scrittura atomica: il browser di un'altra sessione non riceve mai un file scritto a metà
+        descrittore, temporaneo = tempfile.mkstemp(dir=CARTELLA_ANTEPRIME_PDF, suffix=".tmp")
+        try:
+            with os.fdopen(descrittore, "wb") as f:
+                f.write(dati_pdf)
+            os.replace(temporaneo, percorso)
+        except BaseException:
+            if os.path.exists(temporaneo):
+                os.remove(temporaneo)
+            raise
+    return f"app/static/{os.path.basename(CARTELLA_ANTEPRIME_PDF)}/{nome}"
+
 # Funzione per mostrare un'anteprima del PDF
 def mostra_pdf(file):
     if file is not None:
-        base64_pdf = base64.b64encode(file.getvalue()).decode("utf-8")
-        pdf_display = f'<iframe src="data:application/pdf;base64,{base64_pdf}" width="100%" height="500" type="application/pdf"></iframe>'
-        st.markdown(pdf_display, unsafe_allow_html=True)
-
-# Funzione per correzione automatica del codice C di uno studente tramite modelli LLM.
-def correggi_codice(codice_studente, criteri, testo_esame, modello_scelto, client):
-    # Crea il prompt da inviare al modello, includendo il testo dell'esame, i criteri di correzione e il codice dello studente.
-    # Il modello deve rispondere ESCLUSIVAMENTE con un array JSON di oggetti errore.
-    prompt = f"""
-    Exam Text (if present):
-    {textwrap.dedent(testo_esame) if testo_esame else "N/D"}
-
-    Criteri di correzione:
-    {textwrap.dedent(criteri)}
-    
-    Codice dello studente:
-    ```c
-    {codice_studente}
-    ```
-     ##1.Istruzioni e regole di valutazione:
-     Rivedi i dettagli dell'assegnazione e la griglia di valutazione in modo approfondito. 
-     Analizza la sottomissione del codice dello studente rispetto a ciascun criterio.
-     Valuta SOLO in base ai criteri di correzione forniti.
-     Se il codice dello studente include funzioni di supporto
-     non esplicitamente menzionate nei criteri di correzione, non creare nuovi punteggi per esse.
-     Se un errore in una funzione di supporto causa la violazione di un criterio per una funzione principale,
-     segnala l'errore sulla riga corrispondente nella funzione di supporto,
-     ma collega la deduzione e la descrizione del criterio a quello della funzione principale che è stata impattata.
-     Aggiungi commenti in-line posizionandoli direttamente dopo la riga di codice pertinente. 
-     Non scrivere mai il commento al di fuori della funzione corrispondente.
-     Non scrivere mai i commenti tra due funzioni.
-     Non scrivere mai più di un commento per linea.
-     Non creare più oggetti JSON per lo stesso errore ripetuto nella medesima funzione.
-     Non modificare o correggere il codice dello studente. 
-     Mantieni l'oggettività ed evita preferenze personali di codifica. 
-     Non rimuovere punti per errori di battitura. Fornisci feedback specifico e attuabile.
-     
-     ##2. Formato dell'output:
-     Restituisci ESCLUSIVAMENTE un array JSON contenente oggetti per ogni errore identificato.
-     
-     Ogni oggetto deve avere la seguente struttura:
-    {{
-      "line": "string",         // Il numero della riga (1-based) in cui si trova l'errore. Es: "4".
-      "criteria": "string",       // La descrizione COMPLETA del criterio di correzione violato o dell'errore. Es: "Base case should check for length < 3 instead of <= 2".
-      "point_deduction": number,  // La deduzione di punti numerica per questo errore (es. -5, -0.3). QUESTO VALORE DEVE CORRISPONDERE ESATTAMENTE ALLA PARTE NUMERICA "-POINTS_DEDUCTED" del campo "inline_comment". Non confondere con altri numeri presenti nel testo del criterio.
-      "inline_comment": "string"  // Un commento COMPLETO da inserire accanto alla riga di codice, formattato RIGOROSAMENTE come "//******** CRITERIA_TEXT -POINTS_DEDUCTED". Esempio: "//******** Base case should check for length < 3 instead of <= 2 -0.3". Assicurati che l'INTERA stringa del commento, inclusi i punti alla fine, sia presente qui.
-    }}
-    Esempio di output JSON (DEVE essere un array valido):
-    [
-      {{
-        "line": "4",
-        "criteria": "NEVER ENTERS THE LOOP!",
-        "point_deduction": -5,
-        "inline_comment": "//******** NEVER ENTERS THE LOOP! -5" 
-      }},
-      {{
-        "line": "12",
-        "criteria": "Variabile non inizializzata",
-        "point_deduction": -3,
-        "inline_comment": "//******** Variabile non inizializzata -3" 
-      }},
-      {{
-        "line": "6",
-        "criteria": "Base case should check for length < 3 instead of <= 2", 
-        "point_deduction": -0.3,
-        "inline_comment": "//******** Base case should check for length < 3 instead of <= 2 -0.3" 
-      }}
-    ]
-    Se non ci sono errori, restituisci un array JSON vuoto: [].
-    Non includere NESSUN testo al di fuori dell'array JSON nella tua risposta.
-    
-     """
-
-    try:
-        # Utilizzo generico di qualsiasi modello tramite OpenRouter
-        if not client:
-            return None, "Error: OpenRouter client not initialized. Check API key."
-        
-        # Parametri per la generazione della risposta LLM
-        max_tokens = 2048 # Massimo numero di token che il modello può generare nella risposta.
-        temperature = 0.2 # Controlla la casualità della risposta: valori più bassi la rendono più focalizzata e deterministica.
-        
-            
-        risposta = client.chat.completions.create(
-            model=modello_scelto,
-            messages=[
-                {"role": "system", "content": "Sei un esperto di programmazione in C."},
-                {"role": "user", "content": prompt}
-            ],
-            max_tokens=max_tokens,
-            temperature=temperature
+        # Il PDF è servito per URL come file statico: al browser arriva solo l'indirizzo, non il file
+        # ricodificato in base64 a ogni rerun. Viene pubblicato una volta per file caricato e l'URL
+        # resta nello stato della sessione.
+        if not st.get_option("server.enableStaticServing"):
+            st.info("Set server.enableStaticServing = true to preview the exam PDF here.")
+            return
+        anteprima = st.session_state.get("anteprima_pdf")
+        if anteprima is None or anteprima[0] != file.file_id:
+            anteprima = (file.file_id, pubblica_anteprima_pdf(file.getvalue()))
+            st.session_state["anteprima_pdf"] = anteprima
+        st.markdown(
+            f'<iframe src="{anteprima[1]}" width="100%" height="500" type="application/pdf"></iframe>',
+            unsafe_allow_html=True
         )
-        
-        return risposta.choices[0].message.content, None
 
-    # Gestione errori API OpenRouter
-    except openai.APIError as e:
-        if "insufficient_quota" in str(e).lower() or "credit" in str(e).lower():
-            return None, "Error: You have exhausted your OpenRouter quota. Check your plan or wait for monthly renewal."
-        elif "model not found" in str(e).lower():
-            return None, f"Error: Model '{modello_scelto}' not found on OpenRouter. Please check the model name."
-        return None, f"Error API OpenRouter: {e}"
-
-    # Gestione di altri errori imprevisti
-    except Exception as e:
-        return None, f"Unexpected Error: {e}"
+# Funzione per mostrare il pannello con le metriche delle chiamate LLM della sessione
+def mostra_metriche_chiamate(registro):
+    def formatta(valore, formato):
+        return format(valore, formato) if valore is not None else "-"
+
+    def righe_tabella(aggregati, nome_colonna):
+        return [
+            {
+                nome_colonna: chiave if chiave is not None else "-",
+                "Calls": valori["chiamate"],
+                "Cache hits": valori["risposte_da_cache"],
+                "Errors": valori["errori"],
+                "Prompt tokens": valori["prompt_tokens"],
+                "Cached tokens": valori["cached_tokens"],
+                "Completion tokens": valori["completion_tokens"],
+                "Cost (USD)": formatta(valori["costo"], ".4f"),
+                "Latency p50 (s)": formatta(valori["latenza_p50"], ".2f"),
+                "Latency p99 (s)": formatta(valori["latenza_p99"], ".2f"),
+                "TTFT p50 (s)": formatta(valori["tempo_primo_token_p50"], ".2f"),
+                "Tokens/s": formatta(valori["token_al_secondo"], ".1f"),
+                "Successful gradings/USD": formatta(valori["correzioni_per_usd"], ".1f"),
+            }
+            for chiave, valori in aggregati.items()
+        ]
+
+    totali = registro.sessione()
+    with st.expander("📊 LLM Usage Metrics", expanded=False):
+        col_chiamate, col_token, col_costo, col_latenza = st.columns(4)
+        col_chiamate.metric("Calls (cache hits)", f"{totali['chiamate']} ({totali['risposte_da_cache']})")
+        col_token.metric("Tokens in / out", f"{totali['prompt_tokens']} / {totali['completion_tokens']}")
+        col_costo.metric(
+            "Estimated cost (USD)",
+            formatta(totali["costo"], ".4f"),
+            help=f"Budget: {registro.budget if registro.budget is not None else 'no limit'}"
+        )
+        col_latenza.metric("Latency p50 / p99 (s)", f"{formatta(totali['latenza_p50'], '.1f')} / {formatta(totali['latenza_p99'], '.1f')}")
+        riparazioni = statistiche_riparazione_json()
+        if riparazioni["tasso_riparazione"] is not None:
+            st.caption(
+                f"Malformed JSON responses repaired locally: {sum(riparazioni['riparate'].values())} of "
+                f"{sum(riparazioni['riparate'].values()) + riparazioni['non_riparabili']} "
+                f"({', '.join(f'{tipo}: {numero}' for tipo, numero in sorted(riparazioni['riparate'].items())) or 'none'})"
+            )
+        if registro.budget_superato():
+            st.warning("Session budget exceeded: batch grading is paused until the budget is raised.")
+        st.write("**Per model**")
+        st.dataframe(righe_tabella(registro.per_modello(), "Model"), use_container_width=True)
+        st.write("**Per student**")
+        st.dataframe(righe_tabella(registro.per_studente(), "Student"), use_container_width=True)
+
+# Funzione per mostrare i tempi di esecuzione della pagina (rerun corrente e recenti)
+def mostra_tempi_pagina(tempi_rerun):
+    with st.expander("⏱️ Page timing", expanded=False):
+        col_ultimo, col_mediana, col_sdk = st.columns(3)
+        col_ultimo.metric("This rerun (ms)", f"{tempi_rerun[-1] * 1000:.0f}")
+        col_mediana.metric(f"Median of last {len(tempi_rerun)} reruns (ms)", f"{sorted(tempi_rerun)[len(tempi_rerun) // 2] * 1000:.0f}")
+        col_sdk.metric("LLM SDK loaded", "yes" if "openai" in sys.modules else "no (deferred)")
+        st.caption(
+            "Reruns up to this panel, correction calls included. "
+            "The OpenRouter client and its keep-alive connections are shared by all sessions."
+        )
 
-def evidenzia_errori_json(codice_c, correzioni_json_str):
+# Testo d'esame usato per i punteggi base (può contenere definizioni di punteggio):
+# il contenuto del .txt o il testo estratto dal PDF
+def testo_esame_per_punteggi():
+    # 'testo_esame' è l'oggetto UploadedFile, 'testo_modificato' è il suo contenuto stringa
+    if "testo_esame" in st.session_state and \
+       st.session_state["testo_esame"] is not None and \
+       st.session_state["testo_esame"].name.endswith((".txt", ".pdf")):
+        return st.session_state.get("testo_modificato", "")
+    return None
+
+# Funzione per mostrare il registro della classe dopo la correzione di tutti gli studenti
+def mostra_registro_classe(risultati_batch):
+    punteggi_base = punteggi_base_funzioni(st.session_state.get("criteri_modificati", ""), testo_esame_per_punteggi())
+    if not punteggi_base:
+        st.info("No functions with base scores found in criteria: the class gradebook is not available.")
+        return
+    cartella = st.session_state.get("cartella_codici")
+    nomi_file = {
+        nome_studente: cartella[nome_studente].name
+        for nome_studente in risultati_batch if cartella is not None and nome_studente in cartella
+    }
+    # Import differito: NumPy serve solo dopo una correzione di tutta la classe
+    from grading.matrice_punteggi import MatricePunteggi
+    matrice = MatricePunteggi.da_risultati(risultati_batch, punteggi_base, nomi_file)
+
+    def formatta(valore):
+        return f"{valore:.2f}" if valore is not None else "-"
+
+    statistiche = matrice.statistiche()
+    st.subheader("Class Gradebook")
+    col_studenti, col_media, col_mediana, col_intervallo = st.columns(4)
+    col_studenti.metric("Graded students", f"{statistiche['studenti']}/{len(matrice.studenti)}")
+    col_media.metric("Mean total", formatta(statistiche["media"]))
+    col_mediana.metric("Median total", formatta(statistiche["mediana"]))
+    col_intervallo.metric("Min / max", f"{formatta(statistiche['minimo'])} / {formatta(statistiche['massimo'])}")
+
+    conteggi, estremi = matrice.istogramma()
+    st.write("**Distribution of total scores**")
+    st.bar_chart({
+        "Range": [f"{inizio:.1f}-{fine:.1f}" for inizio, fine in zip(estremi[:-1], estremi[1:])],
+        "Students": conteggi.tolist(),
+    }, x="Range", y="Students")
+
+    st.write("**Per criterion**")
+    st.dataframe([
+        {
+            "Function": func_name,
+            "Base": valori["base"],
+            "Mean": round(valori["media"], 2),
+            "Median": round(valori["mediana"], 2),
+            "Mean deduction": round(valori["deduzione_media"], 2),
+            "Students with deductions": f"{valori['frequenza_deduzioni']:.0%}",
+        }
+        for func_name, valori in matrice.statistiche_per_funzione().items()
+    ], use_container_width=True)
+
+    csv_buffer = io.StringIO()
+    matrice.scrivi_csv(csv_buffer)
+    col_csv, col_parquet = st.columns(2)
+    col_csv.download_button("💾 Download gradebook (CSV)", csv_buffer.getvalue(), file_name="punteggi.csv", mime="text/csv")
+    parquet_buffer = io.BytesIO()
     try:
-        # Tenta di parsare la stringa JSON.
-        # È cruciale che correzioni_json_str sia un JSON valido qui.
-        dati_correzione = json.loads(correzioni_json_str)
-        if not isinstance(dati_correzione, list): # L'LLM è istruito a restituire una lista
-            # Il prompt si aspetta un array JSON. Se non è una lista, trattalo come errore.
-            raise json.JSONDecodeError("Expected a JSON array (list) from LLM.", correzioni_json_str, 0)
-    
-    except json.JSONDecodeError as e:
-        # Se il parsing JSON fallisce, restituisci il codice originale con un commento di errore
-        # e l'errore di parsing stesso.
-        messaggio_errore_parsing = f"/* Error parsing LLM JSON response: {str(e)}. \n   Raw response was: \n{correzioni_json_str}\n*/"
-        codice_con_errore_parsing = codice_c + "\n\n" + messaggio_errore_parsing
-        return codice_con_errore_parsing, 0, str(e), None # Aggiunto None per i dati analizzati
-
-    codice_lines = codice_c.split('\n')
-    totale_deduzioni = 0
-    # Memorizza le annotazioni per riga. Una riga può avere più commenti.
-    annotazioni_per_linea = {}  # Usa int come chiave (numero di riga 1-based)
-
-    # Regex per parsare i dettagli (criterio e punti) dall'intero commento catturato.
-    # Gruppo 1: Testo del criterio (e.g., "NEVER ENTERS THE LOOP!")
-    # Gruppo 2: Punti dedotti (e.g., "-5")
-    pattern_dettagli_commento_per_correzione = re.compile(r"//\*+\s*(.*?)\s*(-?\d+(?:\.\d+)?)(?:\s*\*+)?$")
-
-    for item_idx, item in enumerate(dati_correzione):
-        if not isinstance(item, dict):
-            # Ogni elemento nell'array dovrebbe essere un oggetto (dict).
-            # Salta elementi malformati o registra un avviso se necessario.
+        matrice.scrivi_parquet(parquet_buffer)
+    except ImportError as e:
+        col_parquet.caption(str(e))
+    else:
+        col_parquet.download_button("💾 Download gradebook (Parquet)", parquet_buffer.getvalue(), file_name="punteggi.parquet", mime="application/octet-stream")
+
+# Mostra l'avanzamento della correzione della classe leggendo i lavori dalla coda (il lavoratore li esegue
+# in background): elabora le risposte man mano che arrivano e, alla fine, salva i risultati nella sessione.
+# Il frammento rilegge la coda ogni INTERVALLO_AGGIORNAMENTO_CODA secondi senza bloccare lo script, quindi
+# la pagina resta utilizzabile; finita la correzione un rerun completo mostra i risultati.
+@st.fragment(run_every=INTERVALLO_AGGIORNAMENTO_CODA)
+def segui_correzione_in_coda(correzione):
+    if st.session_state.get("correzione_in_coda") is not correzione:
+        return  # Correzione già terminata: il frammento può ancora essere eseguito prima del rerun
+    lavoratore = get_lavoratore_coda(openrouter_api_key)
+    lavoratore.avvia()
+    codici_studenti = st.session_state["cartella_codici"].codici()
+    studenti = correzione["studenti"]
+    risultati_batch = correzione["risultati"]
+
+    lavori = lavoratore.coda.lavori(correzione["modello"], correzione["rubrica"], set(studenti))
+    for nome_studente in studenti:
+        lavoro = lavori.get(nome_studente)
+        if nome_studente in risultati_batch or lavoro is None or lavoro["stato"] not in (COMPLETATO, ERRORE):
             continue
+        risultato = {"json": None, "errore": lavoro["messaggio_errore"], "deduzioni": None}
+        if lavoro["stato"] == COMPLETATO:
+            # Il risultato passa per lo stesso percorso della correzione singola
+            avvisi = []
+            elaborato = elabora_risposta_llm(
+                codici_studenti[nome_studente], lavoro["risposta"], correzione["criteri"],
+                testo_esame_per_punteggi(), avvisi
+            )
+            # Gli avvisi restano nell'elenco: il frammento viene ridisegnato a ogni aggiornamento
+            for avviso in avvisi:
+                correzione["righe_stato"].append(f"⚠️ **{nome_studente}**: {avviso}")
+            # Nello stato restano solo i campi compatti, non il codice annotato
+            risultato = {
+                chiave: elaborato[chiave]
+                for chiave in ("json", "errore", "deduzioni", "deduzioni_funzioni", "numero_deduzioni_funzioni")
+            }
+            if risultato["errore"]:
+                risultato["deduzioni"] = None
+        risultati_batch[nome_studente] = risultato
+        correzione["token_prompt"] += lavoro["uso"].get("prompt_tokens", 0)
+        correzione["token_in_cache"] += lavoro["uso"].get("cached_tokens", 0)
+
+        rappresentante = lavoro["rappresentante"] or nome_studente
+        nota_duplicato = f" (equivalent to {rappresentante})" if rappresentante != nome_studente else ""
+        if risultato["errore"]:
+            correzione["righe_stato"].append(f"❌ **{nome_studente}**{nota_duplicato}: {risultato['errore']}")
+        else:
+            correzione["righe_stato"].append(f"✅ **{nome_studente}**{nota_duplicato}: `{risultato['deduzioni']}`")
+
+    if len(risultati_batch) < len(studenti):
+        st.progress(len(risultati_batch) / len(studenti), text=f"Correcting {len(risultati_batch)}/{len(studenti)} students...")
+        st.markdown("\n\n".join(correzione["righe_stato"]))
+        # Con il thread fermo i lavori non avanzerebbero più: invece di attendere all'infinito si segnala
+        # l'errore, e il pulsante (o il prossimo aggiornamento) lo riavvia riprendendo dagli studenti mancanti
+        if not lavoratore.attivo:
+            dettaglio = f": {lavoratore.errore}" if lavoratore.errore else ""
+            st.error(f"The grading worker stopped unexpectedly{dettaglio}. Completed results are kept; "
+                     "resume to grade the remaining students.")
+            st.button("🔄 Resume grading")
+        return
 
-        inline_comment_str = item.get("inline_comment")
-        
-        # Tentativo di correggere point_deduction basandosi sull'inline_comment
-        if inline_comment_str:
-            match_comment_details = pattern_dettagli_commento_per_correzione.search(inline_comment_str.strip())
-            if match_comment_details:
-                punti_str_from_comment = match_comment_details.group(2)
-                try:
-                    punti_float_from_comment = float(punti_str_from_comment)
-                    item["point_deduction"] = punti_float_from_comment # Sovrascrive con il valore dal commento
-                except ValueError:
-                    # Il commento è formattato ma i punti non sono un numero valido.
-                    st.warning(
-                        f"Avviso: Non è stato possibile analizzare la deduzione punti dall'inline_comment: '{inline_comment_str}' (item {item_idx}). "
-                        f"Il formato dei punti nel commento non è valido. "
-                        f"Verranno usati 0 punti per questo errore specifico. La deduzione punti originale dell'LLM era: {item.get('point_deduction')}"
-                    )
-                    item["point_deduction"] = 0.0 # Predefinito a 0 se il commento è malformato nei punti
-            else:
-                # L'inline_comment non corrisponde al formato atteso per estrarre i punti.
-                st.warning(
-                    f"Avviso: L'inline_comment '{inline_comment_str}' (item {item_idx}) non corrisponde al formato atteso per estrarre la deduzione punti. "
-                    f"Verranno usati 0 punti per questo errore specifico. La deduzione punti originale dell'LLM era: {item.get('point_deduction')}"
-                )
-                item["point_deduction"] = 0.0 # Predefinito a 0 se il formato del commento è errato
-
-        line_str = item.get("line")
-        point_deduction_val = item.get("point_deduction", 0)
-        inline_comment = item.get("inline_comment") # Commento pre-formattato dall'LLM
+    del st.session_state["correzione_in_coda"]
+    st.session_state["risultati_batch"] = risultati_batch
+    st.session_state["riepilogo_correzione_in_coda"] = {
+        "studenti": len(risultati_batch), "token_prompt": correzione["token_prompt"],
+        "token_in_cache": correzione["token_in_cache"],
+    }
+    # Mostra subito il risultato dello studente selezionato
+    reset_correction_display_states()
+    risultato_selezionato = risultati_batch.get(st.session_state.get("selected_student_name"))
+    if risultato_selezionato:
+        if risultato_selezionato["json"]:
+            st.session_state["correzioni_json_originale_llm"] = risultato_selezionato["json"]
+        else:
+            st.session_state["api_error_message"] = risultato_selezionato["errore"]
+    # Rerun dell'intera pagina: registro della classe e correzione dello studente selezionato
+    st.rerun()
 
-        try:
-            # Somma le deduzioni di punti (assicurati che point_deduction sia un numero)
-            totale_deduzioni += float(point_deduction_val)
-        except (ValueError, TypeError):
-            # Gestisci i casi in cui point_deduction potrebbe non essere un numero valido
-            # o registra questo come un problema con il formato di output dell'LLM.
-            pass
-
-        if line_str and inline_comment:
-            try:
-                line_num_int = int(line_str)  # Converte il numero di riga da stringa a intero
-                if line_num_int <= 0:  # I numeri di riga sono tipicamente basati su 1 (1-based)
-                    continue  # Salta numeri di riga non validi (es. 0 o negativi)
-
-                # Aggiunge il commento alla lista per questa riga
-                annotazioni_per_linea.setdefault(line_num_int, []).append(inline_comment)
-            except ValueError:
-                # Gestisci i casi in cui line_str non è una stringa intera valida.
-                pass # Salta questa annotazione di errore
-
-    # Aggiungi commenti alle righe di codice
-    codice_evidenziato_lines = []
-    for i, line_content in enumerate(codice_lines, start=1):
-        current_line_with_comments = line_content
-        if i in annotazioni_per_linea:
-            for comment in annotazioni_per_linea[i]:
-                current_line_with_comments += f" {comment}" # Aggiunge spazio prima del commento
-        codice_evidenziato_lines.append(current_line_with_comments)
-
-    codice_evidenziato_final = "\n".join(codice_evidenziato_lines)
-    return codice_evidenziato_final, totale_deduzioni, None, dati_correzione # Restituisce la lista analizzata
-
-def ricostruisci_errori_da_testo_commentato(testo_editato_con_commenti):
+def display_detailed_function_scores(student_code, criteria_text, error_list):
     """
-    Analizza il testo del codice (che può contenere commenti di errore)
-    per estrarre tutti gli errori formattati, ricalcolare il punteggio
-    e generare una nuova lista di oggetti errore.
-    Il formato del commento atteso è: //******** CRITERIA_TEXT -POINTS_DEDUCTED
-    Questo pattern cerca il formato //*** ... -POINTS alla FINE della riga.
+    Calcola e visualizza i punteggi dettagliati per ogni funzione.
     """
-    # Pattern per catturare l'intero commento di errore formattato alla fine di una riga.
-    # Gruppo 1: L'intero commento formattato.
-    # Gruppo 2: I punti dedotti.
-    # Gruppo 1: Testo del criterio (e.g., "NEVER ENTERS THE LOOP!")
-    # Gruppo 2: Punti dedotti (e.g., "-5")
-    pattern_dettagli_commento = r"//\*+\s*(.*?)\s*(-?\d+(?:\.\d+)?)\s*(?:\s*\*+)?$"
-
-    errori_ricostruiti = []
-    punteggio_ricalcolato = 0
-
-    if testo_editato_con_commenti:
-        righe_codice = testo_editato_con_commenti.splitlines() # Più robusto per i fine riga
-        for idx, riga_contenuto in enumerate(righe_codice, start=1):
-            # Trova tutti i commenti di errore formattati sulla riga
-            # Questa regex cattura l'intera stringa del commento (Gruppo 1) e i punti (Gruppo 2)
-            pattern_comment_and_points_at_end_of_line = re.compile(r"(//\*+\s*.*?\s*(-?\d+(?:\.\d+)?)\s*(?:\s*\*+)?)$")
-            match_full_comment_and_points = pattern_comment_and_points_at_end_of_line.search(riga_contenuto)
-
-            if match_full_comment_and_points:
-                full_matched_comment_string = match_full_comment_and_points.group(1) # L'intera stringa del commento
-                punti_str = match_full_comment_and_points.group(2) # La stringa dei punti
-                # Ora, estrai il criterio dalla stringa completa del commento
-                # Rimuovi la parte dei punti dalla fine della stringa completa del commento
-                criteria = full_matched_comment_string[:-len(match_full_comment_and_points.group(2))].strip() # Rimuove la stringa dei punti dalla fine
-                # È necessario rimuovere i //*** iniziali e gli spazi bianchi dal criterio
-                criteria = re.sub(r"//\*+\s*", "", criteria).strip()
-                try:
-                    punti = float(punti_str)
-                    errori_ricostruiti.append({
-                        "line": str(idx),
-                        "criteria": criteria,
-                        "point_deduction": punti,
-                        "inline_comment": full_matched_comment_string.strip()
-                    })
-                    punteggio_ricalcolato += punti
-                except ValueError:
-                    pass # Ignora se i punti non sono un numero valido
-    
-    return punteggio_ricalcolato, errori_ricostruiti
+    defined_functions = find_c_function_definitions(student_code)
+    criteria_scores = parse_criteria_function_scores(criteria_text)
 
-# --- Funzioni Helper per l'analisi dei punteggi per funzione ---
-def find_c_function_definitions(code_string):
-    """
-    Identifica le definizioni delle funzioni in una stringa di codice C.
-    Restituisce una lista di dizionari, ognuno con "name", "start_line", "end_line".
-    Limitazione: Semplice parser basato su regex; potrebbe non coprire tutti i casi C complessi.
-    """
-    lines = code_string.splitlines()
-    functions = []
-    # Regex per identificare una definizione di funzione (semplificata)
-    # Cattura: tipo di ritorno (molto generico), nome funzione, parametri
-    # Assume che la parentesi graffa aperta '{' sia sulla stessa riga della definizione.
-    func_def_pattern = re.compile( # noqa: E501
-        r"^\s*([\w\s\*&]+(?:\[\s*\])?)\s+"  # Tipo di ritorno (parole, spazi, *, &, opzionale [])
-        r"([a-zA-Z_]\w*)\s*"              # Nome funzione
-        r"\(([^)]*)\)\s*(?:const)?\s*(?:(?:/\*.*?\*/)|(?://[^\r\n]*))*\s*\{"  # Parametri, commenti opzionali, e {
-    )
+    if not defined_functions:
+        st.info("No function definitions found in the student's code to analyze for detailed scores.")
+        return
 
-    for i, line_content in enumerate(lines):
-        match = func_def_pattern.match(line_content)
-        if match:
-            func_name = match.group(2)
-            start_line_num = i + 1  # 1-based
-            
-            # Trova la fine della funzione contando le parentesi graffe
-            brace_level = 1 # Per la { di apertura della funzione stessa
-            # Contenuto sulla stessa riga dopo la {
-            content_after_opening_brace = line_content[match.end():]
-            brace_level += content_after_opening_brace.count('{')
-            brace_level -= content_after_opening_brace.count('}')
-
-            end_line_num = -1
-            if brace_level == 0: # Il corpo della funzione è terminato sulla stessa riga
-                end_line_num = start_line_num
-            else: # Il corpo della funzione si estende su più righe
-                for j in range(i + 1, len(lines)): # Inizia l'analisi dalla riga successiva
-                    current_line_in_body = lines[j]
-                    brace_level += current_line_in_body.count('{')
-                    brace_level -= current_line_in_body.count('}')
-                    if brace_level == 0:
-                        end_line_num = j + 1 # 1-based, quindi aggiungi 1 all'indice j
-                        break
-            
-            if end_line_num != -1:
-                functions.append({
-                    "name": func_name,
-                    "start_line": start_line_num,
-                    "end_line": end_line_num
-                })
-    return functions
-
-def parse_criteria_function_scores(criteria_text):
+    st.markdown("---")
+    st.subheader("Detailed Scores per Function:")
+
+# Frammento: un'interazione con un widget al suo interno riesegue solo questa funzione, non tutta la pagina
+@st.fragment
+def pannello_codice_corretto():
     """
-    Estrae i punteggi base per funzione dal testo dei criteri.
-    Formato atteso: "nome_funzione: punteggio" (es. "massimoPari: 5.0").
-    Restituisce un dizionario {nome_funzione: punteggio_base}.
+    Codice corretto modificabile, con il download e le viste che ne dipendono (deduzione totale,
+    punteggi per funzione, lista degli errori). Ogni modifica dell'area di testo riesegue solo questo frammento.
     """
-    scores = {}
-    # Pattern 1: "nome_funzione: punteggio" (commento opzionale #...)
-    pattern_colon = re.compile(r"^\s*([a-zA-Z_]\w*)\s*:\s*(\d+(?:\.\d+)?)\s*(?:#.*)?$")
-    # Pattern 2: "nomeFunzione (punteggio pt)..." (caratteri finali opzionali)
-    # Esempio: "massimoPari (5.0 pt)........."
-    # Reso più flessibile per accettare (5.0), (5.0 pt), (5.0 pt.), ecc.
-    pattern_parenthesis_pt = re.compile(
-        r"^\s*([a-zA-Z_]\w*)\s*"       # Nome funzione (es. massimoPari)
-        r"\(\s*(\d+(?:\.\d+)?)\s*(?:pt\.?)?\s*\)" # Punteggio tra parentesi, "pt" e il punto sono opzionali
-        r".*$"                          # Consuma il resto della riga (es. .........) # noqa: E501
+    # Non fornire 'value' qui; la 'key' gestirà lo stato della textarea.
+    # Il suo valore sarà accessibile tramite st.session_state.text_area_corrected_code_llm,
+    # inizializzato con il codice annotato quando arriva la risposta dell'LLM.
+    st.text_area(
+        "Corrected Code (Editable):",
+        height=400,
+        key="text_area_corrected_code_llm"
     )
 
-    for line in criteria_text.splitlines():
-        line_stripped = line.strip()
-        match_colon = pattern_colon.match(line_stripped)
-        if match_colon:
-            func_name = match_colon.group(1)
-            score = float(match_colon.group(2))
-            scores[func_name] = score
-        else:
-            match_parenthesis_pt = pattern_parenthesis_pt.match(line_stripped)
-            if match_parenthesis_pt:
-                func_name = match_parenthesis_pt.group(1)
-                score = float(match_parenthesis_pt.group(2))
-                scores[func_name] = score
-    return scores
-
-def build_call_map(code_string, all_defined_functions):
-    """
-    Costruisce una mappa semplice delle chiamate di funzione.
-    Restituisce un dizionario dove la chiave è il nome di una funzione (chiamante)
-    e il valore è una lista di nomi di funzioni che essa chiama (chiamate).
-    Questo è un approccio semplificato basato su regex e potrebbe non essere perfetto.
-    """
-    call_map = {func['name']: [] for func in all_defined_functions}
-    function_names = [func['name'] for func in all_defined_functions]
-    code_lines = code_string.splitlines()
-
-    for caller_func in all_defined_functions:
-        caller_name = caller_func['name']
-        start_line = caller_func['start_line'] - 1
-        end_line = caller_func['end_line']
-        
-        func_body_lines = code_lines[start_line:end_line]
-        
-        for callee_name in function_names:
-            if caller_name == callee_name:
-                continue
-            
-            # Regex semplice per trovare una chiamata di funzione: nome_funzione seguito da (
-            # \b assicura che vengano abbinate solo parole intere.
-            call_pattern = re.compile(r'\b' + re.escape(callee_name) + r'\s*\(')
-            
-            for line in func_body_lines:
-                if call_pattern.search(line):
-                    if callee_name not in call_map[caller_name]:
-                        call_map[caller_name].append(callee_name)
-    return call_map
+    # Il testo corrente modificato dall'utente è in st.session_state.text_area_corrected_code_llm
+    testo_corrente_nella_textarea = st.session_state.get("text_area_corrected_code_llm", "")
 
-def find_main_caller(aux_func_name, call_map, main_func_names):
-    """
-    Trova una funzione principale che chiama, direttamente o indirettamente, la funzione ausiliaria data.
-    Esegue una ricerca inversa sulla mappa delle chiamate.
-    Restituisce il nome del chiamante della funzione principale, o None se non trovato.
-    """
-    visited = set()
+    # Sincronizza codice_corretto_editabile (usato per il download e come "master" prima dell'edit)
+    # con il contenuto attuale della textarea, se sono diversi.
+    if st.session_state.get("codice_corretto_editabile") != testo_corrente_nella_textarea:
+        st.session_state["codice_corretto_editabile"] = testo_corrente_nella_textarea
 
-    def reverse_search(current_func_name):
-        if current_func_name in visited:
-            return None
-        visited.add(current_func_name)
+    # Pulsante di download per il codice corretto editabile
+    # La logica per determinare il nome del file va qui, prima del pulsante
+    nome_file_corretto_con_commenti = nome_file_corretto("student", "task.c")
+    if "selected_student_name" in st.session_state and \
+       st.session_state["selected_student_name"] and \
+       "cartella_codici" in st.session_state and \
+       isinstance(st.session_state["cartella_codici"], Mapping) and \
+       st.session_state["selected_student_name"] in st.session_state["cartella_codici"]:
+        student_id_part = st.session_state["selected_student_name"]
+        selected_file_obj = st.session_state["cartella_codici"][student_id_part]
+        nome_file_corretto_con_commenti = nome_file_corretto(student_id_part, selected_file_obj.name)
 
-        potential_callers = [caller for caller, callees in call_map.items() if current_func_name in callees]
+    st.download_button(
+        label="💾 Save Corrected Code with LLM Comments",
+        data=st.session_state.get("codice_corretto_editabile", ""), # Usa il valore dallo stato # noqa: E501
+        file_name=nome_file_corretto_con_commenti,
+        mime="text/x-c"
+    )
 
-        for caller in potential_callers:
-            if caller in main_func_names:
-                return caller
-            else:
-                main_caller = reverse_search(caller)
-                if main_caller:
-                    return main_caller
-        return None
+    # Ricalcola sempre punteggio e lista errori basati sul contenuto corrente della textarea.
+    # Il risultato è memorizzato per hash del testo: se la textarea non è cambiata, il rerun non ripete l'analisi.
+    punteggio_dinamico, errori_ricostruiti_dal_testo = ricostruisci_errori_da_testo_commentato(
+        testo_corrente_nella_textarea
+    )
+    st.session_state["punteggio_attuale"] = punteggio_dinamico
+    st.session_state["errori_attuali"] = errori_ricostruiti_dal_testo
+
+    # Le viste che dipendono dal codice non sono frammenti a sé: non hanno widget che le rieseguano da sole,
+    # quindi vengono ridisegnate con il pannello a ogni modifica dell'area di testo
+    mostra_totale_deduzioni(punteggio_dinamico)
+    if testo_corrente_nella_textarea and st.session_state.get("criteri_modificati"):
+        mostra_punteggi_funzioni(
+            testo_corrente_nella_textarea, st.session_state["criteri_modificati"],
+            testo_esame_per_punteggi(), errori_ricostruiti_dal_testo
+        )
+    mostra_lista_errori(errori_ricostruiti_dal_testo)
 
-    return reverse_search(aux_func_name)
+def mostra_totale_deduzioni(punteggio):
+    st.write(f"### ✏️ Total Point Deduction (dynamically updated): `{punteggio}`")
 
-def display_detailed_function_scores(student_code, criteria_text, error_list):
-    """
-    Calcola e visualizza i punteggi dettagliati per ogni funzione.
-    """
-    defined_functions = find_c_function_definitions(student_code)
-    criteria_scores = parse_criteria_function_scores(criteria_text)
+def mostra_punteggi_funzioni(codice_per_analisi, testo_criteri, testo_esame_contenuto, lista_errori_attuali):
+    """Riepilogo dei punteggi e dettaglio delle deduzioni per ogni funzione principale (con un punteggio base)."""
+    # I punteggi dei criteri sovrascrivono/integrano quelli dell'esame
+    all_function_base_scores = punteggi_base_funzioni(testo_criteri, testo_esame_contenuto)
 
-    if not defined_functions:
-        st.info("No function definitions found in the student's code to analyze for detailed scores.")
+    if not all_function_base_scores:
+        st.info("No functions with base scores found in criteria to analyze for detailed scores.")
         return
+    # Calcolo delle deduzioni per funzione e del commento di riepilogo
+    function_deductions, function_deduction_details = calcola_deduzioni_per_funzione(
+        codice_per_analisi, lista_errori_attuali, all_function_base_scores
+    )
+    function_final_scores, total_final_score, summary_comment = calcola_punteggi_finali(
+        all_function_base_scores, function_deductions
+    )
+
+    st.header("Correction Results")
+    st.code(summary_comment, language='c')
 
     st.markdown("---")
-    st.subheader("Detailed Scores per Function:")
+    st.subheader("Detailed Function Score Breakdown:")
+
+    # Mostra i risultati solo per le funzioni principali
+    for func_name, base_score in all_function_base_scores.items():
+        # Recupera i valori già calcolati
+        final_score = function_final_scores[func_name]
+        calc_details = "".join(function_deduction_details[func_name])
+
+        col_func_name, col_func_calc = st.columns([2,3])
+        with col_func_name:
+            st.markdown(f"`{func_name}({base_score:.1f})`:")
+        with col_func_calc:
+            st.markdown(f"`{final_score:.1f} = {base_score:.1f}{calc_details}`")
+        st.markdown(f"&nbsp;&nbsp;&nbsp;&nbsp;Punteggio finale `{func_name}` = **{final_score:.1f}**")
+        st.markdown("---") # Separatore per la prossima funzione
+
+def mostra_lista_errori(lista_errori):
+    st.write("### Current Error List (JSON - dynamically updated):")
+    # st.json visualizza direttamente la lista, senza serializzarla prima in una stringa
+    st.json(lista_errori)
 
 # --- Sezione Interfaccia Utente ---
 
@@ -472,7 +512,7 @@ with col1:
     if "cartella_codici" in st.session_state and st.session_state["cartella_codici"]:
         student_data = st.session_state["cartella_codici"]
         # Controlla se è il nuovo formato (dizionario di file) o il vecchio formato (percorso cartella)
-        if isinstance(student_data, dict):
+        if isinstance(student_data, Mapping):
             # Nuovo formato: dizionario di file studente
             st.write(f"\U0001F4C1 **Student files loaded:** {len(student_data)} students")
             
@@ -489,9 +529,16 @@ with col1:
                     if "selected_student_name" not in st.session_state or st.session_state["selected_student_name"] != selected_student:
                         st.session_state["selected_student_name"] = selected_student
                         st.session_state["selected_c_file_path"] = selected_file.name
-                        st.session_state["codice_studente_originale"] = selected_file.getvalue().decode("utf-8")
-                        st.session_state["codice_studente_modificato"] = selected_file.getvalue().decode("utf-8")
+                        # Il codice viene letto dallo zip e decodificato solo ora, per lo studente selezionato
+                        st.session_state["codice_studente_modificato"] = selected_file.testo()
                         reset_correction_display_states()
+                        # Se lo studente è già stato corretto con "Correct all students", mostra quel risultato
+                        risultato_batch = st.session_state.get("risultati_batch", {}).get(selected_student)
+                        if risultato_batch:
+                            if risultato_batch["json"]:
+                                st.session_state["correzioni_json_originale_llm"] = risultato_batch["json"]
+                            else:
+                                st.session_state["api_error_message"] = risultato_batch["errore"]
 
 
                     
@@ -552,7 +599,7 @@ with col1:
     student_selected = False
     
     if student_codes_available:
-        if isinstance(st.session_state["cartella_codici"], dict):
+        if isinstance(st.session_state["cartella_codici"], Mapping):
             student_selected = st.session_state.get("selected_student_name") is not None
     
     if student_codes_available and student_selected:
@@ -582,44 +629,254 @@ with col1:
 
             # Mostra il pulsante di correzione solo se un modello è selezionato
             if modello_scelto:
+                forza_ricorrezione = st.checkbox(
+                    "Force re-grade (ignore cached responses)",
+                    value=False,
+                    key="forza_ricorrezione"
+                )
+                cache_funzioni = st.checkbox(
+                    "Reuse verdicts of functions already graded",
+                    value=True,
+                    key="cache_funzioni",
+                    help="Functions identical to one graded before (e.g. a helper from the provided skeleton) keep their "
+                         "cached annotations; only the other functions are sent to the model."
+                )
+                output_strutturato = st.checkbox(
+                    "Structured output (JSON schema)",
+                    value=True,
+                    key="output_strutturato",
+                    help="Models that support it (OpenAI, Gemini) must answer following the JSON schema of the errors. "
+                         "Nearly valid JSON from the other models is repaired locally."
+                )
+                statistiche_cache = cache_risposte.statistiche()
+                st.caption(
+                    f"Response cache: {statistiche_cache['voci']} entries "
+                    f"({statistiche_cache['byte'] / 1024:.0f} KB), "
+                    f"{statistiche_cache['hit']} hits / {statistiche_cache['miss']} misses"
+                )
                 # Visualizzazione del codice e degli errori
+                risposta_in_streaming = st.checkbox(
+                    "Stream response (show annotations while the model is generating)",
+                    value=True,
+                    key="risposta_in_streaming"
+                )
+                with st.expander("⚙️ Reliability settings", expanded=False):
+                    politica_chiamate.timeout = st.number_input(
+                        "Timeout per request (seconds):", min_value=5.0, max_value=600.0, value=60.0, step=5.0,
+                        key="timeout_richiesta"
+                    )
+                    politica_chiamate.max_tentativi = st.number_input(
+                        "Attempts per model (on timeouts, rate limits and server errors):",
+                        min_value=1, max_value=10, value=3, key="max_tentativi"
+                    )
+                    politica_chiamate.scadenza_totale = st.number_input(
+                        "Maximum time per student, retries and fallbacks included (seconds):",
+                        min_value=10.0, max_value=1800.0, value=180.0, step=10.0, key="scadenza_totale"
+                    )
+                    politica_chiamate.hedging = st.checkbox(
+                        "Hedge slow requests (send a second copy, use the first answer)",
+                        value=False, key="hedging",
+                        help="Applies to non-streamed requests once enough latencies have been observed for the model. "
+                             "The duplicate request is billed too."
+                    )
+                    politica_chiamate.percentile_hedging = st.slider(
+                        "Hedging threshold (latency percentile):", min_value=50, max_value=99, value=95,
+                        key="percentile_hedging", disabled=not politica_chiamate.hedging
+                    )
+                    politica_chiamate.modelli_riserva = st.multiselect(
+                        "Fallback models (tried in order if the selected model is unavailable):",
+                        [opzione for opzione in model_options if opzione not in ("Custom Model", modello_scelto)],
+                        key="modelli_riserva"
+                    )
+                    modelli_ensemble_aggiuntivi = st.multiselect(
+                        "Ensemble: also grade with these models (in parallel) and keep the errors enough models agree on:",
+                        [opzione for opzione in model_options if opzione not in ("Custom Model", modello_scelto)],
+                        key="modelli_ensemble",
+                        help="Errors are matched by line and criterion. Calls still running once the vote is decided "
+                             "are no longer awaited, but they are billed."
+                    )
+                    modelli_ensemble = [modello_scelto] + modelli_ensemble_aggiuntivi if modelli_ensemble_aggiuntivi else None
+                    soglia_voti = None
+                    if modelli_ensemble:
+                        # La chiave dipende dal numero di modelli: il massimo del campo cambia con la selezione
+                        soglia_voti = int(st.number_input(
+                            "Votes needed to keep an error:", min_value=1, max_value=len(modelli_ensemble),
+                            value=soglia_maggioranza(len(modelli_ensemble)), key=f"soglia_voti_{len(modelli_ensemble)}"
+                        ))
                 if st.button("🤖 Correct"):
                     reset_correction_display_states()
 
                     criteri = st.session_state.get("criteri_modificati", "")
                     testo_esame = st.session_state.get("testo_modificato", "")
                     codice = st.session_state.get("codice_studente_modificato", "") # Usa il codice dall'area di testo editabile
-                    llm_response_content, api_or_model_error = correggi_codice(codice, criteri, testo_esame, modello_scelto, client)
+
+                    callback_streaming = None
+                    # Le risposte dei modelli dell'ensemble vengono unite alla fine: niente anteprima in streaming
+                    anteprima_in_streaming = risposta_in_streaming and not modelli_ensemble
+                    if anteprima_in_streaming:
+                        # Anteprima aggiornata con gli oggetti errore completati dal parser incrementale
+                        parser_streaming = ParserArrayJSONIncrementale()
+                        anteprima_deduzioni = st.empty()
+                        anteprima_codice = st.empty()
+                        anteprima_deduzioni.write("### ⏳ Waiting for the first annotation...")
+
+                        ultimo_aggiornamento = {"istante": 0.0}
+
+                        def aggiorna_anteprima(frammento):
+                            # Ogni aggiornamento annota tutto il file: al più uno ogni INTERVALLO_ANTEPRIMA_STREAMING
+                            # secondi, così il costo non cresce con il quadrato degli errori. Gli oggetti arrivati
+                            # nel frattempo compaiono al successivo; alla fine l'anteprima è sostituita dai risultati.
+                            if not parser_streaming.feed(frammento):
+                                return
+                            if time.perf_counter() - ultimo_aggiornamento["istante"] < INTERVALLO_ANTEPRIMA_STREAMING:
+                                return
+                            ultimo_aggiornamento["istante"] = time.perf_counter()
+                            codice_parziale, deduzioni_parziali, _, _ = evidenzia_errori_json(
+                                codice, json.dumps(parser_streaming.oggetti)
+                            )
+                            anteprima_deduzioni.write(
+                                f"### ⏳ Running Point Deduction: `{deduzioni_parziali}` "
+                                f"({len(parser_streaming.oggetti)} errors so far)"
+                            )
+                            anteprima_codice.code(codice_parziale, language="c")
+                        callback_streaming = aggiorna_anteprima
+
+                    uso_token = {}
+                    info_ensemble = {} if modelli_ensemble else None
+                    if modelli_ensemble:
+                        llm_response_content, api_or_model_error = correggi_codice_ensemble(
+                            codice, criteri, testo_esame, modelli_ensemble, client_openrouter(), soglia_voti,
+                            cache=cache_risposte, forza_ricorrezione=forza_ricorrezione, info_uso=uso_token,
+                            registro=registro_chiamate, studente=st.session_state.get("selected_student_name"),
+                            politica=politica_chiamate, cache_funzioni=cache_funzioni,
+                            output_strutturato=output_strutturato, info_ensemble=info_ensemble
+                        )
+                    else:
+                        llm_response_content, api_or_model_error = correggi_codice(
+                            codice, criteri, testo_esame, modello_scelto, client_openrouter(),
+                            cache=cache_risposte, forza_ricorrezione=forza_ricorrezione,
+                            callback_streaming=callback_streaming, info_uso=uso_token,
+                            registro=registro_chiamate, studente=st.session_state.get("selected_student_name"),
+                            politica=politica_chiamate, cache_funzioni=cache_funzioni,
+                            output_strutturato=output_strutturato
+                        )
+                    st.session_state["ultimo_uso_token"] = uso_token
+                    st.session_state["ultimo_ensemble"] = info_ensemble
+                    if anteprima_in_streaming:
+                        # L'anteprima viene sostituita dalla visualizzazione completa dei risultati
+                        anteprima_deduzioni.empty()
+                        anteprima_codice.empty()
 
                     if api_or_model_error:
                         st.session_state["api_error_message"] = api_or_model_error
-                    elif llm_response_content is not None:
-                        processed_response = llm_response_content.strip()
-                        
-                        # Rimuovi UTF-8 BOM se presente
-                        if processed_response.startswith('\ufeff'):
-                            processed_response = processed_response[1:] # noqa: E203
-
-                        # Tenta di estrarre il contenuto JSON da un blocco di codice Markdown
-                        # Cerca ```json ... ``` o ``` ... ```
-                        # Il regex cattura il contenuto tra i delimitatori.
-                        # Gestisce il specificatore di linguaggio "json" opzionale e spazi/newline circostanti.
-                        match = re.search(r"```(?:json)?\s*([\s\S]+?)\s*```", processed_response)
-                        if match:
-                            extracted_json_str = match.group(1).strip() # Ottiene il contenuto e fa lo strip
+                    else:
+                        extracted_json_str, extraction_error = estrai_json_da_risposta(llm_response_content)
+                        if extraction_error:
+                            st.session_state["api_error_message"] = extraction_error
                         else:
-                            extracted_json_str = processed_response # Suppone sia JSON grezzo o qualcos'altro
-                            
-                        if extracted_json_str: # Se non è vuoto dopo lo strip e la rimozione del BOM/Markdown
-                            # La risposta non è vuota. Verrà passata a evidenzia_errori_json.
-                            # Se è ancora JSON non valido (es. "abc" o malformato), 
-                            # evidenzia_errori_json intercetterà l'errore di parsing e lo segnalerà.                            
                             st.session_state["correzioni_json_originale_llm"] = extracted_json_str
                             st.session_state["api_error_message"] = None # Assicura che sia pulito
-                        else:
-                            st.session_state["api_error_message"] = "LLM returned an empty response or content that became empty after attempting to extract JSON from potential Markdown. Expected a JSON array."
-                    else: # llm_response_content è None (e api_or_model_error non è stato impostato da correggi_codice)
-                        st.session_state["api_error_message"] = "Received no response content from the LLM (response was None)."
+
+                ultimo_uso_token = st.session_state.get("ultimo_uso_token")
+                if ultimo_uso_token:
+                    st.caption(
+                        f"Last call: {ultimo_uso_token['prompt_tokens']} prompt tokens "
+                        f"({ultimo_uso_token['cached_tokens']} cached), "
+                        f"{ultimo_uso_token['completion_tokens']} completion tokens"
+                    )
+                ultimo_ensemble = st.session_state.get("ultimo_ensemble")
+                if ultimo_ensemble:
+                    errori_per_modello = ", ".join(
+                        f"{modello}: {numero}" for modello, numero in ultimo_ensemble["errori_per_modello"].items()
+                    )
+                    st.caption(
+                        f"Ensemble: errors found per model ({errori_per_modello}), kept when reported by at least "
+                        f"{ultimo_ensemble['soglia_voti']} models."
+                        + (f" Consensus reached without waiting for: {', '.join(ultimo_ensemble['non_attesi'])}."
+                           if ultimo_ensemble["non_attesi"] else "")
+                        + (f" Failed: {', '.join(ultimo_ensemble['errori_modelli'])}." if ultimo_ensemble["errori_modelli"] else "")
+                    )
+
+                # Correzione di tutti gli studenti in parallelo
+                max_richieste_parallele = st.number_input(
+                    "Maximum parallel requests:",
+                    min_value=1,
+                    max_value=32,
+                    value=8,
+                    key="max_richieste_parallele"
+                )
+                budget_sessione = st.number_input(
+                    "Session budget in USD (0 = no limit):",
+                    min_value=0.0,
+                    value=0.0,
+                    step=0.5,
+                    key="budget_sessione",
+                    help="Batch grading skips the remaining students once the estimated session cost reaches this value."
+                )
+                registro_chiamate.budget = budget_sessione or None
+                deduplica_consegne = st.checkbox(
+                    "Grade equivalent submissions once",
+                    value=True,
+                    key="deduplica_consegne",
+                    help="Submissions that differ only in whitespace, comments or variable names are graded with a single "
+                         "LLM call; the annotations are mapped back onto each student's own lines."
+                )
+                gruppi_duplicati = None
+                if deduplica_consegne:
+                    # Impronte calcolate alla prima visualizzazione con la deduplicazione attiva, poi riusate
+                    if st.session_state.get("gruppi_duplicati") is None:
+                        # Un solo passaggio sullo zip: i codici non restano in memoria né vengono salvati nel deposito
+                        with st.spinner("Looking for equivalent submissions..."):
+                            st.session_state["gruppi_duplicati"] = raggruppa_duplicati(
+                                st.session_state["cartella_codici"].itera_codici()
+                            )
+                    gruppi_duplicati = st.session_state["gruppi_duplicati"]
+                    if gruppi_duplicati.chiamate_risparmiate:
+                        st.caption(
+                            f"{len(gruppi_duplicati.gruppi_con_duplicati())} groups of equivalent submissions: "
+                            f"{gruppi_duplicati.chiamate_risparmiate} LLM calls saved."
+                        )
+                if st.button("🤖 Correct all students"):
+                    if not openrouter_api_key:
+                        st.error("Error: OpenRouter client not initialized. Check API key.")
+                    else:
+                        criteri = st.session_state.get("criteri_modificati", "")
+                        testo_esame = st.session_state.get("testo_modificato", "")
+                        # Vista lazy: ogni codice viene decodificato solo quando serve
+                        codici_studenti = st.session_state["cartella_codici"].codici()
+                        lavoratore = get_lavoratore_coda(openrouter_api_key)
+                        lavoratore.max_workers = int(max_richieste_parallele)
+                        # I lavori già completati per questi studenti, modello e rubrica non vengono ripetuti
+                        # Con l'ensemble i lavori sono registrati con la sua etichetta, così non si confondono con
+                        # quelli del solo modello scelto
+                        modello_lavori = etichetta_ensemble(modelli_ensemble, soglia_voti) if modelli_ensemble else modello_scelto
+                        rubrica = lavoratore.accoda(
+                            codici_studenti, criteri, testo_esame, modello_lavori, gruppi=gruppi_duplicati,
+                            forza=forza_ricorrezione,
+                            opzioni={"cache_funzioni": cache_funzioni, "output_strutturato": output_strutturato,
+                                     "modelli_ensemble": modelli_ensemble, "soglia_voti": soglia_voti},
+                            politica=politica_chiamate, registro=registro_chiamate
+                        )
+                        lavoratore.avvia().notifica()
+                        st.session_state["correzione_in_coda"] = {
+                            "modello": modello_lavori, "rubrica": rubrica, "criteri": criteri,
+                            "studenti": list(codici_studenti), "risultati": {}, "righe_stato": [],
+                            "token_prompt": 0, "token_in_cache": 0,
+                        }
+
+                # Avanzamento della correzione della classe: riletto dalla coda anche dopo un rerun
+                if st.session_state.get("correzione_in_coda"):
+                    segui_correzione_in_coda(st.session_state["correzione_in_coda"])
+                # Riepilogo mostrato una sola volta, nel rerun che segue la fine della correzione
+                riepilogo = st.session_state.pop("riepilogo_correzione_in_coda", None)
+                if riepilogo:
+                    st.success(f"Correction completed for {riepilogo['studenti']} students.")
+                    st.caption(f"Prompt tokens: {riepilogo['token_prompt']} (served from provider prompt cache: {riepilogo['token_in_cache']})")
+                    if gruppi_duplicati and gruppi_duplicati.chiamate_risparmiate:
+                        st.caption(f"LLM calls saved by grading equivalent submissions once: {gruppi_duplicati.chiamate_risparmiate}")
+
+                if st.session_state.get("risultati_batch"):
+                    mostra_registro_classe(st.session_state["risultati_batch"])
             else:
                 st.warning("Please select or enter a model name to proceed with correction.")
 
@@ -671,6 +928,25 @@ with col3:
         if file.name.endswith(".pdf"):
             mostra_pdf(file)
 
+            # Il testo viene estratto una sola volta per contenuto del file (cache per hash)
+            testo_pdf, errore_pdf = estrai_testo_pdf(file.getvalue())
+            if errore_pdf:
+                st.warning(f"{errore_pdf} The exam text will not be sent to the LLM.")
+                # Evita di inviare il testo di un file caricato in precedenza
+                if st.session_state.get("testo_file_name") != file.name:
+                    st.session_state["testo_modificato"] = ""
+                    st.session_state["testo_file_name"] = file.name
+            else:
+                # Come per il .txt, il testo estratto resta modificabile finché non cambia il file
+                if "testo_modificato" not in st.session_state or st.session_state.get("testo_file_name") != file.name:
+                    st.session_state["testo_modificato"] = testo_pdf
+                    st.session_state["testo_file_name"] = file.name
+                st.text_area(
+                    "Text extracted from the PDF (sent to the LLM)",
+                    height=300,
+                    key="testo_modificato"
+                )
+
             # Modifica il tipo MIME per i PDF
             # Non ha senso "salvare con modifiche" un PDF visualizzato così, il download è dell'originale
             st.download_button("💾 Download Exam Text", file.getvalue(), file_name=file.name, mime="application/pdf")
@@ -725,10 +1001,14 @@ elif json_originale_llm: # Se c'è un JSON dall'LLM da processare
         
         st.session_state["last_processed_llm_json"] = json_originale_llm
 
+        avvisi_annotazioni = []
         codice_evidenziato_da_json, totale_deduzioni_iniziale, parsing_error, lista_errori_parsata_da_llm = evidenzia_errori_json(
             codice_studente_per_evidenziazione, 
-            json_originale_llm
+            json_originale_llm,
+            avvisi_annotazioni
         )
+        for avviso in avvisi_annotazioni:
+            st.warning(avviso)
 
 
         if parsing_error:
@@ -739,7 +1019,7 @@ elif json_originale_llm: # Se c'è un JSON dall'LLM da processare
             if "lista_oggetti_errore_iniziali" in st.session_state: del st.session_state["lista_oggetti_errore_iniziali"]
             if "codice_corretto_editabile" in st.session_state: del st.session_state["codice_corretto_editabile"]
             st.session_state["punteggio_attuale"] = 0
-            st.session_state["json_attuale_da_visualizzare"] = "[]"
+            st.session_state["errori_attuali"] = []
             # Non procedere oltre se c'è un errore di parsing
             st.stop() 
         else:
@@ -754,212 +1034,24 @@ elif json_originale_llm: # Se c'è un JSON dall'LLM da processare
             # IMPORTANTE: Sincronizza anche lo stato della text_area con il nuovo contenuto dall'LLM
             st.session_state["text_area_corrected_code_llm"] = codice_evidenziato_da_json
             st.session_state["punteggio_attuale"] = totale_deduzioni_iniziale
-            st.session_state["json_attuale_da_visualizzare"] = json_originale_llm
-
-    # --- Interazione dell'utente con l'area di testo ---
-    # Questa parte viene eseguita ad ogni rerun se l'area di testo è visibile e inizializzata
-
-    # Non fornire 'value' qui; la 'key' gestirà lo stato della textarea.
-    # Il suo valore sarà accessibile tramite st.session_state.text_area_corrected_code_llm.
-    # Se st.session_state.text_area_corrected_code_llm non esiste, verrà inizializzata (a stringa vuota di default,
-    # ma il blocco sopra la inizializza con il codice LLM quando arriva).
-    
-    st.text_area(
-        "Corrected Code (Editable):",
-        height=400,
-        key="text_area_corrected_code_llm"
-    )
+            st.session_state["errori_attuali"] = lista_errori_parsata_da_llm
 
-    # Il testo corrente modificato dall'utente è in st.session_state.text_area_corrected_code_llm
-    testo_corrente_nella_textarea = st.session_state.get("text_area_corrected_code_llm", "")
+    # Il pannello dei risultati è un frammento: modificare il codice corretto riesegue solo il pannello,
+    # non la selezione dello studente, le aree dei criteri e del testo d'esame o l'anteprima del PDF
+    pannello_codice_corretto()
 
-    # Sincronizza codice_corretto_editabile (usato per il download e come "master" prima dell'edit)
-    # con il contenuto attuale della textarea, se sono diversi.
-    if st.session_state.get("codice_corretto_editabile") != testo_corrente_nella_textarea:
-        st.session_state["codice_corretto_editabile"] = testo_corrente_nella_textarea
-
-    # Pulsante di download per il codice corretto editabile
-    # La logica per determinare il nome del file va qui, prima del pulsante
-    student_id_part = "unknown_student"
-    task_name_part = "unknown_task"
-
-    if "selected_student_name" in st.session_state and \
-       st.session_state["selected_student_name"] and \
-       "cartella_codici" in st.session_state and \
-       isinstance(st.session_state["cartella_codici"], dict) and \
-       st.session_state["selected_student_name"] in st.session_state["cartella_codici"]:
-        student_id_part = st.session_state["selected_student_name"]
-        selected_file_obj = st.session_state["cartella_codici"][student_id_part]
-        original_file_base = os.path.splitext(selected_file_obj.name)[0]
-        prefix_to_check = student_id_part + "_"
-        if original_file_base.startswith(prefix_to_check): # noqa: E501
-            task_name_part = original_file_base[len(prefix_to_check):]
-        else:
-            task_name_part = original_file_base
-            
-    if not student_id_part or student_id_part == "unknown_student": student_id_part = "student"
-    else: student_id_part = student_id_part.replace(' ', '_')
-    if not task_name_part or task_name_part == "unknown_task": task_name_part = "task"
-    
-    nome_file_corretto_con_commenti = f"{student_id_part}_corrected_{task_name_part}.c"
 
-    st.download_button(
-        label="💾 Save Corrected Code with LLM Comments",
-        data=st.session_state.get("codice_corretto_editabile", ""), # Usa il valore dallo stato # noqa: E501
-        file_name=nome_file_corretto_con_commenti,
-        mime="text/x-c"
-    )
-
-    # Ricalcola sempre punteggio e JSON basati sul contenuto corrente della textarea
-    punteggio_dinamico, errori_ricostruiti_dal_testo = ricostruisci_errori_da_testo_commentato(
-        testo_corrente_nella_textarea
-    )
-    st.session_state["punteggio_attuale"] = punteggio_dinamico
-    st.session_state["json_attuale_da_visualizzare"] = json.dumps(errori_ricostruiti_dal_testo, indent=2)
-    # Visualizzazione del punteggio e del JSON (dinamicamente aggiornati)
-    # L'header e il riepilogo verranno mostrati più in basso, dopo il calcolo dei punteggi per funzione
-
-    st.write(f"### ✏️ Total Point Deduction (dynamically updated): `{st.session_state.get('punteggio_attuale', 0)}`")
-
-    # --- INIZIO NUOVA SEZIONE PER PUNTEGGI DETTAGLIATI PER FUNZIONE ---
-    if st.session_state.get("codice_corretto_editabile") and \
-       st.session_state.get("criteri_modificati") and \
-       st.session_state.get("json_attuale_da_visualizzare"):
-        
-        codice_per_analisi = st.session_state.get("codice_corretto_editabile", "")
-        testo_criteri = st.session_state.get("criteri_modificati", "")
-        
-        try:
-            lista_errori_attuali_per_dettaglio = json.loads(st.session_state.get("json_attuale_da_visualizzare", "[]"))
-        except json.JSONDecodeError:
-            lista_errori_attuali_per_dettaglio = []
-            st.warning("Could not parse current error list for detailed score breakdown per function.")
-
-        if codice_per_analisi and testo_criteri: # Procedi solo se abbiamo il codice e i criteri
-            
-            defined_functions = find_c_function_definitions(codice_per_analisi)
-            call_map = build_call_map(codice_per_analisi, defined_functions)
-            
-            # Estrai punteggi base dal testo d'esame (se è un .txt e contiene definizioni)
-            exam_func_scores = {}
-            testo_esame_contenuto = st.session_state.get("testo_modificato", "")
-            # 'testo_esame' è l'oggetto UploadedFile, 'testo_modificato' è il suo contenuto stringa # noqa: E501
-            if "testo_esame" in st.session_state and \
-               st.session_state["testo_esame"] is not None and \
-               st.session_state["testo_esame"].name.endswith(".txt") and \
-               testo_esame_contenuto:
-                exam_func_scores = parse_criteria_function_scores(testo_esame_contenuto)
-            
-            # Estrai punteggi base dai criteri di correzione
-            criteria_scores_from_criteria_text = parse_criteria_function_scores(testo_criteri)
-
-            # Unisci i punteggi: i punteggi dei criteri sovrascrivono/integrano quelli dell'esame
-            all_function_base_scores = exam_func_scores.copy()
-            all_function_base_scores.update(criteria_scores_from_criteria_text)
-            main_function_names = list(all_function_base_scores.keys())
-
-            if not all_function_base_scores:
-                st.info("No functions with base scores found in criteria to analyze for detailed scores.")
-            else:
-                # --- INIZIO: Calcolo delle deduzioni per funzione ---
-                # 1. Inizializza le deduzioni solo per le funzioni principali (quelle con un punteggio base)
-                function_deductions = {name: 0.0 for name in main_function_names}
-                function_deduction_details = {name: [] for name in main_function_names}
-
-                # 2. Itera sugli errori e assegnali alle funzioni
-                for error_item in lista_errori_attuali_per_dettaglio:
-                    penalty = float(error_item.get("point_deduction", 0))
-                    criteria_text = error_item.get("criteria", "").lower()
-                    error_line = int(error_item.get("line", 0))
-                    assigned = False
-
-                    # Tentativo 1: Assegna in base al nome della funzione nel testo del criterio.
-                    # Questo funziona bene se l'LLM ha collegato un errore in una funzione di supporto
-                    # al criterio di una funzione principale.
-                    # Ordina per lunghezza decrescente per evitare che "func" corrisponda prima di "func_long".
-                    sorted_main_func_names = sorted(main_function_names, key=len, reverse=True)
-                    for func_name in sorted_main_func_names:
-                        # Cerca il nome della funzione come parola intera, case-insensitive
-                        if re.search(r'\b' + re.escape(func_name.lower()) + r'\b', criteria_text):
-                            function_deductions[func_name] += penalty
-                            function_deduction_details[func_name].append(f" - {abs(penalty):.1f}")
-                            assigned = True
-                            break
-                    
-                    if assigned:
-                        continue
-
-                    # Tentativo 2 (Fallback): Assegna in base alla posizione della riga dell'errore.
-                    containing_func_name = None
-                    for func in defined_functions:
-                        if func["start_line"] <= error_line <= func["end_line"]:
-                            containing_func_name = func['name']
-                            break
-                    
-                    if containing_func_name:
-                        target_func_name = None
-                        if containing_func_name in main_function_names:
-                            # L'errore è in una funzione principale.
-                            target_func_name = containing_func_name
-                        else:
-                            # L'errore è in una funzione ausiliaria, trova il suo chiamante principale.
-                            target_func_name = find_main_caller(containing_func_name, call_map, main_function_names)
-                        
-                        if target_func_name:
-                            function_deductions[target_func_name] += penalty
-                            function_deduction_details[target_func_name].append(f" - {abs(penalty):.1f}")
-
-                # --- INIZIO: Calcolo e costruzione del commento di riepilogo ---
-                summary_lines = []
-                total_final_score = 0.0
-                function_final_scores = {} # Memorizza i punteggi finali per riutilizzarli nella visualizzazione dettagliata
-
-                for func_name, base_score in all_function_base_scores.items():
-                    deductions_for_func_val = function_deductions.get(func_name, 0.0)
-                    # Assicura che il punteggio finale non sia negativo
-                    final_score = max(0, base_score + deductions_for_func_val)
-                    function_final_scores[func_name] = final_score
-                    total_final_score += final_score
-                    # Formatta la riga per il riepilogo, allineando il testo per leggibilità
-                    summary_lines.append(f"  {func_name:<20} ({base_score:<4.1f}) ...... {final_score:.1f}")
-
-                summary_lines.append(f"  {'TOTAL':<20} {'':<7} ...... {total_final_score:.1f}")
-                
-                summary_comment = "/*\n" + "\n".join(summary_lines) + "\n*/"
-                # --- FINE: Calcolo e costruzione del commento di riepilogo ---
-
-                # --- INIZIO: Visualizzazione dei risultati ---
-                st.header("Correction Results") # Header spostato qui
-                st.code(summary_comment, language='c')
-
-                st.markdown("---")
-                st.subheader("Detailed Function Score Breakdown:")
-
-                # 3. Mostra i risultati solo per le funzioni principali
-                for func_name, base_score in all_function_base_scores.items():
-                    # Recupera i valori già calcolati
-                    final_score = function_final_scores[func_name]
-                    calc_details = "".join(function_deduction_details[func_name])
-
-                    col_func_name, col_func_calc = st.columns([2,3])
-                    with col_func_name:
-                        st.markdown(f"`{func_name}({base_score:.1f})`:")
-                    with col_func_calc:
-                        st.markdown(f"`{final_score:.1f} = {base_score:.1f}{calc_details}`")
-                    st.markdown(f"&nbsp;&nbsp;&nbsp;&nbsp;Punteggio finale `{func_name}` = **{final_score:.1f}**")
-                    st.markdown("---") # Separatore per la prossima funzione
-    # --- FINE NUOVA SEZIONE ---
+# Pannello delle metriche delle chiamate LLM (token, latenza, costo)
+if registro_chiamate.chiamate:
+    st.divider()
+    mostra_metriche_chiamate(registro_chiamate)
 
-    st.write("### Current Error List (JSON - dynamically updated):")
-    try:
-        json_to_display = st.session_state.get("json_attuale_da_visualizzare", "[]")
-        # Non serve json.loads() qui perché st.json può gestire direttamente una stringa JSON formattata.
-        st.json(json_to_display)
-    except json.JSONDecodeError:
-        st.warning("Could not display current error list as JSON.")
-        st.code(st.session_state.get("json_attuale_da_visualizzare", ""))
+# Report dei tempi della pagina: il rerun corrente e gli ultimi della sessione
+tempi_rerun = st.session_state.setdefault("tempi_rerun", [])
+tempi_rerun.append(time.perf_counter() - inizio_rerun)
+del tempi_rerun[:-20]
+mostra_tempi_pagina(tempi_rerun)
 
-    
 # Aggiunge più spazio vuoto per spingere il bottone verso il basso
 for _ in range(10):
     st.write("")
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# I test importano il pacchetto grading dalla radice del repository, come la CLI e i benchmark
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,127 @@
+import json
+import threading
+import types
+
+from grading.blocchi import suddividi_in_blocchi, unisci_risposte_blocchi
+from grading.cache import CacheRisposteLLM
+from grading.llm import correggi_codice
+from grading.resilienza import PoliticaChiamate
+
+CODICE = """#include <stdio.h>
+int contatore = 0;
+
+int uno(void) {
+    return 1;
+}
+
+int due(void) {
+    return 2;
+}
+
+int tre(void) {
+    return 3;
+}
+"""
+
+
+def errore(riga, criterio):
+    return {"line": str(riga), "criteria": criterio, "point_deduction": -1, "inline_comment": f"//*** {criterio} -1"}
+
+
+def test_suddivisione_mantiene_i_numeri_di_riga():
+    blocchi = suddividi_in_blocchi(CODICE, 0)
+    assert [blocco["intervalli"] for blocco in blocchi] == [[(4, 6)], [(8, 10)], [(12, 14)]]
+    assert blocchi[0].get("globale") and not blocchi[1].get("globale")
+    for blocco in blocchi:
+        assert len(blocco["codice"].split("\n")) == len(CODICE.split("\n"))
+    assert "return 2;" not in blocchi[0]["codice"] and "function 'due' omitted" in blocchi[0]["codice"]
+
+
+def test_unione_tiene_le_annotazioni_di_ogni_blocco_e_il_globale_una_volta():
+    blocchi = suddividi_in_blocchi(CODICE, 0)
+    risposte = [
+        json.dumps([errore(2, "global variable"), errore(5, "uno"), errore(9, "due, fuori dal blocco")]),
+        "```json\n" + json.dumps([errore(2, "global variable"), errore(9, "due")]) + "\n```",
+        json.dumps([{"line": None, "criteria": "senza riga"}, errore(13, "tre")]),
+    ]
+    unite = json.loads(unisci_risposte_blocchi(blocchi, risposte))
+    assert [(annotazione["line"], annotazione["criteria"]) for annotazione in unite] == [
+        ("2", "global variable"), ("5", "uno"), ("9", "due"), ("13", "tre"),
+    ]
+
+
+def test_unione_restituisce_la_risposta_non_valida():
+    blocchi = suddividi_in_blocchi(CODICE, 0)
+    risposte = [json.dumps([errore(5, "uno")]), "Non riesco a correggere questo codice.", json.dumps([])]
+    assert unisci_risposte_blocchi(blocchi, risposte) == risposte[1]
+
+
+class ClientFinto:
+    """Client che tronca la risposta (finish_reason "length") se il codice contiene più di max_funzioni funzioni."""
+
+    def __init__(self, max_funzioni):
+        self.max_funzioni = max_funzioni
+        self.chiamate = 0
+        self.contemporanee = self.massimo_contemporanee = 0
+        self._lock = threading.Lock()
+        self.chat = types.SimpleNamespace(completions=types.SimpleNamespace(create=self.create))
+
+    def create(self, model, messages, **kwargs):
+        with self._lock:
+            self.chiamate += 1
+            self.contemporanee += 1
+            self.massimo_contemporanee = max(self.massimo_contemporanee, self.contemporanee)
+        try:
+            testo = json.dumps(messages)
+            funzioni = {"uno": (5, "return 1;"), "due": (9, "return 2;"), "tre": (13, "return 3;")}
+            presenti = [nome for nome, (_, istruzione) in funzioni.items() if istruzione in testo]
+            errori = [errore(funzioni[nome][0], nome) for nome in presenti]
+            troncata = len(presenti) > self.max_funzioni
+            contenuto = json.dumps(errori)[:-20] if troncata else json.dumps(errori)
+            messaggio = types.SimpleNamespace(content=contenuto)
+            scelta = types.SimpleNamespace(message=messaggio, finish_reason="length" if troncata else "stop")
+            uso = types.SimpleNamespace(prompt_tokens=100, completion_tokens=10, prompt_tokens_details=None)
+            return types.SimpleNamespace(choices=[scelta], usage=uso)
+        finally:
+            with self._lock:
+                self.contemporanee -= 1
+
+
+def test_risposta_troncata_ricorretta_a_blocchi_con_uso_sommato():
+    client = ClientFinto(max_funzioni=1)
+    info_uso = {}
+    risposta, errore_correzione = correggi_codice(CODICE, "f: 5", None, "m/finto", client, info_uso=info_uso,
+                                                  politica=PoliticaChiamate(max_blocchi_paralleli=2))
+    assert errore_correzione is None
+    assert [annotazione["line"] for annotazione in json.loads(risposta)] == ["5", "9", "13"]
+    # La chiamata troncata sul file intero costa come le tre dei blocchi
+    assert client.chiamate == 4
+    assert info_uso["prompt_tokens"] == 400
+    assert client.massimo_contemporanee <= 2
+
+
+def test_blocco_troncato_ricorretto_una_funzione_per_blocco():
+    client = ClientFinto(max_funzioni=1)
+    risposta, errore_correzione = correggi_codice(CODICE, "f: 5", None, "m/finto", client, max_caratteri_blocco=60)
+    assert errore_correzione is None
+    assert [annotazione["line"] for annotazione in json.loads(risposta)] == ["5", "9", "13"]
+
+
+def test_funzione_troncata_da_sola_segnalata_come_errore():
+    client = ClientFinto(max_funzioni=0)
+    risposta, errore_correzione = correggi_codice(CODICE, "f: 5", None, "m/finto", client)
+    assert risposta is None
+    assert "lines 4-6, 8-10, 12-14" in errore_correzione and "cut off" in errore_correzione
+
+
+def test_risposta_troncata_non_suddivisibile_segnalata_come_errore(tmp_path):
+    client = ClientFinto(max_funzioni=0)
+    cache = CacheRisposteLLM(str(tmp_path / "cache.db"))
+    info_uso = {}
+    codice = "int uno(void) {\n    return 1;\n}\n"
+    risposta, errore_correzione = correggi_codice(codice, "f: 5", None, "m/finto", client, cache=cache,
+                                                  info_uso=info_uso)
+    assert risposta is None
+    assert "cut off" in errore_correzione and "cannot be split" in errore_correzione
+    assert info_uso["prompt_tokens"] == 100
+    assert cache.statistiche()["voci"] == 0
@@ -0,0 +1,62 @@
+from grading.c_analysis import find_c_function_definitions
+
+CODICE = """#include <stdio.h>
+#define MAX(a, b) { (a) > (b) ? (a) : (b) }
+
+struct punto { int x; int y; };
+
+/* int finta(void) { return 0; } */
+static int somma(int *v,
+                 int n)
+{
+    const char *s = "}{";
+    char c = '}';
+    int totale = 0; // }
+    for (int i = 0; i < n; i++) {
+        totale += v[i];
+    }
+    return totale;
+}
+
+int vecchio_stile(a, b)
+int a;
+char *b;
+{
+    return a;
+}
+
+int prototipo(int x);
+
+int main(void) {
+    int v[] = {1, 2};
+    return somma(v, 2);
+}
+"""
+
+
+def _per_nome(codice):
+    return {funzione["name"]: funzione for funzione in find_c_function_definitions.__wrapped__(codice)}
+
+
+def test_funzioni_trovate_con_righe():
+    funzioni = _per_nome(CODICE)
+    assert list(funzioni) == ["somma", "vecchio_stile", "main"]
+    assert (funzioni["somma"]["start_line"], funzioni["somma"]["body_start_line"], funzioni["somma"]["end_line"]) == (7, 9, 17)
+    assert (funzioni["main"]["start_line"], funzioni["main"]["end_line"]) == (28, 31)
+
+
+def test_firma_k_and_r():
+    funzione = _per_nome(CODICE)["vecchio_stile"]
+    assert (funzione["start_line"], funzione["body_start_line"], funzione["end_line"]) == (19, 22, 24)
+
+
+def test_offset_del_corpo():
+    funzione = _per_nome(CODICE)["somma"]
+    corpo = CODICE[funzione["body_start"]:funzione["body_end"]]
+    assert corpo.startswith("{") and corpo.endswith("}")
+    assert "return totale;" in corpo
+
+
+def test_codice_vuoto_e_solo_prototipi():
+    assert find_c_function_definitions.__wrapped__("") == []
+    assert find_c_function_definitions.__wrapped__("int f(int x);\nstruct s { int a; };\n") == []
@@ -0,0 +1,185 @@
+import json
+import time
+
+import pytest
+
+import grading.coda as modulo_coda
+from grading.coda import COMPLETATO, ERRORE, IN_ATTESA, IN_CORSO, CodaCorrezioni, LavoratoreCoda
+from grading.deduplica import raggruppa_duplicati
+from grading.metrics import RegistroChiamate
+
+CODICE = """int somma(int *v, int n) {
+    int s = 0;
+    for (int i = 0; i < n; i++)
+        s += v[i];
+    return s;
+}
+"""
+# Equivalente a CODICE (stessa impronta) con una riga in più in testa
+CODICE_EQUIVALENTE = "// copia\n" + CODICE.replace("v[i]", "v[ i ]")
+ALTRO_CODICE = "int main(void) { return 1; }\n"
+
+RISPOSTA = json.dumps([{"line": "3", "criteria": "loop", "point_deduction": -1, "inline_comment": "//*** loop -1"}])
+
+
+def crea_coda(tmp_path, codici, gruppi=None):
+    coda = CodaCorrezioni(str(tmp_path / "coda.sqlite3"))
+    rubrica = coda.accoda(codici, "somma: 5", None, "m/finto", gruppi=gruppi)
+    return coda, rubrica
+
+
+def test_prendi_e_completa(tmp_path):
+    coda, rubrica = crea_coda(tmp_path, {"anna": CODICE, "bruno": ALTRO_CODICE})
+    primo, secondo = coda.prendi(), coda.prendi()
+    assert [primo["studente"], secondo["studente"]] == ["anna", "bruno"]
+    assert primo["criteri"] == "somma: 5" and primo["tentativi"] == 0
+    assert coda.prendi() is None
+
+    coda.completa(primo["id"], RISPOSTA, {"prompt_tokens": 10})
+    coda.fallisci(secondo["id"], "Error: boom")
+    lavori = coda.lavori("m/finto", rubrica)
+    assert lavori["anna"]["stato"] == COMPLETATO
+    assert lavori["anna"]["errori"][0]["criteria"] == "loop"
+    assert lavori["anna"]["uso"] == {"prompt_tokens": 10}
+    assert (lavori["bruno"]["stato"], lavori["bruno"]["messaggio_errore"]) == (ERRORE, "Error: boom")
+
+
+def test_risposta_del_rappresentante_riportata_sugli_equivalenti(tmp_path):
+    codici = {"anna": CODICE, "bruno": CODICE_EQUIVALENTE}
+    coda, rubrica = crea_coda(tmp_path, codici, raggruppa_duplicati(codici))
+    lavoro = coda.prendi()
+    assert lavoro["studente"] == "anna"
+    assert coda.prendi() is None  # L'equivalente non viene mai assegnato
+    coda.completa(lavoro["id"], RISPOSTA)
+    duplicato = coda.lavori("m/finto", rubrica)["bruno"]
+    assert duplicato["stato"] == COMPLETATO and duplicato["rappresentante"] == "anna"
+    assert duplicato["errori"][0]["line"] == "4"  # Righe riportate sul codice dell'equivalente
+    assert duplicato["uso"] == {}
+
+
+def test_lavoro_riaccodato_dopo_completamento_non_ripetuto(tmp_path):
+    coda, rubrica = crea_coda(tmp_path, {"anna": CODICE})
+    coda.completa(coda.prendi()["id"], RISPOSTA)
+    coda.accoda({"anna": CODICE}, "somma: 5", None, "m/finto")
+    assert coda.prendi() is None
+    coda.accoda({"anna": CODICE}, "somma: 5", None, "m/finto", forza=True)
+    assert coda.prendi()["studente"] == "anna"
+
+
+def test_lavoro_scaduto_ripreso_e_poi_segnato_in_errore(tmp_path, monkeypatch):
+    coda, rubrica = crea_coda(tmp_path, {"anna": CODICE})
+    adesso = time.time()
+    monkeypatch.setattr(modulo_coda.time, "time", lambda: adesso)
+    assert coda.prendi()["tentativi"] == 0
+    assert coda.prendi() is None  # In corso e non ancora scaduto
+
+    for tentativo in range(1, modulo_coda.MAX_TENTATIVI_LAVORO):
+        adesso += modulo_coda.SCADENZA_LAVORO_SECONDI + 1
+        assert coda.prendi()["tentativi"] == tentativo
+    adesso += modulo_coda.SCADENZA_LAVORO_SECONDI + 1
+    assert coda.prendi() is None
+    lavoro = coda.lavori("m/finto", rubrica)["anna"]
+    assert lavoro["stato"] == ERRORE and "interrupted" in lavoro["messaggio_errore"]
+
+
+def test_lavoro_rinnovato_non_scade(tmp_path, monkeypatch):
+    coda, rubrica = crea_coda(tmp_path, {"anna": CODICE})
+    adesso = time.time()
+    monkeypatch.setattr(modulo_coda.time, "time", lambda: adesso)
+    lavoro = coda.prendi()
+    # Correzione più lunga della scadenza, con il lavoratore che la rinnova
+    for _ in range(3):
+        adesso += modulo_coda.SCADENZA_LAVORO_SECONDI * 0.6
+        coda.rinnova([lavoro["id"]])
+        assert coda.prendi() is None
+    assert coda.lavori("m/finto", rubrica)["anna"]["stato"] == IN_CORSO
+
+
+def test_lavoratore_rinnova_i_lavori_in_esecuzione(tmp_path, monkeypatch):
+    monkeypatch.setattr(modulo_coda, "INTERVALLO_RINNOVO_SECONDI", 0.05)
+    coda, rubrica = crea_coda(tmp_path, {"anna": CODICE})
+    rinnovati = []
+    rinnova = coda.rinnova
+    monkeypatch.setattr(coda, "rinnova", lambda id_lavori: (rinnovati.extend(id_lavori), rinnova(id_lavori)))
+
+    def correggi_lento(*args, **kwargs):
+        time.sleep(0.5)
+        return RISPOSTA, None
+    monkeypatch.setattr(modulo_coda, "correggi_codice", correggi_lento)
+    lavoratore = LavoratoreCoda(coda, client=object(), intervallo_attesa=0.02).avvia()
+    try:
+        lavoratore.notifica()
+        scadenza = time.time() + 5
+        while coda.lavori("m/finto", rubrica)["anna"]["stato"] != COMPLETATO and time.time() < scadenza:
+            time.sleep(0.02)
+    finally:
+        lavoratore.ferma()
+    assert coda.lavori("m/finto", rubrica)["anna"]["stato"] == COMPLETATO
+    assert rinnovati and set(rinnovati) == {1}
+
+
+# L'eccezione che ferma il thread viene anche stampata (threading.excepthook): qui è attesa
+@pytest.mark.filterwarnings("ignore::pytest.PytestUnhandledThreadExceptionWarning")
+def test_lavoratore_fermato_da_un_errore_non_risulta_attivo(tmp_path):
+    coda, _ = crea_coda(tmp_path, {"anna": CODICE})
+
+    def prendi_rotto():
+        raise RuntimeError("database is locked")
+    coda.prendi = prendi_rotto
+    lavoratore = LavoratoreCoda(coda, client=object(), intervallo_attesa=0.01)
+    assert not lavoratore.attivo
+    lavoratore.avvia()
+    lavoratore._thread.join(timeout=5)
+    assert not lavoratore.attivo
+    assert str(lavoratore.errore) == "database is locked"
+    assert coda.conteggi() == {IN_ATTESA: 1}
+
+
+def test_rilascia_interrotti_solo_lavori_scaduti(tmp_path, monkeypatch):
+    coda, rubrica = crea_coda(tmp_path, {"anna": CODICE, "bruno": ALTRO_CODICE})
+    adesso = time.time()
+    monkeypatch.setattr(modulo_coda.time, "time", lambda: adesso)
+    coda.prendi()
+    bruno = coda.prendi()
+    adesso += modulo_coda.SCADENZA_LAVORO_SECONDI + 1
+    coda.rinnova([bruno["id"]])  # Ancora in esecuzione, ad esempio in un altro processo sullo stesso database
+    coda.rilascia_interrotti()
+    lavori = coda.lavori("m/finto", rubrica)
+    assert (lavori["anna"]["stato"], lavori["bruno"]["stato"]) == (IN_ATTESA, IN_CORSO)
+
+
+def test_forza_non_riaccoda_un_lavoro_in_corso(tmp_path):
+    coda, rubrica = crea_coda(tmp_path, {"anna": CODICE})
+    lavoro = coda.prendi()
+    coda.accoda({"anna": CODICE}, "somma: 5", None, "m/finto", forza=True)
+    assert coda.prendi() is None
+    coda.completa(lavoro["id"], RISPOSTA)
+    assert coda.lavori("m/finto", rubrica)["anna"]["stato"] == COMPLETATO
+
+
+def test_contesto_di_ogni_accodamento_usato_e_poi_rimosso(tmp_path, monkeypatch):
+    coda = CodaCorrezioni(str(tmp_path / "coda.sqlite3"))
+    registri = {}
+
+    def correggi_finto(codice, *args, registro=None, studente=None, **kwargs):
+        registri[studente] = registro
+        return RISPOSTA, None
+    monkeypatch.setattr(modulo_coda, "correggi_codice", correggi_finto)
+    lavoratore = LavoratoreCoda(coda, client=object(), intervallo_attesa=0.02)
+    registro_anna, registro_bruno = RegistroChiamate(), RegistroChiamate()
+    # Due sessioni con lo stesso modello e la stessa rubrica
+    lavoratore.accoda({"anna": CODICE}, "somma: 5", None, "m/finto", registro=registro_anna)
+    lavoratore.accoda({"bruno": ALTRO_CODICE}, "somma: 5", None, "m/finto", registro=registro_bruno)
+    assert len(lavoratore._contesti) == 2
+    lavoratore.avvia().notifica()
+    try:
+        scadenza = time.time() + 5
+        while coda.conteggi().get(COMPLETATO) != 2 and time.time() < scadenza:
+            time.sleep(0.02)
+    finally:
+        lavoratore.ferma()
+    assert registri["anna"] is registro_anna and registri["bruno"] is registro_bruno
+    assert lavoratore._contesti == {}
+    # Nessun lavoro da eseguire: il contesto non resta registrato
+    lavoratore.accoda({"anna": CODICE}, "somma: 5", None, "m/finto", registro=registro_anna)
+    assert lavoratore._contesti == {}
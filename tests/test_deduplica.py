@@ -0,0 +1,61 @@
+import io
+import json
+import zipfile
+
+from grading.archivio import ArchivioConsegne
+from grading.deduplica import impronta_codice, raggruppa_duplicati, riporta_correzioni
+
+ORIGINE = """int somma(int *v, int n) {
+    int s = 0;
+    for (int i = 0; i < n; i++)
+        s += v[i];
+    return s;
+}
+"""
+
+# Stesso programma con altri nomi di variabili, commenti e righe vuote
+DESTINAZIONE = """// Consegna di Luca
+int somma(int *dati, int quanti)
+{
+    int totale = 0;
+
+    for (int k = 0; k < quanti; k++)
+        totale += dati[k]; /* accumula */
+    return totale;
+}
+"""
+
+
+def test_consegne_equivalenti_hanno_la_stessa_impronta():
+    assert impronta_codice(ORIGINE) == impronta_codice(DESTINAZIONE)
+    assert impronta_codice(ORIGINE) != impronta_codice(ORIGINE.replace("i < n", "i <= n"))
+
+
+def test_riporta_correzioni_sulle_righe_corrispondenti():
+    risposta = "```json\n" + json.dumps([
+        {"line": "3", "criteria": "loop", "point_deduction": -1, "inline_comment": "//*** loop -1"},
+        {"line": "5", "criteria": "return", "point_deduction": -0.5, "inline_comment": "//*** return -0.5"},
+    ]) + "\n```"
+    riportate = json.loads(riporta_correzioni(risposta, ORIGINE, DESTINAZIONE))
+    assert [annotazione["line"] for annotazione in riportate] == ["6", "8"]
+    assert riportate[0]["criteria"] == "loop"
+
+
+def test_riporta_correzioni_lascia_invariate_le_risposte_non_valide():
+    assert riporta_correzioni("Sorry, I cannot grade this.", ORIGINE, DESTINAZIONE) == "Sorry, I cannot grade this."
+    assert riporta_correzioni(None, ORIGINE, DESTINAZIONE) is None
+
+
+def test_raggruppa_duplicati_da_archivio_in_streaming():
+    dati = io.BytesIO()
+    with zipfile.ZipFile(dati, "w") as archivio_zip:
+        archivio_zip.writestr("Anna/es.c", ORIGINE)
+        archivio_zip.writestr("Luca/es.c", DESTINAZIONE)
+        archivio_zip.writestr("Mario/es.c", ORIGINE.replace("i < n", "i <= n"))
+    archivio = ArchivioConsegne(dati)
+    gruppi = raggruppa_duplicati(archivio.itera_codici())
+    assert gruppi.gruppi_con_duplicati() == [["Anna", "Luca"]]
+    assert gruppi.rappresentante("Luca") == "Anna"
+    assert gruppi.chiamate_risparmiate == 1
+    # Il passaggio in streaming non riempie la cache dei codici dell'archivio
+    assert archivio.byte_residenti == 0
@@ -0,0 +1,117 @@
+import io
+import os
+import time
+import zipfile
+
+import pytest
+
+import grading.deposito as modulo_deposito
+from grading.archivio import ArchivioConsegne
+from grading.deduplica import raggruppa_duplicati
+from grading.deposito import DepositoContenuti
+
+
+def crea_zip(consegne):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w") as archivio:
+        for nome, codice in consegne.items():
+            archivio.writestr(f"{nome}/main.c", codice)
+    buffer.seek(0)
+    return buffer
+
+
+def test_evizione_lru_oltre_la_dimensione_massima(tmp_path):
+    deposito = DepositoContenuti(str(tmp_path), max_byte=250)
+    primo = deposito.aggiungi(b"a" * 100)
+    secondo = deposito.aggiungi(b"b" * 100)
+    deposito.vista(primo)  # Il primo è ora il più recente
+    terzo = deposito.aggiungi(b"c" * 100)
+    assert deposito.contiene(primo) and deposito.contiene(terzo)
+    assert not deposito.contiene(secondo)
+    assert deposito.statistiche()["byte_su_disco"] == 200
+
+
+def test_contenuti_scaduti_rimossi(tmp_path):
+    vecchio = DepositoContenuti(str(tmp_path)).aggiungi(b"vecchio")
+    percorso = os.path.join(str(tmp_path), vecchio[:2], vecchio)
+    due_settimane_fa = time.time() - 14 * 24 * 3600
+    os.utime(percorso, (due_settimane_fa, due_settimane_fa))
+    # Un nuovo processo ricostruisce l'indice dal disco, con l'età dei file
+    deposito = DepositoContenuti(str(tmp_path), max_eta_secondi=7 * 24 * 3600)
+    nuovo = deposito.aggiungi(b"nuovo")
+    assert deposito.contiene(nuovo) and not deposito.contiene(vecchio)
+
+
+def test_archivio_trattenuto_non_rimosso_per_fare_spazio(tmp_path):
+    deposito = DepositoContenuti(str(tmp_path), max_byte=1)
+    archivio = ArchivioConsegne(crea_zip({"anna": "int main(void) { return 0; }\n"}), deposito=deposito)
+    assert archivio.codice("anna").startswith("int main")
+    deposito.aggiungi(b"altro contenuto")
+    assert deposito.contiene(archivio.impronta)
+    assert archivio.codice("anna").startswith("int main")
+
+
+def test_chiudi_rimuove_archivio_e_consegne_non_condivise(tmp_path):
+    deposito = DepositoContenuti(str(tmp_path))
+    comune = "int main(void) { return 0; }\n"
+    primo = ArchivioConsegne(crea_zip({"anna": comune, "bruno": "int x;\n"}), deposito=deposito)
+    secondo = ArchivioConsegne(crea_zip({"carla": comune}), deposito=deposito)
+    impronte = {nome: primo.impronta_consegna(nome) for nome in primo}
+    assert secondo.impronta_consegna("carla") == impronte["anna"]
+
+    primo.chiudi()
+    assert not deposito.contiene(primo.impronta)
+    assert not deposito.contiene(impronte["bruno"])
+    # La consegna identica resta: appartiene anche all'archivio ancora in uso
+    assert deposito.contiene(impronte["anna"])
+    assert secondo.codice("carla") == comune
+
+    secondo.chiudi()
+    assert deposito.statistiche()["contenuti"] == 0
+
+
+def test_archivio_in_uso_da_due_sessioni_rimosso_all_ultimo_rilascio(tmp_path):
+    deposito = DepositoContenuti(str(tmp_path))
+    prima_sessione = ArchivioConsegne(crea_zip({"anna": "int a;\n"}), deposito=deposito)
+    seconda_sessione = ArchivioConsegne(crea_zip({"anna": "int a;\n"}), deposito=deposito)
+    prima_sessione.chiudi()
+    assert seconda_sessione.codice("anna") == "int a;\n"
+    seconda_sessione.chiudi()
+    assert not deposito.contiene(seconda_sessione.impronta)
+
+
+def test_file_aperti_limitati_e_riaperti_quando_servono(tmp_path, monkeypatch):
+    monkeypatch.setattr(modulo_deposito, "MAX_MAPPE_APERTE", 2)
+    monkeypatch.setattr(modulo_deposito, "MAX_ZIP_APERTI", 1)
+    deposito = DepositoContenuti(str(tmp_path))
+    impronte = [deposito.aggiungi(bytes([indice]) * 10) for indice in range(4)]
+    vista_in_uso = deposito.vista(impronte[0])
+    for impronta in impronte[1:]:
+        deposito.vista(impronta)
+    assert deposito.statistiche()["contenuti_mappati"] == 2
+    # La vista presa prima della chiusura della sua mappa resta leggibile
+    assert bytes(vista_in_uso) == b"\x00" * 10
+
+    archivi = [ArchivioConsegne(crea_zip({nome: f"int {nome};\n"}), deposito=deposito) for nome in ("anna", "bruno")]
+    assert deposito.statistiche()["archivi"] == 1
+    assert dict(archivi[0].itera_codici()) == {"anna": "int anna;\n"}
+    assert archivi[1].codice("bruno") == "int bruno;\n"
+    assert deposito.statistiche()["archivi"] == 1
+
+
+def test_file_non_zip_non_resta_nel_deposito(tmp_path):
+    deposito = DepositoContenuti(str(tmp_path))
+    with pytest.raises(zipfile.BadZipFile):
+        ArchivioConsegne(io.BytesIO(b"non sono uno zip"), deposito=deposito)
+    assert deposito.statistiche()["contenuti"] == 0
+
+
+@pytest.mark.parametrize("con_deposito", [False, True])
+def test_sorgente_non_utf8_decodificato_senza_errori(tmp_path, con_deposito):
+    deposito = DepositoContenuti(str(tmp_path)) if con_deposito else None
+    commento = "// è già così\nint main(void) { return 0; }\n"
+    archivio = ArchivioConsegne(crea_zip({"anna": commento.encode("cp1252"), "bruno": commento}), deposito=deposito)
+    assert archivio.codice("anna") == commento
+    codici = dict(archivio.itera_codici())
+    assert codici == {"anna": commento, "bruno": commento}
+    assert raggruppa_duplicati(archivio.itera_codici()).rappresentante("bruno") == "anna"
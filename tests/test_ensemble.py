@@ -0,0 +1,121 @@
+import json
+import threading
+import time
+import types
+
+import grading.ensemble as modulo_ensemble
+from grading.ensemble import correggi_codice_ensemble, esito_deciso, raggruppa_errori, unisci_errori_votati
+from grading.metrics import RegistroChiamate
+from grading.resilienza import PoliticaChiamate
+
+CODICE = "\n".join(f"int x{indice};" for indice in range(10))
+
+
+def errore(riga, criterio, punti):
+    return {"line": str(riga), "criteria": criterio, "point_deduction": punti,
+            "inline_comment": f"//******** {criterio} {punti:g}"}
+
+
+def test_raggruppa_e_tiene_gli_errori_con_abbastanza_voti():
+    gruppi = raggruppa_errori({
+        "a": [errore(3, "Loop bound is off by one", -1), errore(5, "Missing check on input", -0.5)],
+        "b": [errore(3, "loop bound off by one!", -2), errore(7, "Something else", -1)],
+        "c": [errore(3, "Loop bound off by one", -1.5)],
+    })
+    assert sorted((gruppo["riga"], len(gruppo["voti"])) for gruppo in gruppi) == [(3, 3), (5, 1), (7, 1)]
+    uniti = unisci_errori_votati(gruppi, soglia_voti=2)
+    # Del gruppo si tiene l'annotazione con la deduzione mediana, così com'è stata scritta dal modello
+    assert uniti == [errore(3, "Loop bound off by one", -1.5)]
+    assert [e["line"] for e in unisci_errori_votati(gruppi, soglia_voti=1)] == ["3", "5", "7"]
+
+
+def test_deduzione_del_commento_prevale_per_la_mediana():
+    gruppi = raggruppa_errori({
+        "a": [dict(errore(3, "loop", -1), point_deduction=-3)],
+        "b": [errore(3, "loop", -2)],
+    })
+    assert unisci_errori_votati(gruppi, soglia_voti=2)[0]["inline_comment"] == "//******** loop -1"
+
+
+def test_esito_deciso():
+    def gruppo(voti):
+        return {"riga": 1, "criterio": "x", "voti": dict.fromkeys(range(voti))}
+    # Soglia 2 con una risposta mancante: un errore nuovo potrebbe ancora arrivare a un voto solo
+    assert esito_deciso([gruppo(2)], risposte_mancanti=1, soglia_voti=2)
+    assert not esito_deciso([gruppo(1)], risposte_mancanti=1, soglia_voti=2)
+    assert esito_deciso([gruppo(2), gruppo(0)], risposte_mancanti=1, soglia_voti=2)
+    # Con tante risposte mancanti quante la soglia anche un errore mai visto potrebbe essere tenuto
+    assert not esito_deciso([], risposte_mancanti=2, soglia_voti=2)
+
+
+class ClientFinto:
+    """Client con una risposta fissa per modello; i modelli in attesa rispondono solo dopo il rilascio."""
+
+    def __init__(self, risposte, in_attesa=()):
+        self.risposte = risposte
+        self.in_attesa = set(in_attesa)
+        self.rilascio = threading.Event()
+        self.chat = types.SimpleNamespace(completions=types.SimpleNamespace(create=self.create))
+
+    def create(self, model, messages, **kwargs):
+        if model in self.in_attesa:
+            self.rilascio.wait(5)
+        contenuto = self.risposte[model]
+        if not isinstance(contenuto, str):
+            contenuto = json.dumps(contenuto)
+        uso = types.SimpleNamespace(prompt_tokens=100, completion_tokens=10, prompt_tokens_details=None)
+        scelta = types.SimpleNamespace(message=types.SimpleNamespace(content=contenuto), finish_reason="stop")
+        return types.SimpleNamespace(choices=[scelta], usage=uso)
+
+
+def test_risposta_testuale_conta_come_modello_in_errore():
+    client = ClientFinto({
+        "a/uno": [errore(3, "loop", -1)],
+        "b/due": [errore(3, "loop", -1)],
+        "c/tre": "I could not find any error in this code.",
+    })
+    info = {}
+    risposta, errore_ensemble = correggi_codice_ensemble(
+        CODICE, "f: 5", None, ["a/uno", "b/due", "c/tre"], client, politica=PoliticaChiamate(), info_ensemble=info
+    )
+    assert errore_ensemble is None
+    assert json.loads(risposta) == [errore(3, "loop", -1)]
+    assert list(info["errori_modelli"]) == ["c/tre"]
+
+
+def test_json_non_analizzabile_conta_come_modello_in_errore(monkeypatch):
+    monkeypatch.setattr(modulo_ensemble, "estrai_json_da_risposta", lambda contenuto: ("[{'rotto'", None))
+    client = ClientFinto({"a/uno": [], "b/due": []})
+    info = {}
+    risposta, errore_ensemble = correggi_codice_ensemble(
+        CODICE, "f: 5", None, ["a/uno", "b/due"], client, info_ensemble=info
+    )
+    # Dopo il primo modello in errore i due voti non sono più raggiungibili: l'altro non viene atteso
+    assert risposta is None and "ensemble models failed" in errore_ensemble
+    assert info["errori_modelli"]
+    assert all(messaggio.startswith("Error parsing LLM JSON response") for messaggio in info["errori_modelli"].values())
+
+
+def test_uso_delle_chiamate_non_attese_aggiunto_quando_terminano():
+    client = ClientFinto({
+        "a/uno": [errore(3, "loop", -1)],
+        "b/due": [errore(3, "loop", -1)],
+        "c/lento": [],
+    }, in_attesa=["c/lento"])
+    info_uso, info = {}, {}
+    registro = RegistroChiamate()
+    risposta, errore_ensemble = correggi_codice_ensemble(
+        CODICE, "f: 5", None, ["a/uno", "b/due", "c/lento"], client, info_uso=info_uso, registro=registro,
+        info_ensemble=info
+    )
+    assert errore_ensemble is None and info["non_attesi"] == ["c/lento"]
+    assert info_uso["prompt_tokens"] == 200
+    assert len(registro.chiamate) == 2
+
+    client.rilascio.set()
+    for _ in range(500):
+        if info_uso["prompt_tokens"] == 300:
+            break
+        time.sleep(0.01)
+    assert info_uso["prompt_tokens"] == 300
+    assert sorted(record["modello"] for record in registro.chiamate) == ["a/uno", "b/due", "c/lento"]
@@ -0,0 +1,12 @@
+from grading.metrics import RegistroChiamate
+
+
+def test_correzioni_per_usd_conta_solo_le_chiamate_riuscite():
+    registro = RegistroChiamate()
+    registro.registra("openai/gpt-4o", "a", latenza=1.0, prompt_tokens=1000, completion_tokens=100)
+    registro.registra("openai/gpt-4o", "b", latenza=1.0, errore="timeout")
+    registro.registra("openai/gpt-4o", "c", latenza=0.0, da_cache=True)
+    totali = registro.sessione()
+    assert totali["chiamate"] == 2
+    assert totali["errori"] == 1
+    assert totali["correzioni_per_usd"] == 1 / totali["costo"]
@@ -0,0 +1,57 @@
+import json
+
+from grading.parsing import estrai_json_da_risposta, ripara_json
+
+# Senza memoizzazione: ogni caso viene analizzato davvero, anche se un altro test ha già visto lo stesso testo
+ripara = ripara_json.__wrapped__
+
+ERRORE = {"line": "3", "criteria": "loop", "point_deduction": -1, "inline_comment": "//*** loop -1"}
+
+
+def test_array_valido_restituito_senza_modifiche():
+    testo = json.dumps([ERRORE])
+    assert ripara(testo) == (testo, "valida")
+
+
+def test_oggetto_errors_riportato_all_array():
+    stringa_json, tipo = ripara(json.dumps({"errors": [ERRORE]}))
+    assert tipo == "valida"
+    assert json.loads(stringa_json) == [ERRORE]
+
+
+def test_sintassi_quasi_valida():
+    testo = "[{'line': '3', 'criteria': 'loop', 'point_deduction': -1, 'ok': True, 'note': None,},]"
+    stringa_json, tipo = ripara(testo)
+    assert tipo == "sintassi"
+    assert json.loads(stringa_json) == [{"line": "3", "criteria": "loop", "point_deduction": -1, "ok": True, "note": None}]
+
+
+def test_apostrofi_nel_testo_prima_del_json_non_alterano_le_stringhe():
+    testo = "Here's the result: " + json.dumps([{"line": "3", "criteria": "don't use magic numbers"}])
+    stringa_json, tipo = ripara(testo)
+    assert tipo == "testo_extra"
+    assert json.loads(stringa_json)[0]["criteria"] == "don't use magic numbers"
+
+
+def test_testo_dopo_l_array():
+    stringa_json, tipo = ripara(json.dumps([ERRORE]) + "\nI hope this helps!")
+    assert tipo == "testo_extra"
+    assert json.loads(stringa_json) == [ERRORE]
+
+
+def test_risposta_troncata_tiene_gli_oggetti_completi():
+    completo = json.dumps([ERRORE, dict(ERRORE, line="7")])
+    stringa_json, tipo = ripara(completo[:-25])
+    assert tipo == "troncata"
+    assert json.loads(stringa_json) == [ERRORE]
+
+
+def test_testo_senza_json_non_riparabile():
+    assert ripara("I could not find any error in this code.") == (None, None)
+    assert ripara('{"message": "no errors"}') == (None, None)
+
+
+def test_estrazione_dal_blocco_markdown():
+    stringa_json, errore = estrai_json_da_risposta("\ufeff```json\n" + json.dumps([ERRORE]) + "\n```")
+    assert errore is None
+    assert json.loads(stringa_json) == [ERRORE]
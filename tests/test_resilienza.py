@@ -0,0 +1,71 @@
+import json
+import threading
+import time
+import types
+
+from grading.llm import correggi_codice
+from grading.metrics import RegistroChiamate
+from grading.resilienza import CAMPIONI_MINIMI_HEDGING, PoliticaChiamate, esegui_con_hedging
+
+
+def test_risultato_della_copia_scartata_passato_al_termine():
+    rilascio = threading.Event()
+    chiamate = []
+
+    def esegui():
+        chiamate.append(None)
+        if len(chiamate) == 1:
+            rilascio.wait(5)
+            return "lenta"
+        return "riserva"
+
+    scartate = []
+    risultato, da_riserva = esegui_con_hedging(esegui, 0.01, al_termine_scartata=scartate.append)
+    assert (risultato, da_riserva) == ("riserva", True)
+    assert scartate == []
+    rilascio.set()
+    for _ in range(500):
+        if scartate:
+            break
+        time.sleep(0.01)
+    assert scartate == ["lenta"]
+
+
+class ClientLento:
+    """Client la cui prima richiesta risponde solo dopo il rilascio: la copia di riserva arriva prima."""
+
+    def __init__(self):
+        self.rilascio = threading.Event()
+        self.chiamate = 0
+        self._lock = threading.Lock()
+        self.chat = types.SimpleNamespace(completions=types.SimpleNamespace(create=self.create))
+
+    def create(self, model, messages, **kwargs):
+        with self._lock:
+            self.chiamate += 1
+            prima = self.chiamate == 1
+        if prima:
+            self.rilascio.wait(5)
+        uso = types.SimpleNamespace(prompt_tokens=100, completion_tokens=10, prompt_tokens_details=None)
+        scelta = types.SimpleNamespace(message=types.SimpleNamespace(content=json.dumps([])), finish_reason="stop")
+        return types.SimpleNamespace(choices=[scelta], usage=uso)
+
+
+def test_uso_della_richiesta_scartata_registrato():
+    politica = PoliticaChiamate(hedging=True)
+    for _ in range(CAMPIONI_MINIMI_HEDGING):
+        politica.registra_latenza("m/finto", 0.01)
+    client = ClientLento()
+    registro = RegistroChiamate()
+    risposta, errore = correggi_codice("int main(void) { return 0; }\n", "f: 5", None, "m/finto", client,
+                                       registro=registro, studente="anna", politica=politica)
+    assert errore is None and json.loads(risposta) == []
+    assert len(registro.chiamate) == 1
+
+    client.rilascio.set()
+    for _ in range(500):
+        if len(registro.chiamate) == 2:
+            break
+        time.sleep(0.01)
+    assert [record["prompt_tokens"] for record in registro.chiamate] == [100, 100]
+    assert all(record["studente"] == "anna" for record in registro.chiamate)
@@ -0,0 +1,42 @@
+import json
+
+from grading.streaming import ParserArrayJSONIncrementale
+
+ERRORI = [
+    {"line": "3", "criteria": "Parentesi } e ] in una \"stringa\"", "point_deduction": -1,
+     "inline_comment": "//******** {x[0]} -1"},
+    {"line": "7", "criteria": "Oggetto annidato", "dettagli": {"righe": [1, 2]}, "point_deduction": -0.5,
+     "inline_comment": "//******** annidato -0.5"},
+]
+
+
+def test_oggetti_restituiti_appena_completati():
+    parser = ParserArrayJSONIncrementale()
+    testo = "```json\n" + json.dumps(ERRORI) + "\n```"
+    fine_primo = testo.index("}, {") + 1
+    assert parser.feed(testo[:fine_primo - 1]) == []
+    assert parser.feed(testo[fine_primo - 1:fine_primo]) == [ERRORI[0]]
+    assert parser.feed(testo[fine_primo:]) == [ERRORI[1]]
+    assert parser.oggetti == ERRORI
+    assert parser.completato
+
+
+def test_frammenti_di_un_carattere():
+    parser = ParserArrayJSONIncrementale()
+    nuovi = []
+    for carattere in json.dumps(ERRORI, indent=2):
+        nuovi.extend(parser.feed(carattere))
+    assert nuovi == ERRORI
+
+
+def test_testo_prima_dell_array_e_dopo_la_chiusura_ignorato():
+    parser = ParserArrayJSONIncrementale()
+    parser.feed('Ecco gli errori {non json}: [{"line": "1"}] e poi [{"line": "2"}]')
+    assert parser.oggetti == [{"line": "1"}]
+    assert parser.completato
+
+
+def test_oggetto_malformato_saltato():
+    parser = ParserArrayJSONIncrementale()
+    assert parser.feed('[{"line": 1,}, {"line": "2"}') == [{"line": "2"}]
+    assert not parser.completato